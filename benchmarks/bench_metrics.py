@@ -0,0 +1,61 @@
+"""
+Накладные расходы инструментирования на один апдейт.
+
+    python -m benchmarks.bench_metrics [N]
+
+Сравнивает вызов хэндлера напрямую и через MetricsMiddleware (+ обёртку DB-метода),
+печатает разницу в микросекундах и падает, если она больше BUDGET_US.
+"""
+import asyncio
+import sys
+import time
+from types import SimpleNamespace
+
+from bot.metrics import Histogram, MetricsMiddleware
+
+BUDGET_US = 5.0
+
+
+async def _handler(event, data):
+    return None
+
+
+def _plain(x):
+    return x
+
+
+async def run(n: int) -> dict:
+    mw = MetricsMiddleware()
+    data = {"handler": SimpleNamespace(callback=_handler), "event_update": SimpleNamespace(update_id=1)}
+    timed = Histogram("bench_q", "bench", ("query",)).timed("q")(_plain)
+
+    t = time.perf_counter()
+    for _ in range(n):
+        await _handler(None, data)
+        _plain(1)
+    bare = time.perf_counter() - t
+
+    t = time.perf_counter()
+    for _ in range(n):
+        await mw(_handler, None, data)
+        timed(1)
+    wrapped = time.perf_counter() - t
+
+    return {
+        "n": n,
+        "bare_us": round(bare / n * 1e6, 3),
+        "instrumented_us": round(wrapped / n * 1e6, 3),
+        "overhead_us": round((wrapped - bare) / n * 1e6, 3),
+    }
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+    res = asyncio.run(run(n))
+    print(res)
+    if res["overhead_us"] > BUDGET_US:
+        sys.exit(f"overhead {res['overhead_us']} us > budget {BUDGET_US} us")
+
+
+if __name__ == "__main__":
+    main()
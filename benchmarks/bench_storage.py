@@ -0,0 +1,118 @@
+"""
+Байт на строку food_entries до и после упаковки разбора (bot.codec).
+
+    python -m benchmarks.bench_storage [N]      # по умолчанию N=1_000_000; полный прогон — 10_000_000
+
+Строит синтетическую таблицу в старом формате (parsed_json + REAL conf/err_*), меряет её страницы
+через dbstat, прогоняет ту же миграцию, что DB._init (pack_food_entries), VACUUM и меряет снова.
+Индексы и FTS не участвуют: они от формата разбора не зависят.
+Заодно оценивает zlib с общим словарём для text — в базе не применяется (text читают FTS и поиск).
+"""
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+import zlib
+
+from bot.db import pack_food_entries
+from bot.services.analyzer import analyze, apply_refinement, to_json
+
+LEGACY = """
+CREATE TABLE food_entries (
+  id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL, ts TEXT NOT NULL, text TEXT,
+  photo_file_id TEXT, parsed_json TEXT NOT NULL, kcal_low INTEGER NOT NULL, kcal_high INTEGER NOT NULL,
+  kcal_mid INTEGER NOT NULL, conf REAL NOT NULL, err_low REAL NOT NULL, err_high REAL NOT NULL
+)"""
+
+USERS = 20_000
+DISHES = ("курица с рисом", "омлет и кофе с молоком", "паста в сливочном соусе", "салат с сыром",
+          "суп и хлеб", "жареная картошка", "шаурма", "пицца", "йогурт", "рыба с овощами", "бургер",
+          "говядина с макаронами", "десерт", "гречка с котлетой", "творог с ягодами")
+PORTIONS = ("", " много", " немного", " большая порция", " чуть-чуть")
+REFINE = {"sauce": ("low", "mid", "high"), "oil": ("none", "little", "1tbsp"), "portion": ("small", "normal", "large")}
+
+
+def _pool(rnd: random.Random, n: int = 2000) -> list[tuple]:
+    out = []
+    for _ in range(n):
+        text = rnd.choice(DISHES) + rnd.choice(PORTIONS)
+        photo = rnd.random() < 0.3
+        ar = analyze(text, has_photo=photo, has_reference=rnd.random() < 0.05)
+        if ar.needs_refine and rnd.random() < 0.6:
+            ar = apply_refinement(ar, ar.refine_kind, rnd.choice(REFINE[ar.refine_kind]))
+        file_id = "AgACAgIAAxkBAAI" + "".join(rnd.choice("abcdefghijklmnopqrstuvwxyz0123456789_-") for _ in range(60))
+        out.append((None if photo and rnd.random() < 0.5 else text, file_id if photo else None, to_json(ar),
+                    ar.kcal_low, ar.kcal_high, ar.kcal_mid, ar.conf, ar.err_low, ar.err_high))
+    return out
+
+
+def fill(path: str, n: int, seed: int = 1):
+    rnd = random.Random(seed)
+    pool = _pool(rnd)
+    conn = sqlite3.connect(path)
+    conn.executescript("PRAGMA journal_mode=OFF; PRAGMA synchronous=OFF;" + LEGACY)
+
+    def rows():
+        for i in range(n):
+            p = pool[rnd.randrange(len(pool))]
+            uid = 1 + i % USERS
+            ts = f"2025-{1 + i // USERS % 12:02d}-{1 + i // (USERS * 12) % 28:02d}T{i % 24:02d}:{i % 60:02d}:00"
+            yield (uid, ts) + p
+
+    conn.executemany(
+        """INSERT INTO food_entries (user_id, ts, text, photo_file_id, parsed_json, kcal_low, kcal_high, kcal_mid,
+                                     conf, err_low, err_high) VALUES (?,?,?,?,?,?,?,?,?,?,?)""", rows())
+    conn.commit()
+    return conn
+
+
+def measure(conn: sqlite3.Connection, n: int, column: str) -> dict:
+    """Страницы таблицы (с заголовками и свободным местом), полезная нагрузка записей и сам столбец разбора."""
+    pages, payload = conn.execute(
+        "SELECT SUM(pgsize), SUM(payload) FROM dbstat WHERE name='food_entries'").fetchone()
+    col = conn.execute(f"SELECT SUM(length(CAST({column} AS BLOB))) FROM food_entries").fetchone()[0]
+    return {"bytes_per_row": round(pages / n, 1), "payload_per_row": round(payload / n, 1),
+            f"{column}_bytes": round(col / n, 1)}
+
+
+def text_zdict(conn: sqlite3.Connection, sample: int = 20_000) -> dict:
+    texts = [r[0].encode() for r in conn.execute(
+        "SELECT text FROM food_entries WHERE text IS NOT NULL LIMIT ?", (sample,))]
+    zdict = b" ".join(sorted(set(texts)))[-32768:]
+    plain = sum(map(len, texts))
+    packed = 0
+    for t in texts:
+        c = zlib.compressobj(9, zdict=zdict)
+        packed += len(c.compress(t) + c.flush())
+    return {"text_bytes": round(plain / len(texts), 1), "zlib_zdict_bytes": round(packed / len(texts), 1)}
+
+
+def run(n: int, directory: str) -> dict:
+    path = os.path.join(directory, "storage.db")
+    t = time.perf_counter()
+    conn = fill(path, n)
+    fill_s = time.perf_counter() - t
+    before = measure(conn, n, "parsed_json")
+    text = text_zdict(conn)
+
+    t = time.perf_counter()
+    pack_food_entries(conn)
+    migrate_s = time.perf_counter() - t
+    conn.execute("VACUUM")
+    after = measure(conn, n, "packed")
+    conn.close()
+    return {"rows": n, "fill_s": round(fill_s, 1), "migrate_s": round(migrate_s, 1),
+            "before": before, "after": after, "text": text,
+            "saved_per_row": round(before["bytes_per_row"] - after["bytes_per_row"], 1)}
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    with tempfile.TemporaryDirectory() as td:
+        print(run(n, td))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+"""
+Сквозной бенчмарк: production-Dispatcher из bot.main + FakeSession вместо Telegram.
+
+    python -m benchmarks.bench_throughput --users 200 --meals 10 --out bench.json
+    python -m benchmarks.bench_throughput --memory      # MemoryStorage: только логика, без диска
+
+Каждый синтетический пользователь проходит анкету, затем шлёт текстовые и фото-записи
+и жмёт кнопку уточнения. Апдейты идут через dp.feed_update, т.е. через DbUserMiddleware,
+фильтры, хэндлеры и хранилище. Итог: апдейты/сек, p50/p99 задержки, рост файла БД.
+"""
+from __future__ import annotations
+import argparse
+import asyncio
+import json
+import os
+import random
+import tempfile
+import time
+from datetime import datetime
+
+from aiogram import Bot
+from aiogram.types import Update
+
+from bot.config import Config
+from bot.db import DB
+from bot.fake_api import FakeSession
+from bot.main import build_dispatcher
+from bot.metrics import MetricsMiddleware
+from bot.outbox import Outbox
+from bot.storage import MemoryStorage
+
+CAPTIONS = [
+    "индейка в сливочном соусе, картошка, соуса мало",
+    "курица с рисом",
+    "омлет из двух яиц, хлеб",
+    "салат овощной с маслом",
+    "паста с сыром, порция большая",
+    "суп и хлеб",
+    "кофе с молоком",
+    "шаурма",
+    "пицца два куска",
+    "йогурт и орехи",
+]
+
+ONBOARDING = ["/start", "f", "32", "165", "62.5"]
+
+
+class UpdateFactory:
+    def __init__(self, bot: Bot):
+        self.bot = bot
+        self.update_id = 0
+        self.message_id = 0
+
+    def _next(self) -> tuple[int, int]:
+        self.update_id += 1
+        self.message_id += 1
+        return self.update_id, self.message_id
+
+    def _user(self, uid: int) -> dict:
+        return {"id": uid, "is_bot": False, "first_name": f"u{uid}"}
+
+    def message(self, uid: int, text: str | None = None, photo_caption: str | None = None) -> Update:
+        update_id, message_id = self._next()
+        msg = {"message_id": message_id, "date": int(time.time()),
+               "chat": {"id": uid, "type": "private"}, "from": self._user(uid)}
+        if photo_caption is not None:
+            msg["photo"] = [{"file_id": f"ph{message_id}", "file_unique_id": f"u{message_id}",
+                             "width": 800, "height": 600}]
+            msg["caption"] = photo_caption
+        else:
+            msg["text"] = text
+        return Update.model_validate({"update_id": update_id, "message": msg}, context={"bot": self.bot})
+
+    def callback(self, uid: int, data: str) -> Update:
+        update_id, message_id = self._next()
+        return Update.model_validate({"update_id": update_id, "callback_query": {
+            "id": str(update_id), "from": self._user(uid), "chat_instance": "bench", "data": data,
+            "message": {"message_id": message_id, "date": int(time.time()),
+                        "chat": {"id": uid, "type": "private"}, "from": self._user(uid), "text": "…"},
+        }}, context={"bot": self.bot})
+
+
+def _percentile(values: list[float], q: float) -> float:
+    if not values:
+        return 0.0
+    s = sorted(values)
+    return s[min(len(s) - 1, int(q * len(s)))]
+
+
+def _db_bytes(path: str) -> int:
+    return sum(os.path.getsize(p) for p in (path, path + "-wal") if os.path.exists(p))
+
+
+def _last_refine_callback(session: FakeSession, chat_id: int) -> str | None:
+    for name, params in reversed(session.calls):
+        if name == "sendMessage" and params.get("chat_id") == chat_id:
+            markup = params.get("reply_markup") or {}
+            for row in markup.get("inline_keyboard", []):
+                for button in row:
+                    if str(button.get("callback_data", "")).startswith("refine:"):
+                        return button["callback_data"]
+            return None
+    return None
+
+
+def _user_script(uid: int, meals: int, rnd: random.Random):
+    """Последовательность шагов одного пользователя; ("cb:last_refine", ...) разрешается на лету."""
+    steps = [("msg", t) for t in ONBOARDING]
+    steps += [("cb", "act:moderate"), ("cb", "goal:maintain")]
+    for i in range(meals):
+        caption = rnd.choice(CAPTIONS)
+        if i % 3 == 0:
+            steps.append(("photo", caption))
+            steps.append(("refine", None))
+        else:
+            steps.append(("msg", caption))
+    steps.append(("msg", "/today"))
+    return steps
+
+
+async def run(users: int, meals: int, concurrency: int, db_path: str, seed: int = 1, memory: bool = False) -> dict:
+    cfg = Config("1:BENCH", db_path, "Asia/Yerevan", set(), None, 300, 50, warmup=False, metrics_port=0)
+    db = MemoryStorage() if memory else DB(db_path)
+    session = FakeSession()
+    bot = Bot("42:BENCH", session=session)
+    # лимиты Telegram здесь не меряем: очередь есть, но не тормозит
+    outbox = Outbox(global_rate=1e9, chat_rate=1e9, chat_burst=1e9)
+    bot.session.middleware(outbox)
+    dp = build_dispatcher(cfg, db, outbox, MetricsMiddleware())
+    factory = UpdateFactory(bot)
+    rnd = random.Random(seed)
+
+    size_before = _db_bytes(db_path)
+    latencies: list[float] = []
+    sem = asyncio.Semaphore(concurrency)
+
+    async def feed(update: Update):
+        t = time.perf_counter()
+        await dp.feed_update(bot, update)
+        latencies.append(time.perf_counter() - t)
+
+    async def user_flow(uid: int):
+        async with sem:
+            for kind, arg in _user_script(uid, meals, rnd):
+                if kind == "msg":
+                    await feed(factory.message(uid, text=arg))
+                elif kind == "photo":
+                    await feed(factory.message(uid, photo_caption=arg))
+                elif kind == "cb":
+                    await feed(factory.callback(uid, arg))
+                elif kind == "refine":
+                    data = _last_refine_callback(session, uid)
+                    if data:
+                        await feed(factory.callback(uid, data))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(user_flow(10_000 + i) for i in range(users)))
+    elapsed = time.perf_counter() - started
+
+    await outbox.close()
+    db.close()
+    size_after = _db_bytes(db_path)
+
+    n = len(latencies)
+    return {
+        "at": datetime.utcnow().replace(microsecond=0).isoformat(),
+        "users": users,
+        "meals_per_user": meals,
+        "concurrency": concurrency,
+        "storage": "memory" if memory else "sqlite",
+        "updates": n,
+        "outgoing_calls": len(session.calls),
+        "seconds": round(elapsed, 3),
+        "updates_per_sec": round(n / elapsed, 1) if elapsed else None,
+        "latency_ms": {
+            "p50": round(_percentile(latencies, 0.50) * 1000, 3),
+            "p99": round(_percentile(latencies, 0.99) * 1000, 3),
+            "max": round(max(latencies) * 1000, 3) if latencies else 0.0,
+        },
+        "db_bytes": {"before": size_before, "after": size_after, "growth": size_after - size_before,
+                     "per_update": round((size_after - size_before) / n, 1) if n else None},
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--users", type=int, default=200)
+    ap.add_argument("--meals", type=int, default=10)
+    ap.add_argument("--concurrency", type=int, default=1)
+    ap.add_argument("--db", help="путь к БД (по умолчанию временный файл)")
+    ap.add_argument("--memory", action="store_true", help="хранилище в памяти вместо SQLite")
+    ap.add_argument("--out", help="куда записать JSON с результатом")
+    args = ap.parse_args()
+
+    with tempfile.TemporaryDirectory() as td:
+        db_path = args.db or os.path.join(td, "bench.db")
+        result = asyncio.run(run(args.users, args.meals, args.concurrency, db_path, memory=args.memory))
+
+    text = json.dumps(result, ensure_ascii=False, indent=2)
+    print(text)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,210 @@
+"""
+Микро-бенчмарки примитивов: analyze, apply_refinement, compute_targets и методы DB.
+
+    BENCH=1 pytest -q benchmarks/test_micro.py                  # сравнить с baseline.json
+    BENCH=1 BENCH_UPDATE=1 pytest -q benchmarks/test_micro.py   # перезаписать baseline
+
+Без BENCH=1 тесты пропускаются (обычный `pytest -q` их не гоняет).
+Время каждого примитива делится на время эталонного цикла чистого Python (калибровка),
+поэтому baseline переносим между машинами; тест падает, если отношение выросло
+больше чем на BENCH_TOLERANCE (по умолчанию 0.30 = +30%).
+БД на BENCH_ROWS записей (1M) строится один раз и кэшируется в BENCH_DB.
+"""
+from __future__ import annotations
+import json
+import os
+import random
+import tempfile
+import timeit
+from datetime import datetime, timedelta
+
+import pytest
+
+from bot import codec
+from bot.db import DB
+from bot.services.analyzer import BASE_KCAL, analyze, apply_refinement
+from bot.services.targets import compute_targets
+
+pytestmark = pytest.mark.skipif(os.getenv("BENCH") != "1", reason="micro-benchmarks: set BENCH=1")
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baseline.json")
+TOLERANCE = float(os.getenv("BENCH_TOLERANCE", "0.30"))
+ROWS = int(os.getenv("BENCH_ROWS", "1000000"))
+USERS = 10_000
+DAY = datetime(2024, 3, 15)
+
+_results: dict[str, dict] = {}
+
+
+def _calibrate() -> float:
+    def loop():
+        s = 0
+        for i in range(1000):
+            s += i * i
+        return s
+    return _best_ns(loop)
+
+
+def _best_ns(fn, repeat: int = 7) -> float:
+    timer = timeit.Timer(fn)
+    number, _ = timer.autorange()  # столько вызовов, чтобы замер шёл >= 0.2 с
+    return min(timer.repeat(repeat=repeat, number=number)) / number * 1e9
+
+
+def _captions(words: int, n: int = 50, seed: int = 7) -> list[str]:
+    rnd = random.Random(seed)
+    vocab = list(BASE_KCAL) + ["соус", "масло", "немного", "большая", "порция", "с", "и", "на", "обед"]
+    return [" ".join(rnd.choice(vocab) + "а" for _ in range(words)) for _ in range(n)]
+
+
+def _populate(db: DB, rows: int):
+    have = db.conn.execute("SELECT COUNT(*) FROM food_entries").fetchone()[0]
+    if have >= rows:
+        return
+    now = DAY.isoformat()
+    db.conn.executemany(
+        "INSERT OR IGNORE INTO users(tg_id, chat_id, created_at, status) VALUES (?,?,?, 'active')",
+        ((100_000 + i, 100_000 + i, now) for i in range(USERS)),
+    )
+    rnd = random.Random(1)
+    texts = _captions(6, n=200)
+    start = DAY - timedelta(days=365)
+    step = timedelta(days=365) / max(1, rows // USERS)  # записи каждого пользователя равномерно за год
+
+    def gen():
+        for i in range(have, rows):
+            uid = 1 + i % USERS
+            ts = (start + step * (i // USERS) + timedelta(minutes=uid % 600)).isoformat()
+            mid = rnd.randint(100, 900)
+            yield (uid, ts, texts[i % len(texts)], packed, int(mid * 0.8), int(mid * 1.2), mid)
+
+    packed = codec.pack("{}", 0.6, 0.2, 0.3)
+    db.conn.executemany(
+        """INSERT INTO food_entries (user_id, ts, text, packed, kcal_low, kcal_high, kcal_mid)
+           VALUES (?,?,?,?,?,?,?)""", gen())
+    db.conn.commit()
+    db.conn.execute("ANALYZE")
+
+
+@pytest.fixture(scope="session")
+def calibration():
+    return _calibrate()
+
+
+@pytest.fixture(scope="session")
+def baseline(calibration):
+    data = {}
+    if os.path.exists(BASELINE_PATH):
+        with open(BASELINE_PATH, encoding="utf-8") as f:
+            data = json.load(f)
+    yield data.get("primitives", {})
+    if os.getenv("BENCH_UPDATE") == "1" and _results:
+        merged = dict(data.get("primitives", {}))
+        merged.update(_results)
+        out = {"calibration_ns": round(calibration, 1), "rows": ROWS, "primitives": dict(sorted(merged.items()))}
+        with open(BASELINE_PATH, "w", encoding="utf-8") as f:
+            json.dump(out, f, ensure_ascii=False, indent=2)
+            f.write("\n")
+
+
+@pytest.fixture(scope="session")
+def bench_db():
+    path = os.getenv("BENCH_DB") or os.path.join(tempfile.gettempdir(), f"calories_bench_{ROWS}.db")
+    db = DB(path)
+    _populate(db, ROWS)
+    yield db
+    db.close()
+
+
+def _check(name: str, ns: float, calibration: float, baseline: dict):
+    rel = ns / calibration
+    _results[name] = {"ns": round(ns, 1), "rel": round(rel, 4)}
+    ref = baseline.get(name)
+    if ref is None or os.getenv("BENCH_UPDATE") == "1":
+        return
+    limit = ref["rel"] * (1 + TOLERANCE)
+    assert rel <= limit, (
+        f"{name}: {ns:.0f} ns ({rel:.3f}× калибровки) > baseline {ref['rel']:.3f}× + {TOLERANCE:.0%}"
+    )
+
+
+@pytest.mark.parametrize("words", [3, 15, 80])
+def test_analyze(words, calibration, baseline):
+    corpus = _captions(words)
+    it = iter(range(10**12))
+
+    def call():
+        analyze(corpus[next(it) % len(corpus)], has_photo=True)
+
+    _check(f"analyze[{words}w]", _best_ns(call), calibration, baseline)
+
+
+@pytest.mark.parametrize("kind,val", [("sauce", "high"), ("oil", "none"), ("portion", "large")])
+def test_apply_refinement(kind, val, calibration, baseline):
+    ar = analyze("индейка в сливочном соусе, картошка, жареная", has_photo=True)
+    _check(f"apply_refinement[{kind}]", _best_ns(lambda: apply_refinement(ar, kind, val)), calibration, baseline)
+
+
+def test_compute_targets(calibration, baseline):
+    ns = _best_ns(lambda: compute_targets("f", 32, 165, 62.5, "moderate", "lose"))
+    _check("compute_targets", ns, calibration, baseline)
+
+
+def test_db_get_or_create_user_cached(bench_db, calibration, baseline):
+    bench_db.get_or_create_user(100_001, 100_001, "trial")
+    ns = _best_ns(lambda: bench_db.get_or_create_user(100_001, 100_001, "trial"))
+    _check("db.get_or_create_user[cached]", ns, calibration, baseline)
+
+
+def test_db_get_or_create_user_cold(bench_db, calibration, baseline):
+    def call():
+        bench_db.users.clear()
+        bench_db.get_or_create_user(100_002, 100_002, "trial")
+    _check("db.get_or_create_user[cold]", _best_ns(call), calibration, baseline)
+
+
+def test_db_get_food_entry(bench_db, calibration, baseline):
+    rnd = random.Random(3)
+    ids = [rnd.randint(1, ROWS) for _ in range(1000)]
+    it = iter(range(10**12))
+
+    def call():
+        eid = ids[next(it) % len(ids)]
+        bench_db.get_food_entry(eid, 1 + (eid - 1) % USERS)
+
+    _check("db.get_food_entry", _best_ns(call), calibration, baseline)
+
+
+def test_db_today_kcal_sum(bench_db, calibration, baseline):
+    it = iter(range(10**12))
+
+    def call():
+        bench_db.today_kcal_sum(1 + next(it) % USERS, DAY)
+
+    _check("db.today_kcal_sum", _best_ns(call), calibration, baseline)
+
+
+def test_db_get_targets(bench_db, calibration, baseline):
+    bench_db.upsert_targets(1, 1800, 110, 25)
+    _check("db.get_targets[cached]", _best_ns(lambda: bench_db.get_targets(1)), calibration, baseline)
+
+
+def test_db_meta_roundtrip(bench_db, calibration, baseline):
+    def call():
+        bench_db.set_meta(1, "bench", "1")
+        bench_db.get_meta(1, "bench")
+    _check("db.meta[set+get]", _best_ns(call), calibration, baseline)
+
+
+def test_db_add_food_entry(bench_db, calibration, baseline):
+    ts = DAY.isoformat()
+
+    def call():
+        bench_db.add_food_entry(USERS, ts, "курица с рисом", None, "{}", 400, 600, 500, 0.6, 0.2, 0.3)
+
+    timer = timeit.Timer(call)
+    # вставки растят таблицу, поэтому фиксированное число вызовов, а не autorange
+    ns = min(timer.repeat(repeat=5, number=200)) / 200 * 1e9
+    bench_db.conn.execute("DELETE FROM food_entries WHERE user_id=? AND ts=?", (USERS, ts))
+    bench_db.conn.commit()
+    _check("db.add_food_entry", ns, calibration, baseline)
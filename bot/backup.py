@@ -0,0 +1,228 @@
+"""
+Онлайн-бэкапы SQLite: sqlite3 backup API мелкими шагами в отдельном потоке, бот пишет дальше.
+
+    python -m bot.backup now  /data/bot.db /data/backups      # снять снимок сейчас
+    python -m bot.backup list /data/backups
+    python -m bot.backup verify /data/backups/bot-20260101-030000.db.gz
+    python -m bot.backup restore /data/backups/bot-20260101-030000.db.gz /data/bot.db --force
+
+Снимок: копия страниц в .tmp -> PRAGMA integrity_check -> gzip -> sha256 рядом (.sha256).
+restore — только при остановленном боте: проверяет контрольную сумму и integrity_check,
+затем атомарно подменяет файл базы и убирает её -wal/-shm.
+"""
+from __future__ import annotations
+import argparse
+import asyncio
+import gzip
+import hashlib
+import logging
+import os
+import shutil
+import sqlite3
+import sys
+import time
+from datetime import datetime
+
+from bot.metrics import REGISTRY
+
+log = logging.getLogger(__name__)
+
+STEP_PAGES = 256        # ~1 МБ при странице 4 КБ: блокировка чтения на шаг — миллисекунды
+STEP_SLEEP_S = 0.005    # пауза между шагами
+MAX_RESTARTS = 5        # дальше — копия одним шагом (в WAL это только снимок чтения, писатель не ждёт)
+PREFIX = "bot-"
+SUFFIX = ".db.gz"
+
+BACKUP_SECONDS = REGISTRY.histogram("bot_backup_seconds", "Backup duration", (),
+                                    buckets=(0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300))
+BACKUP_BYTES = REGISTRY.gauge("bot_backup_bytes", "Last backup size", ("kind",))   # db | gz
+BACKUP_LAST_OK = REGISTRY.gauge("bot_backup_last_success_timestamp", "Unix time of the last good backup")
+BACKUP_FAILURES = REGISTRY.counter("bot_backup_failures_total", "Failed backups")
+BACKUP_RESTARTS = REGISTRY.counter("bot_backup_restarts_total", "Backup copies restarted by concurrent writes")
+
+
+def _sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _integrity(path: str) -> str:
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        return conn.execute("PRAGMA integrity_check").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def list_backups(directory: str) -> list[str]:
+    """Снимки от старых к новым (имя содержит время)."""
+    if not os.path.isdir(directory):
+        return []
+    names = sorted(n for n in os.listdir(directory) if n.startswith(PREFIX) and n.endswith(SUFFIX))
+    return [os.path.join(directory, n) for n in names]
+
+
+def rotate(directory: str, keep: int) -> list[str]:
+    removed = []
+    for path in list_backups(directory)[:-keep] if keep > 0 else []:
+        for p in (path, path + ".sha256"):
+            if os.path.exists(p):
+                os.unlink(p)
+        removed.append(path)
+    return removed
+
+
+class _TooBusy(Exception):
+    pass
+
+
+def backup(db_path: str, directory: str, keep: int = 7, step_pages: int = STEP_PAGES,
+           step_sleep: float = STEP_SLEEP_S) -> dict:
+    """
+    Синхронно (для потока). Своё соединение с источником: между шагами backup писатель бота работает
+    как обычно, а если он что-то изменил — SQLite сам начинает копирование заново (считаем restarts).
+    """
+    os.makedirs(directory, exist_ok=True)
+    started = time.perf_counter()
+    name = PREFIX + datetime.utcnow().strftime("%Y%m%d-%H%M%S")
+    tmp = os.path.join(directory, name + ".db.tmp")
+    out = os.path.join(directory, name + SUFFIX)
+    restarts = 0
+    last_remaining = None
+
+    def progress(status, remaining, total):
+        nonlocal restarts, last_remaining
+        if last_remaining is not None and remaining > last_remaining:
+            restarts += 1
+            if restarts > MAX_RESTARTS:
+                raise _TooBusy
+        last_remaining = remaining
+
+    try:
+        src = sqlite3.connect(db_path, timeout=30)
+        dst = sqlite3.connect(tmp)
+        try:
+            try:
+                src.backup(dst, pages=step_pages, progress=progress, sleep=step_sleep)
+            except _TooBusy:
+                src.backup(dst, pages=-1)
+            # копия самодостаточна: без WAL, одним файлом
+            dst.execute("PRAGMA journal_mode=DELETE")
+        finally:
+            dst.close()
+            src.close()
+
+        check = _integrity(tmp)
+        if check != "ok":
+            raise RuntimeError(f"integrity_check: {check}")
+
+        db_bytes = os.path.getsize(tmp)
+        with open(tmp, "rb") as f, gzip.open(out + ".part", "wb", compresslevel=6) as g:
+            shutil.copyfileobj(f, g, 1 << 20)
+        os.replace(out + ".part", out)
+        with open(out + ".sha256", "w") as f:
+            f.write(f"{_sha256(out)}  {os.path.basename(out)}\n")
+    except Exception:
+        BACKUP_FAILURES.inc()
+        for p in (out + ".part", out):
+            if os.path.exists(p):
+                os.unlink(p)
+        raise
+    finally:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+
+    seconds = time.perf_counter() - started
+    gz_bytes = os.path.getsize(out)
+    BACKUP_SECONDS.observe(seconds)
+    BACKUP_BYTES.set(db_bytes, "db")
+    BACKUP_BYTES.set(gz_bytes, "gz")
+    BACKUP_LAST_OK.set(time.time())
+    if restarts:
+        BACKUP_RESTARTS.inc(amount=restarts)
+    removed = rotate(directory, keep)
+    log.info("backup %s: %d -> %d bytes in %.1f s, restarts %d, rotated %d",
+             out, db_bytes, gz_bytes, seconds, restarts, len(removed))
+    return {"path": out, "db_bytes": db_bytes, "gz_bytes": gz_bytes, "seconds": round(seconds, 3),
+            "restarts": restarts, "removed": removed}
+
+
+async def run_backup(db_path: str, directory: str, keep: int = 7) -> int:
+    """Для планировщика: копирование и сжатие — в потоке. Возвращает размер снимка в байтах."""
+    res = await asyncio.to_thread(backup, db_path, directory, keep)
+    return res["gz_bytes"]
+
+
+def verify(path: str) -> str:
+    """'ok' или описание проблемы: контрольная сумма, потом integrity_check распакованной копии."""
+    sums = path + ".sha256"
+    if os.path.exists(sums):
+        with open(sums) as f:
+            expected = f.read().split()[0]
+        if _sha256(path) != expected:
+            return "sha256 mismatch"
+    tmp = path + ".verify"
+    try:
+        with gzip.open(path, "rb") as g, open(tmp, "wb") as f:
+            shutil.copyfileobj(g, f, 1 << 20)
+        return _integrity(tmp)
+    except (OSError, EOFError, sqlite3.DatabaseError) as e:
+        return f"unreadable: {e}"
+    finally:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+
+
+def restore(path: str, db_path: str, force: bool = False):
+    if os.path.exists(db_path) and not force:
+        raise FileExistsError(f"{db_path} exists; stop the bot and pass --force")
+    check = verify(path)
+    if check != "ok":
+        raise RuntimeError(f"{path}: {check}")
+    tmp = db_path + ".restore"
+    with gzip.open(path, "rb") as g, open(tmp, "wb") as f:
+        shutil.copyfileobj(g, f, 1 << 20)
+    # старый WAL относится к старому файлу — применять его к восстановленному нельзя
+    for p in (db_path + "-wal", db_path + "-shm"):
+        if os.path.exists(p):
+            os.unlink(p)
+    os.replace(tmp, db_path)
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("now", help="снять снимок")
+    p.add_argument("db")
+    p.add_argument("dir")
+    p.add_argument("--keep", type=int, default=7)
+    p = sub.add_parser("list", help="снимки в каталоге")
+    p.add_argument("dir")
+    p = sub.add_parser("verify", help="проверить снимок")
+    p.add_argument("path")
+    p = sub.add_parser("restore", help="восстановить базу из снимка (бот должен быть остановлен)")
+    p.add_argument("path")
+    p.add_argument("db")
+    p.add_argument("--force", action="store_true", help="перезаписать существующий файл базы")
+    args = ap.parse_args()
+
+    if args.cmd == "now":
+        res = backup(args.db, args.dir, args.keep)
+        print(f"{res['path']}: {res['db_bytes']} -> {res['gz_bytes']} bytes, {res['seconds']} s")
+    elif args.cmd == "list":
+        for path in list_backups(args.dir):
+            print(f"{path}\t{os.path.getsize(path)}")
+    elif args.cmd == "verify":
+        check = verify(args.path)
+        print(check)
+        sys.exit(0 if check == "ok" else 1)
+    elif args.cmd == "restore":
+        restore(args.path, args.db, args.force)
+        print(f"restored {args.db} from {args.path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+Компактное хранение разбора записи (food_entries.packed) вместо parsed_json + трёх REAL.
+
+v1 (байты):  1 | флаги | conf | err_low | err_high | n | id компонентов… | m | id суффиксов note…
+  флаги: биты 0–2 — начало note (NOTE_BASES), 3 — has_reference, 4 — needs_refine, 5–6 — refine_kind
+  conf/err — в сотых (0..255): столько знаков analyzer и даёт, точнее оценка всё равно не бывает.
+v0 (запасной): 0 | conf, err_low, err_high как double | parsed_json как есть (UTF-8).
+
+note не хранится: собирается из начала (описание/фото/референс/импорт) и суффиксов « | уточнение:…».
+pack() проверяет, что unpack() вернёт ровно тот же parsed_json, иначе пишет v0 — разбор не теряется никогда.
+"""
+from __future__ import annotations
+import json
+import struct
+from typing import Optional
+
+# индексы хранятся в базе: только дописывать в конец, не переставлять
+COMPONENTS = (
+    "индейк", "куриц", "рыб", "говя", "свини", "яйц", "омлет", "карто", "рис", "паста", "макарон", "салат",
+    "овощ", "сыр", "хлеб", "кофе", "молок", "йогур", "суп", "десерт", "пицц", "бургер", "шаур", "блюдо",
+)
+NOTE_BASES = (
+    "Оценка по описанию", "Оценка по описанию + фото", "Оценка по описанию, с референсом",
+    "Оценка по описанию + фото, с референсом", "импорт",
+)
+NOTE_SUFFIXES = (
+    "импорт",
+    "уточнение:sauce:low", "уточнение:sauce:mid", "уточнение:sauce:high",
+    "уточнение:oil:none", "уточнение:oil:little", "уточнение:oil:1tbsp",
+    "уточнение:portion:small", "уточнение:portion:normal", "уточнение:portion:large",
+)
+REFINE_KINDS = (None, "sauce", "oil", "portion")
+KEYS = ("components", "note", "needs_refine", "refine_kind", "has_reference")
+
+_COMPONENT_ID = {c: i for i, c in enumerate(COMPONENTS)}
+_BASE_ID = {b: i for i, b in enumerate(NOTE_BASES)}
+_SUFFIX_ID = {s: i for i, s in enumerate(NOTE_SUFFIXES)}
+_KIND_ID = {k: i for i, k in enumerate(REFINE_KINDS)}
+_V0 = struct.Struct("<ddd")
+
+
+def _q(x: float) -> Optional[int]:
+    q = int(round(x * 100))
+    return q if 0 <= q <= 255 else None
+
+
+def _dump(components, note, needs_refine, refine_kind, has_reference) -> str:
+    # тот же вид, что analyzer.to_json
+    return json.dumps({"components": components, "note": note, "needs_refine": needs_refine,
+                       "refine_kind": refine_kind, "has_reference": has_reference}, ensure_ascii=False)
+
+
+def _pack_v1(parsed_json: str, conf: float, err_low: float, err_high: float) -> Optional[bytes]:
+    try:
+        meta = json.loads(parsed_json)
+    except ValueError:
+        return None
+    if not isinstance(meta, dict) or tuple(meta) != KEYS:
+        return None
+    comps, note = meta["components"], meta["note"]
+    if not isinstance(comps, list) or not isinstance(note, str) or len(comps) > 255:
+        return None
+    base, *suffixes = note.split(" | ")
+    try:
+        comp_ids = [_COMPONENT_ID[c] for c in comps]
+        suffix_ids = [_SUFFIX_ID[s] for s in suffixes]
+        flags = (_BASE_ID[base] | bool(meta["has_reference"]) << 3 | bool(meta["needs_refine"]) << 4
+                 | _KIND_ID[meta["refine_kind"]] << 5)
+    except (KeyError, TypeError):
+        return None
+    q = [_q(conf), _q(err_low), _q(err_high)]
+    if None in q or len(suffix_ids) > 255:
+        return None
+    return bytes([1, flags, *q, len(comp_ids), *comp_ids, len(suffix_ids), *suffix_ids])
+
+
+def pack(parsed_json: str, conf: float, err_low: float, err_high: float) -> bytes:
+    blob = _pack_v1(parsed_json, conf, err_low, err_high)
+    if blob is not None and unpack(blob)[0] == parsed_json:
+        return blob
+    return b"\x00" + _V0.pack(conf, err_low, err_high) + parsed_json.encode("utf-8")
+
+
+def unpack(blob: bytes) -> tuple[str, float, float, float]:
+    """(parsed_json, conf, err_low, err_high)."""
+    if blob[0] == 0:
+        conf, err_low, err_high = _V0.unpack_from(blob, 1)
+        return bytes(blob[1 + _V0.size:]).decode("utf-8"), conf, err_low, err_high
+    flags, conf, err_low, err_high, n = blob[1:6]
+    comps = [COMPONENTS[i] for i in blob[6:6 + n]]
+    m = blob[6 + n]
+    note = " | ".join([NOTE_BASES[flags & 7]] + [NOTE_SUFFIXES[i] for i in blob[7 + n:7 + n + m]])
+    parsed = _dump(comps, note, bool(flags & 16), REFINE_KINDS[flags >> 5 & 3], bool(flags & 8))
+    return parsed, conf / 100, err_low / 100, err_high / 100
+
+
+def entry_row(row) -> dict:
+    """Строка food_entries в прежнем виде: packed раскрывается в parsed_json, conf, err_low, err_high."""
+    d = dict(row)
+    d["parsed_json"], d["conf"], d["err_low"], d["err_high"] = unpack(d.pop("packed"))
+    return d
@@ -10,6 +10,29 @@ class Config:
     provider_token: str | None
     price_rub: int
     discount_percent: int
+    warmup: bool = True
+    metrics_host: str = "127.0.0.1"
+    metrics_port: int = 9108                     # 0 — не поднимать /metrics
+    admin_ids: frozenset[int] = frozenset()
+    db_profile_ms: float | None = None           # порог медленного запроса; None — профилирование выключено
+    record_updates: str | None = None            # путь .jsonl.gz для записи апдейтов; None — не писать
+    record_salt: str | None = None               # соль псевдонимизации; без неё — случайная на запуск
+    backup_dir: str | None = None                # каталог снимков; None — рядом с базой, в backups/
+    backup_hours: float = 6.0                    # 0 — не снимать
+    backup_keep: int = 7
+    chart_weekly: bool = False                   # по понедельникам слать график за неделю
+
+
+def _parse_ids(raw: str) -> set[int]:
+    ids = set()
+    for x in raw.split(","):
+        x = x.strip()
+        if x:
+            try:
+                ids.add(int(x))
+            except ValueError:
+                pass
+    return ids
 
 def load_config() -> Config:
     token = os.getenv("BOT_TOKEN", "").strip()
@@ -17,20 +40,23 @@ def load_config() -> Config:
         raise RuntimeError("BOT_TOKEN is required")
     db_path = os.getenv("DB_PATH", "bot.db").strip()
     tz = os.getenv("TZ", "Asia/Yerevan").strip()
-    wl_raw = os.getenv("BETA_WHITELIST", "").strip()
-    wl = set()
-    if wl_raw:
-        for x in wl_raw.split(","):
-            x = x.strip()
-            if x:
-                try:
-                    wl.add(int(x))
-                except ValueError:
-                    pass
+    wl = _parse_ids(os.getenv("BETA_WHITELIST", ""))
 
     provider_token = os.getenv("PROVIDER_TOKEN", "").strip() or None
     price_rub = int(os.getenv("PRICE_RUB", "300").strip())
     discount_percent = int(os.getenv("REF_DISCOUNT_PERCENT", "50").strip())
+    warmup = os.getenv("WARMUP", "1").strip() not in ("0", "false", "no")
+    metrics_host = os.getenv("METRICS_HOST", "127.0.0.1").strip()
+    metrics_port = int(os.getenv("METRICS_PORT", "9108").strip() or 0)
+    admin_ids = frozenset(_parse_ids(os.getenv("ADMIN_IDS", "")))
+    profile_raw = os.getenv("DB_PROFILE_MS", "").strip()
+    db_profile_ms = float(profile_raw) if profile_raw else None
+    record_updates = os.getenv("RECORD_UPDATES", "").strip() or None
+    record_salt = os.getenv("RECORD_SALT", "").strip() or None
+    backup_dir = os.getenv("BACKUP_DIR", "").strip() or None
+    backup_hours = float(os.getenv("BACKUP_HOURS", "6").strip() or 0)
+    backup_keep = int(os.getenv("BACKUP_KEEP", "7").strip() or 7)
+    chart_weekly = os.getenv("CHART_WEEKLY", "0").strip() in ("1", "true", "yes")
     return Config(
         bot_token=token,
         db_path=db_path,
@@ -39,4 +65,15 @@ def load_config() -> Config:
         provider_token=provider_token,
         price_rub=price_rub,
         discount_percent=discount_percent,
+        warmup=warmup,
+        metrics_host=metrics_host,
+        metrics_port=metrics_port,
+        admin_ids=admin_ids,
+        db_profile_ms=db_profile_ms,
+        record_updates=record_updates,
+        record_salt=record_salt,
+        backup_dir=backup_dir,
+        backup_hours=backup_hours,
+        backup_keep=backup_keep,
+        chart_weekly=chart_weekly,
     )
@@ -1,10 +1,20 @@
 from __future__ import annotations
+import json
 import os
 import sqlite3
+import time
+from contextlib import contextmanager
 from dataclasses import dataclass
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 from typing import Optional
 
+from bot import codec
+from bot.cache import LRUCache
+from bot.profiling import ProfilingConnection
+
+# увеличивать при любом изменении SCHEMA/миграций в _init, иначе старые базы их не получат
+SCHEMA_VERSION = 10
+
 SCHEMA = """
 PRAGMA journal_mode=WAL;
 
@@ -16,9 +26,14 @@ CREATE TABLE IF NOT EXISTS users (
   status TEXT NOT NULL DEFAULT 'trial',         -- beta|trial|active|expired
   trial_start TEXT,
   trial_end TEXT,
-  paid_until TEXT
+  paid_until TEXT,
+  tz TEXT,                                      -- IANA, NULL = TZ из конфига
+  summary_day TEXT                              -- локальная дата последнего итога дня
 );
 
+CREATE INDEX IF NOT EXISTS idx_users_status_trial_end ON users(status, trial_end);
+CREATE INDEX IF NOT EXISTS idx_users_status_paid_until ON users(status, paid_until);
+
 CREATE TABLE IF NOT EXISTS profiles (
   user_id INTEGER PRIMARY KEY,
   sex TEXT NOT NULL,                           -- f|m
@@ -39,6 +54,7 @@ CREATE TABLE IF NOT EXISTS daily_targets (
   protein_g INTEGER NOT NULL,
   fiber_g INTEGER NOT NULL,
   updated_at TEXT NOT NULL,
+  formula_version INTEGER,                     -- targets.FORMULA_VERSION; NULL = до версионирования
   FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE
 );
 
@@ -48,16 +64,15 @@ CREATE TABLE IF NOT EXISTS food_entries (
   ts TEXT NOT NULL,
   text TEXT,
   photo_file_id TEXT,
-  parsed_json TEXT NOT NULL,
+  packed BLOB NOT NULL,                         -- bot.codec: разбор, conf, err_low, err_high
   kcal_low INTEGER NOT NULL,
   kcal_high INTEGER NOT NULL,
   kcal_mid INTEGER NOT NULL,
-  conf REAL NOT NULL,
-  err_low REAL NOT NULL,
-  err_high REAL NOT NULL,
   FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE
 );
 
+CREATE INDEX IF NOT EXISTS idx_food_entries_user_ts ON food_entries(user_id, ts);
+
 CREATE TABLE IF NOT EXISTS promo_codes (
   user_id INTEGER PRIMARY KEY,
   code TEXT NOT NULL UNIQUE,
@@ -77,6 +92,31 @@ CREATE TABLE IF NOT EXISTS referrals (
   FOREIGN KEY(referred_user_id) REFERENCES users(id)
 );
 
+-- успешные оплаты; ключ — telegram_payment_charge_id, повторная доставка того же платежа ничего не меняет
+CREATE TABLE IF NOT EXISTS payments (
+  charge_id TEXT PRIMARY KEY,
+  provider_charge_id TEXT,
+  user_id INTEGER NOT NULL,
+  amount INTEGER NOT NULL,                      -- в минимальных единицах (копейки)
+  currency TEXT NOT NULL,
+  payload TEXT,
+  paid_until TEXT NOT NULL,                     -- срок доступа после этой оплаты
+  created_at TEXT NOT NULL,
+  FOREIGN KEY(user_id) REFERENCES users(id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_payments_user ON payments(user_id);
+
+-- счётчики реферера: ведутся в тех же транзакциях, что referrals/reward_ledger; сверка — rebuild_referral_stats
+CREATE TABLE IF NOT EXISTS referral_stats (
+  user_id INTEGER PRIMARY KEY,
+  invited INTEGER NOT NULL DEFAULT 0,
+  paid INTEGER NOT NULL DEFAULT 0,
+  reward_days INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE INDEX IF NOT EXISTS idx_referral_stats_rank ON referral_stats(paid DESC, invited DESC);
+
 CREATE TABLE IF NOT EXISTS reward_ledger (
   id INTEGER PRIMARY KEY AUTOINCREMENT,
   user_id INTEGER NOT NULL,
@@ -94,8 +134,180 @@ CREATE TABLE IF NOT EXISTS user_meta (
   PRIMARY KEY (user_id, key),
   FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE
 );
+
+CREATE TABLE IF NOT EXISTS weight_log (
+  user_id INTEGER NOT NULL,
+  day TEXT NOT NULL,                            -- локальная дата
+  weight_kg REAL NOT NULL,
+  PRIMARY KEY (user_id, day)
+) WITHOUT ROWID;
+
+-- состояние адаптивного TDEE (services/tdee.py): несколько чисел на пользователя
+CREATE TABLE IF NOT EXISTS tdee_state (
+  user_id INTEGER PRIMARY KEY,
+  weight REAL,
+  weight_slope REAL NOT NULL DEFAULT 0,
+  weight_day TEXT,
+  weight_n INTEGER NOT NULL DEFAULT 0,
+  intake REAL,
+  intake_day TEXT,
+  intake_n INTEGER NOT NULL DEFAULT 0,
+  first_day TEXT,
+  FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE
+);
+
+-- полнотекстовый индекс по food_entries.text (external content: текст хранится один раз).
+-- user_id тоже индексируется: запрос «user_id:"N" AND text:(...)» пересекает списки, а не фильтрует всё
+CREATE VIRTUAL TABLE IF NOT EXISTS food_fts USING fts5(
+  text, user_id, content='food_entries', content_rowid='id',
+  tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+);
+
+CREATE TRIGGER IF NOT EXISTS food_fts_ai AFTER INSERT ON food_entries BEGIN
+  INSERT INTO food_fts(rowid, text, user_id) VALUES (new.id, new.text, new.user_id);
+END;
+CREATE TRIGGER IF NOT EXISTS food_fts_ad AFTER DELETE ON food_entries BEGIN
+  INSERT INTO food_fts(food_fts, rowid, text, user_id) VALUES ('delete', old.id, old.text, old.user_id);
+END;
+CREATE TRIGGER IF NOT EXISTS food_fts_au AFTER UPDATE OF text, user_id ON food_entries BEGIN
+  INSERT INTO food_fts(food_fts, rowid, text, user_id) VALUES ('delete', old.id, old.text, old.user_id);
+  INSERT INTO food_fts(rowid, text, user_id) VALUES (new.id, new.text, new.user_id);
+END;
+
+-- частые блюда пользователя: ведётся в add_food_entry, не больше FREQUENT_MAX строк на пользователя
+CREATE TABLE IF NOT EXISTS frequent_meals (
+  user_id INTEGER NOT NULL,
+  norm_text TEXT NOT NULL,                      -- normalize_meal(text)
+  entry_id INTEGER NOT NULL,                    -- последняя запись с этим текстом (её разбор и копируем)
+  cnt INTEGER NOT NULL,
+  last_ts TEXT NOT NULL,
+  PRIMARY KEY (user_id, norm_text)
+) WITHOUT ROWID;
+
+-- сводки по дням / неделям (ключ — понедельник) / месяцам (YYYY-MM), день — UTC-дата ts.
+-- Ведутся в add_food_entry/update_food_entry; days — сколько дней с записями внутри недели/месяца
+CREATE TABLE IF NOT EXISTS food_daily (
+  user_id INTEGER NOT NULL,
+  day TEXT NOT NULL,
+  n INTEGER NOT NULL,
+  kcal_low INTEGER NOT NULL,
+  kcal_mid INTEGER NOT NULL,
+  kcal_high INTEGER NOT NULL,
+  PRIMARY KEY (user_id, day)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS food_weekly (
+  user_id INTEGER NOT NULL,
+  week TEXT NOT NULL,
+  n INTEGER NOT NULL,
+  days INTEGER NOT NULL,
+  kcal_low INTEGER NOT NULL,
+  kcal_mid INTEGER NOT NULL,
+  kcal_high INTEGER NOT NULL,
+  PRIMARY KEY (user_id, week)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS food_monthly (
+  user_id INTEGER NOT NULL,
+  month TEXT NOT NULL,
+  n INTEGER NOT NULL,
+  days INTEGER NOT NULL,
+  kcal_low INTEGER NOT NULL,
+  kcal_mid INTEGER NOT NULL,
+  kcal_high INTEGER NOT NULL,
+  PRIMARY KEY (user_id, month)
+) WITHOUT ROWID;
 """
 
+ROLLUP_BACKFILL = """
+INSERT INTO food_daily (user_id, day, n, kcal_low, kcal_mid, kcal_high)
+  SELECT user_id, substr(ts, 1, 10), COUNT(*), SUM(kcal_low), SUM(kcal_mid), SUM(kcal_high)
+  FROM food_entries GROUP BY user_id, substr(ts, 1, 10);
+INSERT INTO food_weekly (user_id, week, n, days, kcal_low, kcal_mid, kcal_high)
+  SELECT user_id, date(day, 'weekday 0', '-6 days'), SUM(n), COUNT(*), SUM(kcal_low), SUM(kcal_mid), SUM(kcal_high)
+  FROM food_daily GROUP BY user_id, date(day, 'weekday 0', '-6 days');
+INSERT INTO food_monthly (user_id, month, n, days, kcal_low, kcal_mid, kcal_high)
+  SELECT user_id, substr(day, 1, 7), SUM(n), COUNT(*), SUM(kcal_low), SUM(kcal_mid), SUM(kcal_high)
+  FROM food_daily GROUP BY user_id, substr(day, 1, 7);
+"""
+
+# счётчики рефереров с нуля, по referrals и reward_ledger
+REFERRAL_STATS_SQL = """
+SELECT r.referrer_user_id AS user_id, COUNT(*) AS invited,
+       SUM(r.status IN ('paid', 'rewarded') OR r.first_payment_at IS NOT NULL) AS paid,
+       COALESCE((SELECT SUM(l.days) FROM reward_ledger l
+                 WHERE l.user_id = r.referrer_user_id AND l.reason LIKE 'referral:%'), 0) AS reward_days
+FROM referrals r GROUP BY r.referrer_user_id
+"""
+
+ROLLUP_LEVELS = {"day": ("food_daily", "day"), "week": ("food_weekly", "week"), "month": ("food_monthly", "month")}
+
+FREQUENT_MAX = 50
+BUSY_TIMEOUT = 5.0      # сек: основное соединение ждёт чужую запись (пачку импорта), а не падает с locked
+IMPORT_PAUSE = 0.005    # сек между пачками импорта: окно для записей из хэндлеров
+
+
+def week_key(d: date) -> str:
+    return (d - timedelta(days=d.weekday())).isoformat()
+
+
+def normalize_meal(text: str) -> str:
+    return " ".join(text.lower().replace("ё", "е").split()).strip(" .,;!")
+
+
+def extend_paid_until(paid_until: str | None, now: datetime, days: int) -> str:
+    # если доступ ещё действует — продлеваем от его конца, иначе от сейчас
+    current = datetime.fromisoformat(paid_until) if paid_until else None
+    base = current if current and current > now else now
+    return (base + timedelta(days=days)).isoformat()
+
+
+def fts_query(user_id: int, query: str) -> str | None:
+    # каждое слово — префикс в кавычках, чтобы пользовательский ввод не ломал синтаксис MATCH;
+    # однобуквенные префиксы раскрываются во весь словарь — их выкидываем
+    words = [w for w in normalize_meal(query).replace('"', " ").split() if len(w) >= 2]
+    if not words:
+        return None
+    return f'user_id:"{int(user_id)}" AND text:(' + " AND ".join(f'"{w}"*' for w in words) + ")"
+
+
+def pack_food_entries(conn: sqlite3.Connection):
+    """
+    Разовая миграция food_entries: parsed_json/conf/err_* -> packed (bot.codec). Таблица пересобирается
+    одним INSERT…SELECT с упаковкой в SQL-функции; id сохраняются, поэтому food_fts и frequent_meals
+    остаются валидными. Индекс и триггеры FTS уходят вместе со старой таблицей — их пересоздаёт SCHEMA.
+    """
+    conn.commit()
+    conn.create_function("pack_entry", 4, codec.pack, deterministic=True)
+    conn.execute("BEGIN")
+    try:
+        conn.execute("""CREATE TABLE food_entries_packed (
+              id INTEGER PRIMARY KEY AUTOINCREMENT,
+              user_id INTEGER NOT NULL,
+              ts TEXT NOT NULL,
+              text TEXT,
+              photo_file_id TEXT,
+              packed BLOB NOT NULL,
+              kcal_low INTEGER NOT NULL,
+              kcal_high INTEGER NOT NULL,
+              kcal_mid INTEGER NOT NULL,
+              FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE
+            )""")
+        conn.execute(
+            """INSERT INTO food_entries_packed (id, user_id, ts, text, photo_file_id, packed, kcal_low, kcal_high, kcal_mid)
+               SELECT id, user_id, ts, text, photo_file_id, pack_entry(parsed_json, conf, err_low, err_high),
+                      kcal_low, kcal_high, kcal_mid
+               FROM food_entries ORDER BY id""")
+        conn.execute("DROP TABLE food_entries")
+        conn.execute("ALTER TABLE food_entries_packed RENAME TO food_entries")
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+
+TDEE_COLS = ("user_id", "weight", "weight_slope", "weight_day", "weight_n",
+             "intake", "intake_day", "intake_n", "first_day")
+
 @dataclass
 class UserRow:
     id: int
@@ -105,10 +317,25 @@ class UserRow:
     trial_start: Optional[str]
     trial_end: Optional[str]
     paid_until: Optional[str]
+    tz: Optional[str] = None
+
+def _user_row(row) -> UserRow:
+    return UserRow(
+        id=row["id"], tg_id=row["tg_id"], chat_id=row["chat_id"],
+        status=row["status"], trial_start=row["trial_start"], trial_end=row["trial_end"], paid_until=row["paid_until"],
+        tz=row["tz"],
+    )
 
 class DB:
-    def __init__(self, path: str):
+    def __init__(self, path: str, cache_size: int = 50_000):
         self.path = (path or "bot.db").strip()
+        self.users = LRUCache(cache_size)      # tg_id -> UserRow
+        self.targets = LRUCache(cache_size)    # user_id -> dict | None
+        self.meta = LRUCache(cache_size)       # (user_id, key) -> value | None
+        self._meta_dirty: dict[tuple[int, str], tuple[str, str]] = {}  # ещё не записанное в user_meta
+        self.meta_flush_at = 1000
+        self.caches = {"users": self.users, "targets": self.targets, "meta": self.meta}
+        self._timezones: set[str | None] | None = None   # пояса пользователей; None — ещё не читали
 
         # If DB_PATH points to a directory that doesn't exist (e.g. /data/bot.db),
         # create the directory to prevent sqlite "unable to open database file".
@@ -117,7 +344,7 @@ class DB:
             os.makedirs(dirn, exist_ok=True)
 
         try:
-            self.conn = sqlite3.connect(self.path)
+            self.conn = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT)
         except sqlite3.OperationalError as e:
             raise sqlite3.OperationalError(
                 f"unable to open database file: path='{self.path}'. "
@@ -128,26 +355,91 @@ class DB:
         self._init()
 
     def _init(self):
+        # на старте с актуальной схемой DDL не гоняем: одна PRAGMA вместо всего скрипта
+        if self.schema_version() == SCHEMA_VERSION:
+            return
+        def has_table(name: str) -> bool:
+            return self.conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (name,)).fetchone() is not None
+
+        had_fts = has_table("food_fts")
+        had_rollups = has_table("food_daily")
+        had_referral_stats = has_table("referral_stats")
+        legacy_entries = "parsed_json" in {r["name"] for r in self.conn.execute("PRAGMA table_info(food_entries)")}
         self.conn.executescript(SCHEMA)
+        if not had_rollups:
+            self.conn.executescript(ROLLUP_BACKFILL)
+        if not had_referral_stats:
+            self.conn.execute(f"INSERT INTO referral_stats (user_id, invited, paid, reward_days) {REFERRAL_STATS_SQL}")
+        if not had_fts:
+            # старые записи в индекс; разовая миграция
+            self.conn.execute("INSERT INTO food_fts(food_fts) VALUES ('rebuild')")
+            # реже сливаем сегменты на вставке (по умолчанию 4); доливает merge_fts из планировщика
+            self.conn.execute("INSERT INTO food_fts(food_fts, rank) VALUES ('automerge', 8)")
+        # колонки, добавленные после первого релиза (CREATE TABLE IF NOT EXISTS их не добавит)
+        self._ensure_column("users", "tz", "TEXT")
+        self._ensure_column("users", "summary_day", "TEXT")
+        self._ensure_column("daily_targets", "formula_version", "INTEGER")
+        # после _ensure_column: у старых баз колонки tz ещё нет, в SCHEMA индекс не положить.
+        # (tz, id) — DISTINCT tz без чтения таблицы и keyset summary_batches внутри одного пояса
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_users_tz ON users(tz)")
+        if legacy_entries:
+            pack_food_entries(self.conn)
+            self.conn.executescript(SCHEMA)
+        self.conn.execute(f"PRAGMA user_version={SCHEMA_VERSION}")
         self.conn.commit()
 
+    def schema_version(self) -> int:
+        return int(self.conn.execute("PRAGMA user_version").fetchone()[0])
+
+    def _ensure_column(self, table: str, column: str, decl: str):
+        cols = {r["name"] for r in self.conn.execute(f"PRAGMA table_info({table})")}
+        if column not in cols:
+            self.conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+
     def close(self):
+        self.flush_meta()
         self.conn.close()
 
+    def enable_profiling(self, threshold_ms: float = 50.0):
+        """Учёт времени по каждому SQL; медленные — в лог с EXPLAIN QUERY PLAN."""
+        if isinstance(self.conn, ProfilingConnection):
+            self.conn.threshold = threshold_ms / 1000
+        else:
+            self.conn = ProfilingConnection(self.conn, threshold_ms)
+
+    def disable_profiling(self):
+        if isinstance(self.conn, ProfilingConnection):
+            self.conn = self.conn._conn
+
+    def query_stats(self, limit: int = 20) -> Optional[list[dict]]:
+        if not isinstance(self.conn, ProfilingConnection):
+            return None
+        return self.conn.dump(limit)
+
     def now_iso(self) -> str:
         return datetime.utcnow().replace(microsecond=0).isoformat()
 
+    def _forget_user(self, user_id: int):
+        row = self.conn.execute("SELECT tg_id FROM users WHERE id=?", (user_id,)).fetchone()
+        if row:
+            self.users.pop(row["tg_id"])
+
     def get_or_create_user(self, tg_id: int, chat_id: int, default_status: str) -> UserRow:
+        cached = self.users.get(tg_id)
+        if cached is not None and (cached.chat_id == chat_id or not chat_id):
+            return cached
+
         cur = self.conn.execute("SELECT * FROM users WHERE tg_id=?", (tg_id,))
         row = cur.fetchone()
         if row:
             if row["chat_id"] != chat_id and chat_id:
                 self.conn.execute("UPDATE users SET chat_id=? WHERE tg_id=?", (chat_id, tg_id))
                 self.conn.commit()
-            return UserRow(
-                id=row["id"], tg_id=row["tg_id"], chat_id=row["chat_id"],
-                status=row["status"], trial_start=row["trial_start"], trial_end=row["trial_end"], paid_until=row["paid_until"]
-            )
+                row = self.conn.execute("SELECT * FROM users WHERE tg_id=?", (tg_id,)).fetchone()
+            user = _user_row(row)
+            self.users.put(tg_id, user)
+            return user
 
         now = self.now_iso()
         trial_start = now
@@ -162,15 +454,100 @@ class DB:
             (tg_id, chat_id, now, status, trial_start, trial_end),
         )
         self.conn.commit()
+        if self._timezones is not None:
+            self._timezones.add(None)
         return self.get_or_create_user(tg_id, chat_id, default_status)
 
     def set_user_status(self, user_id: int, status: str):
         self.conn.execute("UPDATE users SET status=? WHERE id=?", (status, user_id))
         self.conn.commit()
+        self._forget_user(user_id)
+
+    def expire_trials(self, now_iso: str) -> int:
+        cur = self.conn.execute(
+            "UPDATE users SET status='expired' WHERE status='trial' AND trial_end<=?", (now_iso,)
+        )
+        self.conn.commit()
+        if cur.rowcount:
+            self.users.clear()
+        return cur.rowcount
+
+    def expire_subscriptions(self, now_iso: str) -> int:
+        cur = self.conn.execute(
+            "UPDATE users SET status='expired' WHERE status='active' AND paid_until IS NOT NULL AND paid_until<=?",
+            (now_iso,),
+        )
+        self.conn.commit()
+        if cur.rowcount:
+            self.users.clear()
+        return cur.rowcount
+
+    def set_user_tz(self, user_id: int, tz: str | None):
+        self.conn.execute("UPDATE users SET tz=? WHERE id=?", (tz, user_id))
+        self.conn.commit()
+        self._forget_user(user_id)
+        if self._timezones is not None:
+            # прежний пояс мог опустеть — пусть остаётся: summary_batches по нему просто ничего не вернёт
+            self._timezones.add(tz)
+
+    def user_timezones(self) -> list[str | None]:
+        """Пояса пользователей: один раз по idx_users_tz, дальше — из памяти (дополняется при записи)."""
+        if self._timezones is None:
+            self._timezones = {r["tz"] for r in self.conn.execute("SELECT DISTINCT tz FROM users")}
+        return list(self._timezones)
+
+    def summary_batches(self, tz: str | None, day: str, start_iso: str, end_iso: str,
+                        chunk: int = 500):
+        """
+        Пачки пользователей для итога дня (keyset по users.id) вместе с суммами за [start, end).
+        tz=None — пользователи без своего часового пояса (живут по TZ из конфига).
+        """
+        tz_cond = "u.tz IS NULL" if tz is None else "u.tz=?"
+        tz_args = () if tz is None else (tz,)
+        last_id = 0
+        while True:
+            rows = self.conn.execute(
+                f"""SELECT c.id, c.chat_id, c.kcal_target,
+                          COALESCE(SUM(f.kcal_low), 0) AS low, COALESCE(SUM(f.kcal_mid), 0) AS mid,
+                          COALESCE(SUM(f.kcal_high), 0) AS high, COUNT(f.id) AS n
+                   FROM (SELECT u.id, u.chat_id, t.kcal_target
+                         FROM users u JOIN daily_targets t ON t.user_id=u.id
+                         WHERE u.id>? AND {tz_cond} AND u.status IN ('beta','trial','active')
+                           AND (u.summary_day IS NULL OR u.summary_day<>?)
+                         ORDER BY u.id LIMIT ?) c
+                   LEFT JOIN food_entries f ON f.user_id=c.id AND f.ts>=? AND f.ts<?
+                   GROUP BY c.id ORDER BY c.id""",
+                (last_id, *tz_args, day, chunk, start_iso, end_iso),
+            ).fetchall()
+            if not rows:
+                return
+            yield [dict(r) for r in rows]
+            last_id = rows[-1]["id"]
+
+    def chart_batches(self, since_day: str, chunk: int = 500):
+        """Пачки (keyset по users.id) с доступом, целями и хотя бы одним днём записей с since_day."""
+        last_id = 0
+        while True:
+            rows = self.conn.execute(
+                """SELECT u.id, u.chat_id, t.kcal_target FROM users u JOIN daily_targets t ON t.user_id=u.id
+                   WHERE u.id>? AND u.status IN ('beta','trial','active')
+                     AND EXISTS (SELECT 1 FROM food_daily d WHERE d.user_id=u.id AND d.day>=?)
+                   ORDER BY u.id LIMIT ?""",
+                (last_id, since_day, chunk),
+            ).fetchall()
+            if not rows:
+                return
+            yield [dict(r) for r in rows]
+            last_id = rows[-1]["id"]
+
+    def mark_summary_sent(self, user_ids: list[int], day: str):
+        self.conn.executemany("UPDATE users SET summary_day=? WHERE id=?", [(day, uid) for uid in user_ids])
+        self.conn.commit()
 
     def set_paid_until(self, user_id: int, paid_until_iso: str):
         self.conn.execute("UPDATE users SET paid_until=?, status='active' WHERE id=?", (paid_until_iso, user_id))
         self.conn.commit()
+        self._forget_user(user_id)
 
     def upsert_profile(self, user_id: int, **fields):
         cols = ["sex","age","height_cm","weight_kg","activity","goal","palm_len_cm","palm_w_cm","updated_at"]
@@ -190,75 +567,535 @@ class DB:
         row = self.conn.execute("SELECT * FROM profiles WHERE user_id=?", (user_id,)).fetchone()
         return dict(row) if row else None
 
-    def upsert_targets(self, user_id: int, kcal_target: int, protein_g: int, fiber_g: int):
+    def upsert_targets(self, user_id: int, kcal_target: int, protein_g: int, fiber_g: int,
+                       formula_version: int | None = None):
         now = self.now_iso()
         existing = self.conn.execute("SELECT 1 FROM daily_targets WHERE user_id=?", (user_id,)).fetchone()
         if existing:
             self.conn.execute(
-                "UPDATE daily_targets SET kcal_target=?, protein_g=?, fiber_g=?, updated_at=? WHERE user_id=?",
-                (kcal_target, protein_g, fiber_g, now, user_id),
+                """UPDATE daily_targets SET kcal_target=?, protein_g=?, fiber_g=?, updated_at=?, formula_version=?
+                   WHERE user_id=?""",
+                (kcal_target, protein_g, fiber_g, now, formula_version, user_id),
             )
         else:
             self.conn.execute(
-                "INSERT INTO daily_targets (user_id, kcal_target, protein_g, fiber_g, updated_at) VALUES (?,?,?,?,?)",
-                (user_id, kcal_target, protein_g, fiber_g, now),
+                """INSERT INTO daily_targets (user_id, kcal_target, protein_g, fiber_g, updated_at, formula_version)
+                   VALUES (?,?,?,?,?,?)""",
+                (user_id, kcal_target, protein_g, fiber_g, now, formula_version),
             )
         self.conn.commit()
+        self.targets.pop(user_id)
+
+    def stale_target_batches(self, formula_version: int, chunk: int = 1000):
+        """
+        Пачки анкет (keyset по profiles.user_id), у которых целей нет или они посчитаны
+        формулой старее formula_version.
+        """
+        last_id = 0
+        while True:
+            rows = self.conn.execute(
+                """SELECT p.user_id, p.sex, p.age, p.height_cm, p.weight_kg, p.activity, p.goal
+                   FROM profiles p LEFT JOIN daily_targets t ON t.user_id=p.user_id
+                   WHERE p.user_id>? AND (t.user_id IS NULL OR t.formula_version IS NULL OR t.formula_version<?)
+                   ORDER BY p.user_id LIMIT ?""",
+                (last_id, formula_version, chunk),
+            ).fetchall()
+            if not rows:
+                return
+            yield [tuple(r) for r in rows]
+            last_id = rows[-1]["user_id"]
+
+    def bulk_upsert_targets(self, rows: list[tuple[int, int, int, int]], formula_version: int) -> int:
+        """rows: (user_id, kcal_target, protein_g, fiber_g) — одна транзакция на пачку."""
+        now = self.now_iso()
+        self.conn.executemany(
+            """INSERT INTO daily_targets (user_id, kcal_target, protein_g, fiber_g, updated_at, formula_version)
+               VALUES (?,?,?,?,?,?)
+               ON CONFLICT(user_id) DO UPDATE SET kcal_target=excluded.kcal_target,
+                 protein_g=excluded.protein_g, fiber_g=excluded.fiber_g,
+                 updated_at=excluded.updated_at, formula_version=excluded.formula_version""",
+            [(uid, kcal, protein, fiber, now, formula_version) for uid, kcal, protein, fiber in rows],
+        )
+        self.conn.commit()
+        for row in rows:
+            self.targets.pop(row[0])
+        return len(rows)
 
     def get_targets(self, user_id: int) -> Optional[dict]:
+        if user_id in self.targets:
+            return self.targets.get(user_id)
         row = self.conn.execute("SELECT * FROM daily_targets WHERE user_id=?", (user_id,)).fetchone()
+        targets = dict(row) if row else None
+        if targets is not None:
+            self.targets.put(user_id, targets)
+        return targets
+
+    def warm_up(self, since_iso: str, limit: int = 5000) -> int:
+        """Прогрев кэшей: пользователи с записями после since_iso и их цели."""
+        rows = self.conn.execute(
+            """SELECT u.*, t.kcal_target, t.protein_g, t.fiber_g, t.updated_at AS t_updated_at
+               FROM users u LEFT JOIN daily_targets t ON t.user_id=u.id
+               WHERE u.id IN (SELECT DISTINCT user_id FROM food_entries WHERE ts>=?)
+               LIMIT ?""",
+            (since_iso, limit),
+        ).fetchall()
+        for row in rows:
+            if row["tg_id"] not in self.users:
+                self.users.put(row["tg_id"], _user_row(row))
+            if row["kcal_target"] is not None and row["id"] not in self.targets:
+                self.targets.put(row["id"], {
+                    "user_id": row["id"], "kcal_target": row["kcal_target"], "protein_g": row["protein_g"],
+                    "fiber_g": row["fiber_g"], "updated_at": row["t_updated_at"],
+                })
+        return len(rows)
+
+    def get_tdee_state(self, user_id: int) -> Optional[dict]:
+        row = self.conn.execute("SELECT * FROM tdee_state WHERE user_id=?", (user_id,)).fetchone()
         return dict(row) if row else None
 
+    def tdee_states(self, user_ids: list[int]) -> dict[int, dict]:
+        if not user_ids:
+            return {}
+        marks = ",".join("?" * len(user_ids))
+        rows = self.conn.execute(f"SELECT * FROM tdee_state WHERE user_id IN ({marks})", user_ids).fetchall()
+        return {r["user_id"]: dict(r) for r in rows}
+
+    def _upsert_tdee_sql(self) -> str:
+        cols = ",".join(TDEE_COLS)
+        sets = ",".join(f"{c}=excluded.{c}" for c in TDEE_COLS[1:])
+        return (f"INSERT INTO tdee_state ({cols}) VALUES ({','.join('?' * len(TDEE_COLS))}) "
+                f"ON CONFLICT(user_id) DO UPDATE SET {sets}")
+
+    def save_tdee_states(self, states: list[dict]):
+        self.conn.executemany(self._upsert_tdee_sql(), [tuple(st[c] for c in TDEE_COLS) for st in states])
+        self.conn.commit()
+
+    def log_weight(self, user_id: int, day: str, weight_kg: float, state: dict):
+        """Взвешивание, вес в анкете и новое состояние TDEE — одной транзакцией."""
+        with self.conn:
+            self.conn.execute(
+                "INSERT INTO weight_log (user_id, day, weight_kg) VALUES (?,?,?) "
+                "ON CONFLICT(user_id, day) DO UPDATE SET weight_kg=excluded.weight_kg",
+                (user_id, day, weight_kg),
+            )
+            self.conn.execute("UPDATE profiles SET weight_kg=?, updated_at=? WHERE user_id=?",
+                              (weight_kg, self.now_iso(), user_id))
+            self.conn.execute(self._upsert_tdee_sql(), tuple(state[c] for c in TDEE_COLS))
+
+    def weight_history(self, user_id: int, since_day: str) -> list[tuple[str, float]]:
+        rows = self.conn.execute(
+            "SELECT day, weight_kg FROM weight_log WHERE user_id=? AND day>=? ORDER BY day",
+            (user_id, since_day),
+        ).fetchall()
+        return [(r["day"], r["weight_kg"]) for r in rows]
+
+    def adaptive_batches(self, min_weighins: int, chunk: int = 1000):
+        """Пачки (keyset по user_id): состояние TDEE + цель из анкеты + текущие цели."""
+        last_id = 0
+        while True:
+            rows = self.conn.execute(
+                """SELECT s.*, p.goal, t.kcal_target, t.protein_g, t.fiber_g
+                   FROM tdee_state s
+                   JOIN profiles p ON p.user_id=s.user_id
+                   JOIN daily_targets t ON t.user_id=s.user_id
+                   WHERE s.user_id>? AND s.weight_n>=?
+                   ORDER BY s.user_id LIMIT ?""",
+                (last_id, min_weighins, chunk),
+            ).fetchall()
+            if not rows:
+                return
+            yield [dict(r) for r in rows]
+            last_id = rows[-1]["user_id"]
+
+    def intake_batches(self, first_day: str, last_day: str, chunk: int = 1000):
+        """
+        Пачки активных пользователей с записями за [first_day, last_day] (keyset по users.id)
+        и их дневные итоги food_daily: {"id", "tz", "days": [(день, kcal_mid), …] по возрастанию}.
+        """
+        last_id = 0
+        while True:
+            users = self.conn.execute(
+                """SELECT u.id, u.tz FROM users u
+                   WHERE u.id>? AND u.status IN ('beta','trial','active')
+                     AND EXISTS (SELECT 1 FROM food_daily d WHERE d.user_id=u.id AND d.day>=? AND d.day<=?)
+                   ORDER BY u.id LIMIT ?""",
+                (last_id, first_day, last_day, chunk),
+            ).fetchall()
+            if not users:
+                return
+            ids = [r["id"] for r in users]
+            days: dict[int, list[tuple[str, int]]] = {}
+            for r in self.conn.execute(
+                f"""SELECT user_id, day, kcal_mid FROM food_daily
+                    WHERE user_id IN ({",".join("?" * len(ids))}) AND day>=? AND day<=? ORDER BY user_id, day""",
+                (*ids, first_day, last_day),
+            ):
+                days.setdefault(r["user_id"], []).append((r["day"], r["kcal_mid"]))
+            yield [{"id": r["id"], "tz": r["tz"], "days": days[r["id"]]} for r in users]
+            last_id = ids[-1]
+
     def add_food_entry(self, user_id: int, ts_iso: str, text: str | None, photo_file_id: str | None,
                        parsed_json: str, kcal_low: int, kcal_high: int, kcal_mid: int,
                        conf: float, err_low: float, err_high: float) -> int:
         cur = self.conn.execute(
-            """INSERT INTO food_entries
-                (user_id, ts, text, photo_file_id, parsed_json, kcal_low, kcal_high, kcal_mid, conf, err_low, err_high)
-                VALUES (?,?,?,?,?,?,?,?,?,?,?)""",
-            (user_id, ts_iso, text, photo_file_id, parsed_json, kcal_low, kcal_high, kcal_mid, conf, err_low, err_high),
+            """INSERT INTO food_entries (user_id, ts, text, photo_file_id, packed, kcal_low, kcal_high, kcal_mid)
+               VALUES (?,?,?,?,?,?,?,?)""",
+            (user_id, ts_iso, text, photo_file_id, codec.pack(parsed_json, conf, err_low, err_high),
+             kcal_low, kcal_high, kcal_mid),
+        )
+        entry_id = int(cur.lastrowid)
+        self._rollup(user_id, ts_iso, 1, kcal_low, kcal_mid, kcal_high)
+        if text:
+            self._bump_frequent(user_id, normalize_meal(text), entry_id, ts_iso)
+        self.conn.commit()
+        return entry_id
+
+    def _rollup(self, user_id: int, ts_iso: str, dn: int, dlow: int, dmid: int, dhigh: int):
+        """Приращение во все три сводки; вызывается внутри транзакции записи."""
+        day = ts_iso[:10]
+        cur = self.conn.execute(
+            """UPDATE food_daily SET n=n+?, kcal_low=kcal_low+?, kcal_mid=kcal_mid+?, kcal_high=kcal_high+?
+               WHERE user_id=? AND day=?""",
+            (dn, dlow, dmid, dhigh, user_id, day),
+        )
+        new_day = 0
+        if cur.rowcount == 0:
+            self.conn.execute(
+                "INSERT INTO food_daily (user_id, day, n, kcal_low, kcal_mid, kcal_high) VALUES (?,?,?,?,?,?)",
+                (user_id, day, dn, dlow, dmid, dhigh),
+            )
+            new_day = 1
+        for level, key in (("week", week_key(date.fromisoformat(day))), ("month", day[:7])):
+            table, col = ROLLUP_LEVELS[level]
+            self.conn.execute(
+                f"""INSERT INTO {table} (user_id, {col}, n, days, kcal_low, kcal_mid, kcal_high) VALUES (?,?,?,?,?,?,?)
+                    ON CONFLICT(user_id, {col}) DO UPDATE SET n=n+excluded.n, days=days+excluded.days,
+                      kcal_low=kcal_low+excluded.kcal_low, kcal_mid=kcal_mid+excluded.kcal_mid,
+                      kcal_high=kcal_high+excluded.kcal_high""",
+                (user_id, key, dn, new_day, dlow, dmid, dhigh),
+            )
+
+    def rollups(self, user_id: int, level: str, first: str, last: str) -> list[dict]:
+        """Строки сводки уровня day|week|month с ключом в [first, last]."""
+        table, col = ROLLUP_LEVELS[level]
+        rows = self.conn.execute(
+            f"""SELECT {col} AS key, n, {"1 AS days" if level == "day" else "days"}, kcal_low, kcal_mid, kcal_high
+                FROM {table} WHERE user_id=? AND {col}>=? AND {col}<=? ORDER BY {col}""",
+            (user_id, first, last),
+        ).fetchall()
+        return [dict(r) for r in rows]
+
+    def _bump_frequent(self, user_id: int, norm: str, entry_id: int, ts_iso: str):
+        if not norm:
+            return
+        cur = self.conn.execute(
+            """UPDATE frequent_meals SET cnt=cnt+1, entry_id=?, last_ts=? WHERE user_id=? AND norm_text=?""",
+            (entry_id, ts_iso, user_id, norm),
         )
+        if cur.rowcount:
+            return
+        self.conn.execute(
+            "INSERT INTO frequent_meals (user_id, norm_text, entry_id, cnt, last_ts) VALUES (?,?,?,1,?)",
+            (user_id, norm, entry_id, ts_iso),
+        )
+        # новое блюдо: вытесняем самое редкое и давнее, чтобы на пользователя было <= FREQUENT_MAX строк
+        self.conn.execute(
+            """DELETE FROM frequent_meals WHERE user_id=? AND norm_text IN (
+                 SELECT norm_text FROM frequent_meals WHERE user_id=?
+                 ORDER BY cnt DESC, last_ts DESC LIMIT -1 OFFSET ?)""",
+            (user_id, user_id, FREQUENT_MAX),
+        )
+
+    def _backfill_frequent(self, user_id: int, scan: int = 1000) -> int:
+        # для записей, сделанных до появления frequent_meals: последние scan записей пользователя
+        rows = self.conn.execute(
+            "SELECT id, ts, text FROM food_entries WHERE user_id=? AND text IS NOT NULL ORDER BY ts DESC LIMIT ?",
+            (user_id, scan),
+        ).fetchall()
+        for r in reversed(rows):
+            self._bump_frequent(user_id, normalize_meal(r["text"]), r["id"], r["ts"])
         self.conn.commit()
-        return int(cur.lastrowid)
+        return len(rows)
+
+    def frequent_meals(self, user_id: int, prefix: str | None = None, limit: int = 8) -> list[dict]:
+        """Частые блюда (cnt, потом свежесть); prefix — начало текста, по диапазону первичного ключа."""
+        def query():
+            if prefix:
+                p = normalize_meal(prefix)
+                return self.conn.execute(
+                    """SELECT f.norm_text, f.entry_id, f.cnt, f.last_ts, e.kcal_mid FROM frequent_meals f
+                       JOIN food_entries e ON e.id=f.entry_id
+                       WHERE f.user_id=? AND f.norm_text>=? AND f.norm_text<?
+                       ORDER BY f.cnt DESC, f.last_ts DESC LIMIT ?""",
+                    (user_id, p, p + "\uffff", limit),
+                ).fetchall()
+            return self.conn.execute(
+                """SELECT f.norm_text, f.entry_id, f.cnt, f.last_ts, e.kcal_mid FROM frequent_meals f
+                   JOIN food_entries e ON e.id=f.entry_id
+                   WHERE f.user_id=? ORDER BY f.cnt DESC, f.last_ts DESC LIMIT ?""",
+                (user_id, limit),
+            ).fetchall()
+
+        rows = query()
+        if not rows and self.conn.execute(
+                "SELECT 1 FROM frequent_meals WHERE user_id=? LIMIT 1", (user_id,)).fetchone() is None:
+            if self._backfill_frequent(user_id):
+                rows = query()
+        return [dict(r) for r in rows]
+
+    def search_meals(self, user_id: int, query: str, limit: int = 8) -> list[dict]:
+        """Поиск по всей истории пользователя (FTS5, слова — префиксы); по одному результату на текст."""
+        match = fts_query(user_id, query)
+        if match is None:
+            return []
+        rows = self.conn.execute(
+            """SELECT e.id AS entry_id, e.text, e.ts, e.kcal_mid FROM food_fts
+               JOIN food_entries e ON e.id=food_fts.rowid
+               WHERE food_fts MATCH ? ORDER BY food_fts.rowid DESC LIMIT ?""",
+            (match, limit * 5),
+        ).fetchall()
+        seen, out = set(), []
+        for r in rows:
+            norm = normalize_meal(r["text"] or "")
+            if norm and norm not in seen:
+                seen.add(norm)
+                out.append({"norm_text": norm, "entry_id": r["entry_id"], "last_ts": r["ts"],
+                            "kcal_mid": r["kcal_mid"]})
+            if len(out) >= limit:
+                break
+        return out
+
+    def merge_fts(self, pages: int = 500) -> int:
+        """Фоновое слияние сегментов FTS: на горячей вставке его остаётся меньше."""
+        self.conn.execute("INSERT INTO food_fts(food_fts, rank) VALUES ('merge', ?)", (pages,))
+        self.conn.commit()
+        return pages
+
+    def repeat_food_entry(self, entry_id: int, user_id: int, ts_iso: str) -> Optional[int]:
+        """Копия записи с новым временем: разбор и калории берутся как есть, без analyze."""
+        e = self.get_food_entry(entry_id, user_id)
+        if e is None:
+            return None
+        return self.add_food_entry(user_id, ts_iso, e["text"], None, e["parsed_json"], e["kcal_low"],
+                                   e["kcal_high"], e["kcal_mid"], e["conf"], e["err_low"], e["err_high"])
+
+    def _readonly(self) -> sqlite3.Connection:
+        """Отдельное соединение только на чтение — для потоков (экспорт, отчёты); WAL не мешает писателю."""
+        conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    @contextmanager
+    def _snapshot(self):
+        """
+        Согласованный снимок базы: отдельное read-only соединение и одна читающая транзакция.
+        В WAL читатель не блокирует писателя, а все запросы внутри видят одно и то же состояние.
+        """
+        conn = self._readonly()
+        conn.isolation_level = None
+        try:
+            conn.execute("BEGIN")
+            conn.execute("SELECT 1 FROM users LIMIT 1").fetchall()   # снимок фиксируется на первом чтении
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            conn.close()
+
+    def report_rows(self, queries: dict[str, str], params: dict) -> dict:
+        """{имя: {"columns": [...], "rows": [[...]]}} — все запросы в одном снимке; можно гонять в потоке."""
+        out = {}
+        with self._snapshot() as conn:
+            for name, sql in queries.items():
+                cur = conn.execute(sql, params)
+                rows = cur.fetchall()
+                out[name] = {"columns": [d[0] for d in cur.description], "rows": [list(r) for r in rows]}
+        return out
+
+    def export_rows(self, user_id: int, chunk: int = 500):
+        """
+        Все записи пользователя по времени, по одной строке: курсор читает с диска по мере итерации
+        (fetchmany), в памяти не больше chunk строк. Своё соединение — можно гонять в потоке.
+        """
+        conn = self._readonly()
+        try:
+            cur = conn.execute(
+                """SELECT id, ts, text, photo_file_id, packed, kcal_low, kcal_mid, kcal_high
+                   FROM food_entries WHERE user_id=? ORDER BY ts, id""",
+                (user_id,),
+            )
+            while True:
+                rows = cur.fetchmany(chunk)
+                if not rows:
+                    return
+                for r in rows:
+                    yield codec.entry_row(r)
+        finally:
+            conn.close()
+
+    def import_entries(self, user_id: int, entries, chunk: int = 200, progress: dict | None = None) -> tuple[int, int]:
+        """
+        Массовая вставка записей (dict с полями food_entries без user_id/photo) пачками по chunk:
+        на пачку одна транзакция, executemany в food_entries (FTS — триггерами) и сводки одним
+        upsert на день/неделю/месяц, а не на строку. Повтор (тот же ts и text) пропускается.
+        Своё соединение — вызывается из потока. Возвращает (вставлено, дублей).
+        Пачка собирается до BEGIN, блокировка записи держится миллисекунды; между пачками —
+        пауза, чтобы основное соединение (хэндлеры) успевало записать, а не ждало весь файл.
+        """
+        conn = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT, check_same_thread=False, isolation_level=None)
+        inserted = duplicates = 0
+        try:
+            batch: list[dict] = []
+            for e in entries:
+                batch.append(e)
+                if len(batch) >= chunk:
+                    i, d = self._import_chunk(conn, user_id, batch)
+                    inserted, duplicates, batch = inserted + i, duplicates + d, []
+                    if progress is not None:
+                        progress.update(inserted=inserted, duplicates=duplicates)
+                    time.sleep(IMPORT_PAUSE)
+            if batch:
+                i, d = self._import_chunk(conn, user_id, batch)
+                inserted, duplicates = inserted + i, duplicates + d
+            if inserted:
+                # частые блюда пересоберутся лениво (frequent_meals) по свежей истории
+                conn.execute("DELETE FROM frequent_meals WHERE user_id=?", (user_id,))
+        finally:
+            conn.close()
+        if progress is not None:
+            progress.update(inserted=inserted, duplicates=duplicates)
+        return inserted, duplicates
+
+    @staticmethod
+    def _import_chunk(conn: sqlite3.Connection, user_id: int, batch: list[dict]) -> tuple[int, int]:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # дубли ищем точечно по ts пачки (индекс user_id, ts): файл может быть не отсортирован
+            stamps = json.dumps(sorted({e["ts"] for e in batch}))
+            seen = set(conn.execute(
+                "SELECT ts, text FROM food_entries WHERE user_id=? AND ts IN (SELECT value FROM json_each(?))",
+                (user_id, stamps),
+            ).fetchall())
+            rows, days = [], {}
+            for e in batch:
+                if (e["ts"], e["text"]) in seen:
+                    continue
+                seen.add((e["ts"], e["text"]))
+                rows.append((user_id, e["ts"], e["text"], codec.pack(e["parsed_json"], e["conf"], e["err_low"],
+                             e["err_high"]), e["kcal_low"], e["kcal_high"], e["kcal_mid"]))
+                agg = days.setdefault(e["ts"][:10], [0, 0, 0, 0])
+                agg[0] += 1
+                agg[1] += e["kcal_low"]
+                agg[2] += e["kcal_mid"]
+                agg[3] += e["kcal_high"]
+            if rows:
+                conn.executemany(
+                    """INSERT INTO food_entries (user_id, ts, text, packed, kcal_low, kcal_high, kcal_mid)
+                       VALUES (?,?,?,?,?,?,?)""",
+                    rows,
+                )
+                existing = {r[0] for r in conn.execute(
+                    "SELECT day FROM food_daily WHERE user_id=? AND day IN (SELECT value FROM json_each(?))",
+                    (user_id, json.dumps(sorted(days))),
+                )}
+                conn.executemany(
+                    """INSERT INTO food_daily (user_id, day, n, kcal_low, kcal_mid, kcal_high) VALUES (?,?,?,?,?,?)
+                       ON CONFLICT(user_id, day) DO UPDATE SET n=n+excluded.n, kcal_low=kcal_low+excluded.kcal_low,
+                         kcal_mid=kcal_mid+excluded.kcal_mid, kcal_high=kcal_high+excluded.kcal_high""",
+                    [(user_id, d, *agg) for d, agg in days.items()],
+                )
+                for level in ("week", "month"):
+                    table, col = ROLLUP_LEVELS[level]
+                    per: dict[str, list[int]] = {}
+                    for d, (n, low, mid, high) in days.items():
+                        key = week_key(date.fromisoformat(d)) if level == "week" else d[:7]
+                        p = per.setdefault(key, [0, 0, 0, 0, 0])
+                        p[0] += n
+                        p[1] += d not in existing
+                        p[2] += low
+                        p[3] += mid
+                        p[4] += high
+                    conn.executemany(
+                        f"""INSERT INTO {table} (user_id, {col}, n, days, kcal_low, kcal_mid, kcal_high)
+                            VALUES (?,?,?,?,?,?,?)
+                            ON CONFLICT(user_id, {col}) DO UPDATE SET n=n+excluded.n, days=days+excluded.days,
+                              kcal_low=kcal_low+excluded.kcal_low, kcal_mid=kcal_mid+excluded.kcal_mid,
+                              kcal_high=kcal_high+excluded.kcal_high""",
+                        [(user_id, k, *p) for k, p in per.items()],
+                    )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return len(rows), len(batch) - len(rows)
+
+    def find_user(self, tg_id: int) -> Optional[UserRow]:
+        row = self.conn.execute("SELECT * FROM users WHERE tg_id=?", (tg_id,)).fetchone()
+        return _user_row(row) if row else None
 
     def get_food_entry(self, entry_id: int, user_id: int) -> Optional[dict]:
         row = self.conn.execute("SELECT * FROM food_entries WHERE id=? AND user_id=?", (entry_id, user_id)).fetchone()
-        return dict(row) if row else None
+        return codec.entry_row(row) if row else None
 
     def update_food_entry(self, entry_id: int, user_id: int, parsed_json: str,
                           kcal_low: int, kcal_high: int, kcal_mid: int, conf: float, err_low: float, err_high: float):
+        old = self.conn.execute(
+            "SELECT ts, kcal_low, kcal_mid, kcal_high FROM food_entries WHERE id=? AND user_id=?", (entry_id, user_id)
+        ).fetchone()
+        if old is None:
+            return
         self.conn.execute(
-            """UPDATE food_entries
-               SET parsed_json=?, kcal_low=?, kcal_high=?, kcal_mid=?, conf=?, err_low=?, err_high=?
-               WHERE id=? AND user_id=?""",
-            (parsed_json, kcal_low, kcal_high, kcal_mid, conf, err_low, err_high, entry_id, user_id)
+            """UPDATE food_entries SET packed=?, kcal_low=?, kcal_high=?, kcal_mid=? WHERE id=? AND user_id=?""",
+            (codec.pack(parsed_json, conf, err_low, err_high), kcal_low, kcal_high, kcal_mid, entry_id, user_id)
         )
+        self._rollup(user_id, old["ts"], 0, kcal_low - old["kcal_low"], kcal_mid - old["kcal_mid"],
+                     kcal_high - old["kcal_high"])
         self.conn.commit()
 
     def today_kcal_sum(self, user_id: int, day_utc: datetime) -> tuple[int,int,int]:
-        start = day_utc.replace(hour=0, minute=0, second=0, microsecond=0)
-        end = start + timedelta(days=1)
-        rows = self.conn.execute(
-            "SELECT SUM(kcal_low) as a, SUM(kcal_mid) as b, SUM(kcal_high) as c FROM food_entries WHERE user_id=? AND ts>=? AND ts<?",
-            (user_id, start.isoformat(), end.isoformat()),
+        row = self.conn.execute(
+            "SELECT kcal_low, kcal_mid, kcal_high FROM food_daily WHERE user_id=? AND day=?",
+            (user_id, day_utc.date().isoformat()),
         ).fetchone()
-        a = int(rows["a"] or 0)
-        b = int(rows["b"] or 0)
-        c = int(rows["c"] or 0)
-        return a,b,c
+        if row is None:
+            return 0, 0, 0
+        return int(row["kcal_low"]), int(row["kcal_mid"]), int(row["kcal_high"])
 
     def get_meta(self, user_id: int, key: str) -> Optional[str]:
+        k = (user_id, key)
+        dirty = self._meta_dirty.get(k)
+        if dirty is not None:
+            return dirty[0]
+        if k in self.meta:
+            return self.meta.get(k)
         row = self.conn.execute("SELECT value FROM user_meta WHERE user_id=? AND key=?", (user_id, key)).fetchone()
-        return row["value"] if row else None
+        value = row["value"] if row else None
+        self.meta.put(k, value)
+        return value
 
     def set_meta(self, user_id: int, key: str, value: str):
-        now = self.now_iso()
-        existing = self.conn.execute("SELECT 1 FROM user_meta WHERE user_id=? AND key=?", (user_id, key)).fetchone()
-        if existing:
-            self.conn.execute("UPDATE user_meta SET value=?, updated_at=? WHERE user_id=? AND key=?", (value, now, user_id, key))
-        else:
-            self.conn.execute("INSERT INTO user_meta (user_id, key, value, updated_at) VALUES (?,?,?,?)", (user_id, key, value, now))
+        """Пишет в кэш; в БД попадёт пачкой при flush_meta (по таймеру, при переполнении и в close)."""
+        k = (user_id, key)
+        self.meta.put(k, value)
+        self._meta_dirty[k] = (value, self.now_iso())
+        if len(self._meta_dirty) >= self.meta_flush_at:
+            self.flush_meta()
+
+    def meta_pending(self) -> int:
+        return len(self._meta_dirty)
+
+    def flush_meta(self) -> int:
+        if not self._meta_dirty:
+            return 0
+        rows = [(uid, key, value, ts) for (uid, key), (value, ts) in self._meta_dirty.items()]
+        self.conn.executemany(
+            """INSERT INTO user_meta (user_id, key, value, updated_at) VALUES (?,?,?,?)
+               ON CONFLICT(user_id, key) DO UPDATE SET value=excluded.value, updated_at=excluded.updated_at""",
+            rows,
+        )
         self.conn.commit()
+        self._meta_dirty.clear()
+        return len(rows)
 
     def get_or_create_promo_code(self, user_id: int) -> str:
         row = self.conn.execute("SELECT code FROM promo_codes WHERE user_id=?", (user_id,)).fetchone()
@@ -284,11 +1121,12 @@ class DB:
         if referrer_user_id == referred_user_id:
             return False, "Нельзя применить свой промокод.", None
 
-        self.conn.execute(
-            "INSERT INTO referrals (referrer_user_id, referred_user_id, code, status, created_at) VALUES (?,?,?,?,?)",
-            (referrer_user_id, referred_user_id, code, "discount_reserved", self.now_iso()),
-        )
-        self.conn.commit()
+        with self.conn:
+            self.conn.execute(
+                "INSERT INTO referrals (referrer_user_id, referred_user_id, code, status, created_at) VALUES (?,?,?,?,?)",
+                (referrer_user_id, referred_user_id, code, "discount_reserved", self.now_iso()),
+            )
+            self._bump_referral_stats(referrer_user_id, invited=1)
         return True, "Ок. Скидка будет применена при первой оплате после триала.", referrer_user_id
 
     def get_discount_for_user(self, user_id: int) -> int:
@@ -300,32 +1138,102 @@ class DB:
             return 1
         return 0
 
-    def mark_first_payment(self, referred_user_id: int):
+    def _bump_referral_stats(self, user_id: int, invited: int = 0, paid: int = 0, reward_days: int = 0):
+        # внутри транзакции вызывающего
         self.conn.execute(
-            "UPDATE referrals SET status='paid', first_payment_at=? WHERE referred_user_id=? AND status='discount_reserved'",
-            (self.now_iso(), referred_user_id),
+            """INSERT INTO referral_stats (user_id, invited, paid, reward_days) VALUES (?,?,?,?)
+               ON CONFLICT(user_id) DO UPDATE SET invited=invited+excluded.invited, paid=paid+excluded.paid,
+                 reward_days=reward_days+excluded.reward_days""",
+            (user_id, invited, paid, reward_days),
         )
-        self.conn.commit()
 
-    def reward_referrer_if_paid(self, referred_user_id: int, days: int = 7) -> Optional[int]:
+    def referral_stats(self, user_id: int) -> dict:
         row = self.conn.execute(
-            "SELECT id, referrer_user_id, status FROM referrals WHERE referred_user_id=?",
-            (referred_user_id,)
+            "SELECT invited, paid, reward_days FROM referral_stats WHERE user_id=?", (user_id,)
         ).fetchone()
-        if not row or row["status"] != "paid":
+        return dict(row) if row else {"invited": 0, "paid": 0, "reward_days": 0}
+
+    def referral_top(self, limit: int = 10) -> list[dict]:
+        """Лидеры по оплатившим, потом по приглашённым — по индексу idx_referral_stats_rank."""
+        rows = self.conn.execute(
+            """SELECT user_id, invited, paid, reward_days FROM referral_stats
+               WHERE invited > 0 ORDER BY paid DESC, invited DESC LIMIT ?""",
+            (limit,),
+        ).fetchall()
+        return [dict(r) for r in rows]
+
+    def referral_rank(self, user_id: int) -> Optional[int]:
+        st = self.conn.execute("SELECT invited, paid FROM referral_stats WHERE user_id=?", (user_id,)).fetchone()
+        if st is None or st["invited"] == 0:
             return None
-        referrer_user_id = int(row["referrer_user_id"])
-        self.conn.execute("INSERT INTO reward_ledger (user_id, days, reason, created_at) VALUES (?,?,?,?)",
-                          (referrer_user_id, days, f"referral:{referred_user_id}", self.now_iso()))
-        self.conn.execute("UPDATE referrals SET status='rewarded' WHERE id=?", (int(row["id"]),))
-        now = datetime.utcnow()
-        u = self.conn.execute("SELECT paid_until FROM users WHERE id=?", (referrer_user_id,)).fetchone()
-        if u and u["paid_until"]:
-            pu = datetime.fromisoformat(u["paid_until"])
-            base = pu if pu > now else now
-        else:
-            base = now
-        new_pu = (base + timedelta(days=days)).replace(microsecond=0).isoformat()
-        self.conn.execute("UPDATE users SET paid_until=?, status='active' WHERE id=?", (new_pu, referrer_user_id))
-        self.conn.commit()
-        return referrer_user_id
+        ahead = self.conn.execute(
+            "SELECT COUNT(*) FROM referral_stats WHERE paid > ? OR (paid = ? AND invited > ?)",
+            (st["paid"], st["paid"], st["invited"]),
+        ).fetchone()[0]
+        return int(ahead) + 1
+
+    def rebuild_referral_stats(self) -> dict:
+        """Пересчёт счётчиков с нуля; mismatched — сколько рефереров расходилось с накопленными."""
+        with self.conn:
+            mismatched = self.conn.execute(
+                f"""WITH want AS ({REFERRAL_STATS_SQL}),
+                         have AS (SELECT user_id, invited, paid, reward_days FROM referral_stats
+                                  WHERE invited + paid + reward_days > 0)
+                    SELECT COUNT(DISTINCT user_id) FROM (
+                      SELECT * FROM (SELECT * FROM want EXCEPT SELECT * FROM have)
+                      UNION ALL
+                      SELECT * FROM (SELECT * FROM have EXCEPT SELECT * FROM want))"""
+            ).fetchone()[0]
+            self.conn.execute("DELETE FROM referral_stats")
+            cur = self.conn.execute(
+                f"INSERT INTO referral_stats (user_id, invited, paid, reward_days) {REFERRAL_STATS_SQL}"
+            )
+        return {"rows": cur.rowcount, "mismatched": int(mismatched)}
+
+    def apply_payment(self, user_id: int, charge_id: str, provider_charge_id: str | None, amount: int,
+                      currency: str, payload: str | None, days: int = 30, reward_days: int = 7) -> dict:
+        """
+        Оплата целиком одной транзакцией: запись в payments, продление доступа, переход реферала
+        discount_reserved -> paid -> rewarded, запись в reward_ledger и продление рефереру.
+        Повтор того же charge_id не меняет ничего (new=False).
+        Возвращает {"new", "paid_until", "referrer_chat_id"}; уведомлять реферера — после возврата.
+        """
+        now = datetime.utcnow().replace(microsecond=0)
+        now_iso = now.isoformat()
+        referrer_id = referrer_chat_id = None
+        with self.conn:
+            cur = self.conn.execute(
+                """INSERT INTO payments (charge_id, provider_charge_id, user_id, amount, currency, payload,
+                                         paid_until, created_at)
+                   VALUES (?,?,?,?,?,?,'',?) ON CONFLICT(charge_id) DO NOTHING""",
+                (charge_id, provider_charge_id, user_id, amount, currency, payload, now_iso),
+            )
+            if cur.rowcount == 0:
+                row = self.conn.execute("SELECT paid_until FROM payments WHERE charge_id=?", (charge_id,)).fetchone()
+                return {"new": False, "paid_until": row["paid_until"], "referrer_chat_id": None}
+
+            u = self.conn.execute("SELECT paid_until FROM users WHERE id=?", (user_id,)).fetchone()
+            paid_until = extend_paid_until(u["paid_until"] if u else None, now, days)
+            self.conn.execute("UPDATE users SET paid_until=?, status='active' WHERE id=?", (paid_until, user_id))
+            self.conn.execute("UPDATE payments SET paid_until=? WHERE charge_id=?", (paid_until, charge_id))
+
+            ref = self.conn.execute(
+                "SELECT id, referrer_user_id, status FROM referrals WHERE referred_user_id=?", (user_id,)
+            ).fetchone()
+            if ref and ref["status"] == "discount_reserved":
+                referrer_id = int(ref["referrer_user_id"])
+                self.conn.execute(
+                    "UPDATE referrals SET status='rewarded', first_payment_at=? WHERE id=?", (now_iso, ref["id"])
+                )
+                self.conn.execute("INSERT INTO reward_ledger (user_id, days, reason, created_at) VALUES (?,?,?,?)",
+                                  (referrer_id, reward_days, f"referral:{user_id}", now_iso))
+                self._bump_referral_stats(referrer_id, paid=1, reward_days=reward_days)
+                r = self.conn.execute("SELECT chat_id, paid_until FROM users WHERE id=?", (referrer_id,)).fetchone()
+                self.conn.execute("UPDATE users SET paid_until=?, status='active' WHERE id=?",
+                                  (extend_paid_until(r["paid_until"], now, reward_days), referrer_id))
+                referrer_chat_id = int(r["chat_id"]) if r["chat_id"] else None
+
+        self._forget_user(user_id)
+        if referrer_id is not None:
+            self._forget_user(referrer_id)
+        return {"new": True, "paid_until": paid_until, "referrer_chat_id": referrer_chat_id}
@@ -0,0 +1,107 @@
+from __future__ import annotations
+import os
+import resource
+import time
+import tracemalloc
+
+_PAGE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def rss_bytes() -> int:
+    # /proc/self/statm — одно чтение без обхода памяти; вне Linux — пиковое RSS из getrusage
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * _PAGE
+    except (OSError, ValueError, IndexError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def db_file_sizes(path: str) -> dict[str, int]:
+    out = {}
+    for suffix in ("", "-wal", "-shm"):
+        try:
+            out["db" + suffix.replace("-", "_")] = os.path.getsize(path + suffix)
+        except OSError:
+            pass
+    return out
+
+
+def tracemalloc_start(frames: int = 5):
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(frames)
+
+
+def tracemalloc_stop():
+    tracemalloc.stop()
+
+
+def tracemalloc_top(limit: int = 10) -> list[dict] | None:
+    """Топ мест аллокаций; None, если tracemalloc не включён (включается по команде — он не бесплатный)."""
+    if not tracemalloc.is_tracing():
+        return None
+    snapshot = tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    ))
+    top = []
+    for stat in snapshot.statistics("lineno")[:limit]:
+        frame = stat.traceback[0]
+        top.append({"where": f"{frame.filename}:{frame.lineno}", "kib": round(stat.size / 1024, 1),
+                    "count": stat.count})
+    return top
+
+
+def collect(db, metrics=None, loop_monitor=None, outbox=None, jobs: dict | None = None) -> dict:
+    """Снимок состояния процесса: только уже посчитанные счётчики и пара syscall'ов, без запросов в БД."""
+    d = {
+        "at": time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime()),
+        "rss_mb": round(rss_bytes() / 2**20, 1),
+        "files": db_file_sizes(db.path),
+        "caches": {name: cache.stats() for name, cache in db.caches.items()},
+        "meta_dirty": db.meta_pending(),
+    }
+    if metrics is not None:
+        d["in_flight"] = metrics.in_flight
+    if loop_monitor is not None:
+        d["loop_lag_ms"] = round(loop_monitor.lag * 1000, 1)
+        d["loop_max_lag_ms"] = round(loop_monitor.max_lag * 1000, 1)
+        d["stalls"] = len(loop_monitor.stalls)
+    if outbox is not None:
+        d["outbox"] = {"depth": outbox.depth(), "sent": outbox.sent, "retried": outbox.retried,
+                       "failed": outbox.failed}
+    if jobs is not None:
+        d["jobs"] = jobs
+    if tracemalloc.is_tracing():
+        current, peak = tracemalloc.get_traced_memory()
+        d["traced_mb"] = {"current": round(current / 2**20, 1), "peak": round(peak / 2**20, 1)}
+    return d
+
+
+def _mb(n: int) -> str:
+    return f"{n / 2**20:.1f} MB"
+
+
+def render(d: dict) -> str:
+    lines = [f"{d['at']} UTC", f"RSS: {d['rss_mb']} MB"]
+    if "traced_mb" in d:
+        lines.append(f"tracemalloc: {d['traced_mb']['current']} MB (пик {d['traced_mb']['peak']} MB)")
+    lines.append("БД: " + ", ".join(f"{k} {_mb(v)}" for k, v in d["files"].items()))
+    for name, c in d["caches"].items():
+        lines.append(f"кэш {name}: {c['size']}/{c['maxsize']}, hit {c['hit_rate']:.1%}")
+    lines.append(f"meta к записи: {d['meta_dirty']}")
+    if "in_flight" in d:
+        lines.append(f"апдейтов в обработке: {d['in_flight']}")
+    if "loop_lag_ms" in d:
+        lines.append(f"лаг цикла: {d['loop_lag_ms']} мс (макс {d['loop_max_lag_ms']} мс, остановок {d['stalls']})")
+    if "outbox" in d:
+        o = d["outbox"]
+        lines.append(f"outbox: в очереди {o['depth']}, отправлено {o['sent']}, повторов {o['retried']}, "
+                     f"ошибок {o['failed']}")
+    for name, j in (d.get("jobs") or {}).items():
+        lines.append(f"job {name}: {j['runs']}× last {j['last_ms']} мс / max {j['max_ms']} мс, "
+                     f"rows {j['last_rows']}, ошибок {j['errors']}, {j['last_run']}")
+    return "\n".join(lines)
+
+
+def render_top(top: list[dict]) -> str:
+    return "\n".join(f"{t['kib']:>9} KiB {t['count']:>7}  {t['where']}" for t in top)
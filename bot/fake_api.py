@@ -0,0 +1,188 @@
+from __future__ import annotations
+import argparse
+import asyncio
+import json
+import logging
+import time
+from collections import Counter
+from typing import Any, AsyncGenerator, Callable, Optional
+
+from aiogram.client.session.base import BaseSession
+from aiogram.methods import TelegramMethod
+
+log = logging.getLogger(__name__)
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "FakeBot", "username": "fake_bot"}
+
+
+def fake_result(method_name: str, params: dict, message_id: int) -> Any:
+    """Минимальный ответ Bot API, которого хватает aiogram для десериализации."""
+    if method_name == "getMe":
+        return BOT_USER
+    if method_name == "getUpdates":
+        return []
+    if method_name.startswith("send") or method_name.startswith("edit"):
+        chat_id = params.get("chat_id") or 0
+        msg: dict[str, Any] = {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": int(chat_id), "type": "private"},
+            "from": BOT_USER,
+        }
+        if "text" in params:
+            msg["text"] = params["text"]
+        if method_name == "sendInvoice":
+            msg["invoice"] = {
+                "title": params.get("title", ""),
+                "description": params.get("description", ""),
+                "start_parameter": params.get("start_parameter", ""),
+                "currency": params.get("currency", "RUB"),
+                "total_amount": 0,
+            }
+        if method_name == "sendDocument":
+            msg["document"] = {"file_id": f"doc{message_id}", "file_unique_id": f"udoc{message_id}"}
+        if method_name == "sendPhoto":
+            msg["photo"] = [{"file_id": f"photo{message_id}", "file_unique_id": f"uphoto{message_id}",
+                             "width": 1, "height": 1}]
+        return msg
+    return True
+
+
+class FakeSession(BaseSession):
+    """
+    Сессия без сети: отвечает как Bot API и записывает все исходящие вызовы.
+    `fail` — callable(method_name, params) -> retry_after | None, чтобы подмешивать 429.
+    """
+
+    def __init__(self, fail: Optional[Callable[[str, dict], Optional[int]]] = None, latency: float = 0.0):
+        super().__init__()
+        self.fail = fail
+        self.latency = latency
+        self.calls: list[tuple[str, dict]] = []
+        self.rejected: list[tuple[str, dict]] = []
+        self._message_id = 0
+
+    async def close(self) -> None:
+        pass
+
+    async def make_request(self, bot, method: TelegramMethod, timeout: Optional[int] = None):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        name = method.__api_method__
+        params = self.params(bot, method)
+
+        retry_after = self.fail(name, params) if self.fail else None
+        if retry_after is not None:
+            self.rejected.append((name, params))
+            content = json.dumps({
+                "ok": False,
+                "error_code": 429,
+                "description": f"Too Many Requests: retry after {retry_after}",
+                "parameters": {"retry_after": retry_after},
+            })
+            response = self.check_response(bot=bot, method=method, status_code=429, content=content)
+            return response.result
+
+        self.calls.append((name, params))
+        self._message_id += 1
+        content = json.dumps({"ok": True, "result": fake_result(name, params, self._message_id)})
+        response = self.check_response(bot=bot, method=method, status_code=200, content=content)
+        return response.result
+
+    def params(self, bot, method: TelegramMethod) -> dict:
+        files: dict[str, Any] = {}
+        params = {}
+        for key, value in method.model_dump(warnings=False).items():
+            value = self.prepare_value(value, bot=bot, files=files, _dumps_json=False)
+            if value is not None:
+                params[key] = value
+        return params
+
+    async def stream_content(self, url: str, headers=None, timeout: int = 30,
+                             chunk_size: int = 65536, raise_for_status: bool = True) -> AsyncGenerator[bytes, None]:
+        yield b""
+
+    def sent(self, method_name: str = "sendMessage") -> list[dict]:
+        return [p for n, p in self.calls if n == method_name]
+
+
+class FakeBotApiServer:
+    """
+    Локальный HTTP-сервер с интерфейсом Bot API (/bot<token>/<method>).
+    Подтверждает sendMessage/sendInvoice/... и всё остальное, считает вызовы по методам.
+    Бот подключается через AiohttpSession(api=TelegramAPIServer.from_base(server.url)).
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.0):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.counts: Counter = Counter()
+        self._message_id = 0
+        self._runner = None
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    async def _handle(self, request):
+        from aiohttp import web
+
+        method = request.match_info["method"]
+        if request.content_type == "application/json":
+            params = await request.json()
+        else:
+            params = {}
+            form = await request.post()
+            for k, v in form.items():
+                if isinstance(v, str):
+                    try:
+                        params[k] = json.loads(v) if v[:1] in "[{" else v
+                    except ValueError:
+                        params[k] = v
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        self.counts[method] += 1
+        self._message_id += 1
+        return web.json_response({"ok": True, "result": fake_result(method, params, self._message_id)})
+
+    async def start(self):
+        from aiohttp import web
+
+        app = web.Application()
+        app.router.add_route("*", "/bot{token}/{method}", self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        if not self.port:
+            self.port = self._runner.addresses[0][1]
+        log.info("fake Bot API on %s", self.url)
+        return self
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+async def _serve(host: str, port: int, latency: float):
+    server = await FakeBotApiServer(host, port, latency).start()
+    print(f"fake Bot API: {server.url}  (Ctrl+C to stop)")
+    try:
+        while True:
+            await asyncio.sleep(3600)
+    finally:
+        await server.stop()
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Local fake Telegram Bot API server")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8081)
+    ap.add_argument("--latency", type=float, default=0.0, help="задержка ответа, сек")
+    args = ap.parse_args()
+    try:
+        asyncio.run(_serve(args.host, args.port, args.latency))
+    except KeyboardInterrupt:
+        pass
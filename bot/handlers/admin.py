@@ -0,0 +1,129 @@
+import shutil
+from html import escape
+
+from aiogram import Router
+from aiogram.filters import BaseFilter, Command
+from aiogram.types import FSInputFile, Message
+
+from bot import diagnostics
+from bot.services.reports import FORMATS as REPORT_FORMATS, REPORTS, run_reports
+from bot.storage import SqlReports, Storage
+
+router = Router()
+
+
+class AdminFilter(BaseFilter):
+    async def __call__(self, message: Message, cfg) -> bool:
+        return message.from_user is not None and message.from_user.id in cfg.admin_ids
+
+
+router.message.filter(AdminFilter())
+
+
+@router.message(Command("dbstats"))
+async def dbstats_cmd(message: Message, db: Storage):
+    # /dbstats — топ запросов; /dbstats on [мс] — включить; /dbstats off — выключить
+    parts = (message.text or "").split()
+    if len(parts) >= 2 and parts[1] == "on":
+        try:
+            threshold = float(parts[2]) if len(parts) >= 3 else 50.0
+        except ValueError:
+            await message.answer("Формат: /dbstats on 50 | /dbstats off")
+            return
+        db.enable_profiling(threshold)
+        await message.answer(f"Профилирование SQL включено, порог {threshold:g} мс.")
+        return
+    if len(parts) >= 2 and parts[1] == "off":
+        db.disable_profiling()
+        await message.answer("Профилирование SQL выключено.")
+        return
+
+    stats = db.query_stats(limit=15)
+    if stats is None:
+        await message.answer("Профилирование выключено. Включить: /dbstats on 50")
+        return
+    if not stats:
+        await message.answer("Пока пусто.")
+        return
+
+    lines = []
+    for s in stats:
+        lines.append(
+            f"{s['count']}× p50 {s['p50_ms']} / p99 {s['p99_ms']} / max {s['max_ms']} мс, всего {s['total_ms']} мс\n"
+            f"  {s['sql'][:100]}"
+        )
+    await message.answer("<pre>" + escape("\n".join(lines)[:3900]) + "</pre>")
+
+
+@router.message(Command("stalls"))
+async def stalls_cmd(message: Message, loop_monitor=None):
+    if loop_monitor is None:
+        await message.answer("Монитор цикла не запущен.")
+        return
+    stalls = loop_monitor.dump(limit=5)
+    head = f"Лаг цикла: {loop_monitor.lag * 1000:.1f} мс (макс {loop_monitor.max_lag * 1000:.1f} мс)"
+    if not stalls:
+        await message.answer(head + "\nОстановок не было.")
+        return
+
+    blocks = []
+    for s in reversed(stalls):
+        stack = "\n".join(s["stack"][-6:])
+        blocks.append(f"{s['at']} {s['lag_ms']} мс {s['handler']} update={s['update_id']}\n{stack}")
+    await message.answer(escape(head) + "\n<pre>" + escape("\n\n".join(blocks)[:3800]) + "</pre>")
+
+
+@router.message(Command("diag"))
+async def diag_cmd(message: Message, db: Storage, metrics=None, loop_monitor=None, outbox=None):
+    # /diag — снимок процесса; /diag mem on|off — tracemalloc; /diag mem — топ аллокаций
+    parts = (message.text or "").split()
+    if len(parts) >= 2 and parts[1] == "mem":
+        if len(parts) >= 3 and parts[2] == "on":
+            diagnostics.tracemalloc_start()
+            await message.answer("tracemalloc включён. Топ аллокаций: /diag mem")
+            return
+        if len(parts) >= 3 and parts[2] == "off":
+            diagnostics.tracemalloc_stop()
+            await message.answer("tracemalloc выключен.")
+            return
+        top = diagnostics.tracemalloc_top(limit=15)
+        if top is None:
+            await message.answer("tracemalloc выключен. Включить: /diag mem on")
+            return
+        await message.answer("<pre>" + escape(diagnostics.render_top(top)[:3900]) + "</pre>")
+        return
+
+    # планировщик импортируется лениво в main; если его ещё нет — и статистики нет
+    from bot.scheduler import JOB_STATS
+
+    d = diagnostics.collect(db, metrics, loop_monitor, outbox, JOB_STATS)
+    await message.answer("<pre>" + escape(diagnostics.render(d)[:3900]) + "</pre>")
+
+
+@router.message(Command("refstats"))
+async def refstats_cmd(message: Message, db: Storage):
+    # /refstats — пересчитать счётчики рефереров с нуля и показать, сколько расходилось
+    res = db.rebuild_referral_stats()
+    await message.answer(f"Счётчики рефереров пересчитаны: {res['rows']} строк, расходилось {res['mismatched']}.")
+
+
+@router.message(Command("report"))
+async def report_cmd(message: Message, db: Storage):
+    # /report [conversion|referrals|retention|cohort_kcal ...] [json|csv]; без имён — все
+    args = (message.text or "").split()[1:]
+    fmt = next((a for a in args if a in REPORT_FORMATS), "json")
+    names = [a for a in args if a in REPORTS] or None
+    unknown = [a for a in args if a not in REPORTS and a not in REPORT_FORMATS]
+    if unknown:
+        await message.answer("Отчёты: " + ", ".join(REPORTS) + "; формат: json или csv.")
+        return
+
+    if not isinstance(db, SqlReports):
+        await message.answer("Отчёты строятся только по базе SQLite.")
+        return
+    directory, paths = await run_reports(db, names, fmt)
+    try:
+        for path in paths:
+            await message.answer_document(FSInputFile(path))
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
@@ -1,16 +1,23 @@
 from datetime import datetime
+from html import escape
 
 from aiogram import Router, F
+from aiogram.filters import Command
 from aiogram.types import Message, CallbackQuery
 
-from bot.services.analyzer import analyze, to_json, from_json, apply_refinement
-from bot.services.access import is_active, ensure_status
-from bot.keyboards import refine_keyboard
+from bot.services.analyzer import analyze, to_json, apply_refinement, result_from_entry
+from bot.services.access import is_active
+from bot.keyboards import refine_keyboard, repeat_keyboard
+from bot.metrics import FUNC_SECONDS
+from bot.storage import Storage
 
 router = Router()
 
+analyze = FUNC_SECONDS.timed("analyze")(analyze)
+apply_refinement = FUNC_SECONDS.timed("apply_refinement")(apply_refinement)
 
-def _daily_tip_once(db, user_id: int, key: str) -> bool:
+
+def _daily_tip_once(db: Storage, user_id: int, key: str) -> bool:
     today = datetime.utcnow().date().isoformat()
     prev = db.get_meta(user_id, key)
     if prev == today:
@@ -20,8 +27,8 @@ def _daily_tip_once(db, user_id: int, key: str) -> bool:
 
 
 @router.message(F.photo)
-async def photo_entry(message: Message, db, user_row):
-    user = ensure_status(db, user_row)
+async def photo_entry(message: Message, db: Storage, user_row):
+    user = user_row
     if not is_active(user):
         await message.answer("Доступ ограничен: триал закончился. Чтобы продолжить — /buy")
         return
@@ -86,13 +93,10 @@ async def photo_entry(message: Message, db, user_row):
         await message.answer(resp)
 
 
-@router.message(F.text)
-async def text_entry(message: Message, db, user_row):
-    # не перехватываем команды
-    if message.text and message.text.startswith("/"):
-        return
-
-    user = ensure_status(db, user_row)
+# команды не перехватываем: иначе до misc/payments они не доходят
+@router.message(F.text, ~F.text.startswith("/"))
+async def text_entry(message: Message, db: Storage, user_row):
+    user = user_row
     if not is_active(user):
         await message.answer("Доступ ограничен: триал закончился. Чтобы продолжить — /buy")
         return
@@ -136,7 +140,7 @@ async def text_entry(message: Message, db, user_row):
 
 
 @router.callback_query(F.data.startswith("refine:"))
-async def refine(cb: CallbackQuery, db, user_row):
+async def refine(cb: CallbackQuery, db: Storage, user_row):
     # refine:<kind>:<val>:<entry_id>
     parts = (cb.data or "").split(":")
     if len(parts) != 4:
@@ -150,13 +154,13 @@ async def refine(cb: CallbackQuery, db, user_row):
         await cb.answer("Ошибка")
         return
 
-    user = ensure_status(db, user_row)
+    user = user_row
     entry = db.get_food_entry(entry_id, user.id)
     if not entry:
         await cb.answer("Запись не найдена")
         return
 
-    ar = from_json(entry["parsed_json"])
+    ar = result_from_entry(entry)
     ar2 = apply_refinement(ar, kind, val)
 
     db.update_food_entry(
@@ -183,3 +187,50 @@ async def refine(cb: CallbackQuery, db, user_row):
         f"Осталось: ~{remaining_mid} ккал (консервативно ≥{remaining_low})"
     )
     await cb.answer("Ок")
+
+
+@router.message(Command("repeat"))
+async def repeat_cmd(message: Message, db: Storage, user_row):
+    # /repeat — частые блюда; /repeat кур — по началу текста, затем по всей истории
+    user = user_row
+    if not is_active(user):
+        await message.answer("Доступ ограничен: триал закончился. Чтобы продолжить — /buy")
+        return
+
+    parts = (message.text or "").split(maxsplit=1)
+    query = parts[1].strip() if len(parts) > 1 else ""
+    meals = db.frequent_meals(user.id, prefix=query or None)
+    if not meals and query:
+        meals = db.search_meals(user.id, query)
+    if not meals:
+        await message.answer("Нечего повторить." if not query else "Ничего не нашёл.")
+        return
+    await message.answer("Что записать ещё раз?", reply_markup=repeat_keyboard(meals))
+
+
+@router.callback_query(F.data.startswith("rep:"))
+async def repeat_cb(cb: CallbackQuery, db: Storage, user_row):
+    user = user_row
+    if not is_active(user):
+        await cb.answer("Доступ ограничен", show_alert=True)
+        return
+    try:
+        entry_id = int((cb.data or "").split(":", 1)[1])
+    except ValueError:
+        await cb.answer("Ошибка")
+        return
+
+    ts = datetime.utcnow().replace(microsecond=0).isoformat()
+    new_id = db.repeat_food_entry(entry_id, user.id, ts)
+    if new_id is None:
+        await cb.answer("Запись не найдена")
+        return
+
+    entry = db.get_food_entry(new_id, user.id)
+    targets = db.get_targets(user.id)
+    low, mid, high = db.today_kcal_sum(user.id, datetime.utcnow())
+    text = f"Записал: {escape(entry['text'] or '')} — ~{entry['kcal_mid']} ккал.\nЗа сегодня: ~{mid} ккал"
+    if targets:
+        text += f"\nОсталось: ~{max(0, targets['kcal_target'] - mid)} ккал"
+    await cb.message.answer(text)
+    await cb.answer("Ок")
@@ -0,0 +1,183 @@
+import asyncio
+import csv
+import os
+import tempfile
+from datetime import date, datetime, timedelta
+
+from aiogram import F, Router
+from aiogram.dispatcher.event.bases import SkipHandler
+from aiogram.filters import Command
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.state import State, StatesGroup
+from aiogram.types import FSInputFile, Message
+
+from bot.services.export import FORMATS, export_user
+from bot.services.history import current_streak, render_days, render_periods, send_chart
+from bot.services.importer import MAX_ROWS, import_file
+from bot.storage import Storage
+
+router = Router()
+
+MAX_RANGE_DAYS = 366
+IMPORT_MAX_BYTES = 20 * 1024 * 1024   # больше бот через getFile всё равно не скачает
+IMPORT_EXTS = (".csv", ".json", ".jsonl", ".gz")
+PROGRESS_EVERY_S = 2.0
+
+
+class Imp(StatesGroup):
+    waiting = State()
+
+
+async def _history(message: Message, db: Storage, user_row, start: date, end: date):
+    targets = db.get_targets(user_row.id)
+    if not targets:
+        await message.answer("Сначала заполни анкету: /start")
+        return
+    target = targets["kcal_target"]
+    span = (end - start).days + 1
+    if span <= 14:
+        text = render_days(db, user_row.id, target, start, end)
+    else:
+        text = render_periods(db, user_row.id, target, start, end, by="week" if span <= 62 else "month")
+    streak = current_streak(db, user_row.id, target, datetime.utcnow().date())
+    if streak:
+        text += f"\nСерия дней в норме: {streak}"
+    await message.answer(text)
+
+
+@router.message(Command("week"))
+async def week_cmd(message: Message, db: Storage, user_row):
+    today = datetime.utcnow().date()
+    await _history(message, db, user_row, today - timedelta(days=6), today)
+
+
+@router.message(Command("month"))
+async def month_cmd(message: Message, db: Storage, user_row):
+    today = datetime.utcnow().date()
+    await _history(message, db, user_row, today - timedelta(days=29), today)
+
+
+@router.message(Command("range"))
+async def range_cmd(message: Message, db: Storage, user_row):
+    # /range 2026-01-01 2026-03-31
+    parts = (message.text or "").split()
+    try:
+        start, end = date.fromisoformat(parts[1]), date.fromisoformat(parts[2])
+    except (IndexError, ValueError):
+        await message.answer("Формат: /range 2026-01-01 2026-03-31")
+        return
+    if end < start:
+        start, end = end, start
+    if (end - start).days >= MAX_RANGE_DAYS:
+        await message.answer(f"Не больше {MAX_RANGE_DAYS} дней за раз.")
+        return
+    await _history(message, db, user_row, start, end)
+
+
+@router.message(Command("chart"))
+async def chart_cmd(message: Message, db: Storage, user_row, bot):
+    # /chart — 7 дней, /chart 30 — 30 дней
+    parts = (message.text or "").split()
+    span = 30 if len(parts) > 1 and parts[1] == "30" else 7
+    targets = db.get_targets(user_row.id)
+    if not targets:
+        await message.answer("Сначала заполни анкету: /start")
+        return
+    await send_chart(bot, db, user_row.id, message.chat.id, targets["kcal_target"], span, datetime.utcnow().date())
+
+
+@router.message(Command("export"))
+async def export_cmd(message: Message, db: Storage, user_row, cfg):
+    # /export [csv|json]; админ/поддержка: /export [csv|json] <tg_id>
+    fmt, target = "csv", user_row
+    for arg in (message.text or "").split()[1:]:
+        if arg in FORMATS:
+            fmt = arg
+        elif arg.isdigit() and message.from_user.id in cfg.admin_ids:
+            target = db.find_user(int(arg))
+            if target is None:
+                await message.answer("Пользователь не найден.")
+                return
+
+    path, n = await export_user(db, target.id, fmt)
+    try:
+        if n == 0:
+            await message.answer("Записей пока нет.")
+            return
+        name = f"food_{target.tg_id}_{datetime.utcnow():%Y%m%d}" + (".csv.gz" if fmt == "csv" else ".jsonl.gz")
+        await message.answer_document(FSInputFile(path, filename=name), caption=f"Записей: {n}")
+    finally:
+        os.unlink(path)
+
+
+@router.message(Command("import"))
+async def import_cmd(message: Message, state: FSMContext):
+    await state.set_state(Imp.waiting)
+    await message.answer(
+        "Пришли файл с историей: CSV с заголовком или JSON/JSONL (можно .gz), до 20 МБ.\n"
+        "Нужны колонки с датой (date/ts) и блюдом (food/name/text); калории (kcal/calories) — "
+        "если есть, иначе оценю сам. Повторный импорт того же файла дублей не создаст.\n"
+        "Передумал — /cancel."
+    )
+
+
+@router.message(Imp.waiting, Command("cancel"))
+async def import_cancel(message: Message, state: FSMContext):
+    await state.clear()
+    await message.answer("Импорт отменён.")
+
+
+@router.message(Imp.waiting, ~F.document)
+async def import_abandoned(message: Message, state: FSMContext):
+    # вместо файла пришло что-то другое — импорт бросили: выходим из ожидания
+    # и отдаём сообщение обычным хэндлерам (текст запишется как еда, команда выполнится)
+    await state.clear()
+    raise SkipHandler()
+
+
+@router.message(Imp.waiting, F.document)
+async def import_file_step(message: Message, db: Storage, user_row, state: FSMContext):
+    doc = message.document
+    name = (doc.file_name or "").lower()
+    if not name.endswith(IMPORT_EXTS):
+        await message.answer("Нужен .csv, .json, .jsonl или .gz.")
+        return
+    if doc.file_size and doc.file_size > IMPORT_MAX_BYTES:
+        await message.answer("Файл больше 20 МБ — раздели его на части.")
+        return
+    await state.clear()
+
+    fd, path = tempfile.mkstemp(prefix="import_")
+    os.close(fd)
+    try:
+        await message.bot.download(doc, destination=path)
+        status = await message.answer("Импорт: читаю файл…")
+        progress: dict = {}
+        task = asyncio.create_task(import_file(db, user_row.id, path, progress))
+        shown = None
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=PROGRESS_EVERY_S)
+            if done:
+                break
+            line = f"Импорт: прочитано {progress.get('read', 0)}, добавлено {progress.get('inserted', 0)}…"
+            if line != shown:
+                shown = line
+                await status.edit_text(line)
+        try:
+            res = task.result()
+        except (ValueError, csv.Error) as e:
+            await status.edit_text(f"Не получилось разобрать файл: {e}")
+            return
+        text = f"Импорт готов: добавлено {res['inserted']} записей."
+        if res["duplicates"]:
+            text += f"\nУже были: {res['duplicates']}."
+        if res["bad"]:
+            text += f"\nПропущено строк без даты или блюда: {res['bad']}."
+        if res["analyzed"]:
+            text += f"\nКалории оценены автоматически для {res['analyzed']} блюд."
+        if res["truncated"]:
+            text += (f"\nФайл длиннее {MAX_ROWS} строк: прочитаны первые {MAX_ROWS}, остальное пропущено. "
+                     "Пришли остаток отдельным файлом — уже добавленное не задвоится.")
+        await status.edit_text(text)
+    finally:
+        os.unlink(path)
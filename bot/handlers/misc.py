@@ -1,15 +1,20 @@
+from dataclasses import asdict
+from datetime import datetime
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
 from aiogram import Router
 from aiogram.filters import Command
 from aiogram.types import Message
 
-from bot.services.access import ensure_status, is_active
+from bot.services.access import is_active
+from bot.services.tdee import add_weight, estimate_tdee, load_state
+from bot.storage import Storage
 
 router = Router()
 
 
 @router.message(Command("help"))
-async def help_cmd(message: Message, db, user_row):
-    ensure_status(db, user_row)
+async def help_cmd(message: Message, db: Storage, user_row):
     await message.answer(
         "Как пользоваться:\n"
         "1) Фото еды + 1 фраза комментария (что это и примерно сколько/как приготовлено)\n"
@@ -17,16 +22,23 @@ async def help_cmd(message: Message, db, user_row):
         "3) Если есть возможность — положи в кадр банковскую карту (референс размера).\n\n"
         "Команды:\n"
         "/today — итоги дня\n"
+        "/week, /month — история по дням и неделям; /range 2026-01-01 2026-03-31 — за период\n"
+        "/chart [30] — график ккал за 7 (или 30) дней\n"
+        "/repeat [начало] — повторить частое блюдо одним тапом\n"
+        "/export [csv|json] — выгрузить всю историю файлом\n"
+        "/import — загрузить историю из другого приложения (CSV/JSON)\n"
         "/beta — статус доступа\n"
-        "/invite — промокод для рекомендаций\n"
+        "/invite — промокод для рекомендаций; /top — рейтинг приглашений\n"
         "/promo <CODE> — применить промокод\n"
+        "/tz Europe/Moscow — часовой пояс для вечернего итога\n"
+        "/weight 62.5 — записать вес (цель подстраивается по тренду)\n"
         "/buy — оплата (если подключена)"
     )
 
 
 @router.message(Command("today"))
-async def today_cmd(message: Message, db, user_row):
-    user = ensure_status(db, user_row)
+async def today_cmd(message: Message, db: Storage, user_row):
+    user = user_row
 
     targets = db.get_targets(user.id)
     if not targets:
@@ -45,8 +57,8 @@ async def today_cmd(message: Message, db, user_row):
 
 
 @router.message(Command("beta"))
-async def beta_cmd(message: Message, db, user_row):
-    u = ensure_status(db, user_row)
+async def beta_cmd(message: Message, db: Storage, user_row):
+    u = user_row
     status = u.status
     trial_end = u.trial_end or "—"
     paid_until = u.paid_until or "—"
@@ -64,20 +76,43 @@ async def beta_cmd(message: Message, db, user_row):
 
 
 @router.message(Command("invite"))
-async def invite_cmd(message: Message, db, user_row):
-    u = ensure_status(db, user_row)
+async def invite_cmd(message: Message, db: Storage, user_row):
+    u = user_row
     code = db.get_or_create_promo_code(u.id)
+    st = db.referral_stats(u.id)
+    stats = ""
+    if st["invited"]:
+        stats = (f"\n\nПо твоему коду: {st['invited']} чел., оплатили {st['paid']}, "
+                 f"тебе начислено +{st['reward_days']} дн. Рейтинг: /top")
     await message.answer(
         f"Твой промокод: <code>{code}</code>\n\n"
         "Условия:\n"
         "— Новому пользователю: -50% на 1 месяц (при первой оплате)\n"
         "— Тебе: +7 дней после первой оплаты приглашённого"
+        f"{stats}"
     )
 
 
+@router.message(Command("top"))
+async def top_cmd(message: Message, db: Storage, user_row):
+    top = db.referral_top(10)
+    if not top:
+        await message.answer("Рейтинг пока пуст. Твой код: /invite")
+        return
+    lines = ["Топ по приглашениям (оплатили / пришли):"]
+    for i, r in enumerate(top, 1):
+        me = " — это ты" if r["user_id"] == user_row.id else ""
+        lines.append(f"{i}. {r['paid']} / {r['invited']}{me}")
+    rank = db.referral_rank(user_row.id)
+    if rank is not None and rank > len(top):
+        st = db.referral_stats(user_row.id)
+        lines.append(f"…\n{rank}. {st['paid']} / {st['invited']} — это ты")
+    await message.answer("\n".join(lines))
+
+
 @router.message(Command("promo"))
-async def promo_cmd(message: Message, db, user_row):
-    u = ensure_status(db, user_row)
+async def promo_cmd(message: Message, db: Storage, user_row):
+    u = user_row
     text = (message.text or "").strip()
     parts = text.split(maxsplit=1)
     if len(parts) < 2:
@@ -87,3 +122,47 @@ async def promo_cmd(message: Message, db, user_row):
     code = parts[1].strip().upper()
     ok, msg, _referrer = db.apply_promo_for_new_user(u.id, code)
     await message.answer(msg)
+
+
+@router.message(Command("tz"))
+async def tz_cmd(message: Message, db: Storage, user_row, cfg):
+    parts = (message.text or "").strip().split(maxsplit=1)
+    if len(parts) < 2:
+        await message.answer(f"Формат: /tz Europe/Moscow\nСейчас: {user_row.tz or cfg.tz}")
+        return
+
+    tz = parts[1].strip()
+    try:
+        ZoneInfo(tz)
+    except (ZoneInfoNotFoundError, ValueError):
+        await message.answer("Не знаю такой часовой пояс. Пример: Europe/Moscow, Asia/Yerevan")
+        return
+    db.set_user_tz(user_row.id, tz)
+    await message.answer(f"Часовой пояс: {tz}. Итог дня придёт вечером по местному времени.")
+
+
+@router.message(Command("weight"))
+async def weight_cmd(message: Message, db: Storage, user_row, cfg):
+    parts = (message.text or "").strip().split(maxsplit=1)
+    try:
+        kg = float(parts[1].replace(",", "."))
+        if kg < 30 or kg > 200:
+            raise ValueError
+    except (IndexError, ValueError):
+        await message.answer("Формат: /weight 62.5")
+        return
+    if not db.get_profile(user_row.id):
+        await message.answer("Сначала заполни анкету: /start")
+        return
+
+    day = datetime.now(ZoneInfo(user_row.tz or cfg.tz)).date().isoformat()
+    st = add_weight(load_state(db, user_row.id), day, kg)
+    db.log_weight(user_row.id, day, kg, asdict(st))
+
+    text = f"Вес записан: {kg:g} кг.\nТренд: {st.weight:.1f} кг ({st.weight_slope * 7:+.2f} кг/нед)"
+    tdee = estimate_tdee(st)
+    if tdee is not None:
+        text += f"\nОценка расхода: ~{int(round(tdee))} ккал/день"
+    else:
+        text += "\nЦель начнёт подстраиваться через 2 недели взвешиваний и записей еды."
+    await message.answer(text)
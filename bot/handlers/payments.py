@@ -1,26 +1,16 @@
-from datetime import datetime, timedelta
-
 from aiogram import Router
 from aiogram.filters import Command
 from aiogram.types import Message, LabeledPrice, PreCheckoutQuery
 
-from bot.services.access import ensure_status
-
-router = Router()
+from bot.storage import Storage
 
 
-def _parse_paid_until(s: str | None) -> datetime | None:
-    if not s:
-        return None
-    try:
-        return datetime.fromisoformat(s)
-    except Exception:
-        return None
+router = Router()
 
 
 @router.message(Command("buy"))
-async def buy_cmd(message: Message, db, user_row, bot, cfg):
-    u = ensure_status(db, user_row)
+async def buy_cmd(message: Message, db: Storage, user_row, bot, cfg):
+    u = user_row
 
     if not cfg.provider_token:
         await message.answer("Оплата пока не подключена. Тестовый доступ активен.")
@@ -57,31 +47,19 @@ async def pre_checkout(preq: PreCheckoutQuery, bot):
 
 
 @router.message(lambda m: m.successful_payment is not None)
-async def successful_payment(message: Message, db, user_row, bot):
-    u = ensure_status(db, user_row)
-
-    now = datetime.utcnow()
-    current_paid = _parse_paid_until(u.paid_until)
-
-    # если уже оплачено и срок в будущем — продлеваем оттуда, иначе от сейчас
-    base = current_paid if (current_paid and current_paid > now) else now
-    new_paid_until = (base + timedelta(days=30)).replace(microsecond=0).isoformat()
-
-    db.set_paid_until(u.id, new_paid_until)
-
-    # если пользователь пришёл по рефералке — отмечаем первую оплату и начисляем рефереру +7 дней
-    db.mark_first_payment(u.id)
-    referrer_user_id = db.reward_referrer_if_paid(u.id, days=7)
-    if referrer_user_id:
-        # пробуем уведомить реферера (если известен chat_id)
-        ref_row = db.conn.execute("SELECT chat_id FROM users WHERE id=?", (referrer_user_id,)).fetchone()
-        if ref_row and ref_row["chat_id"]:
-            try:
-                await bot.send_message(
-                    chat_id=int(ref_row["chat_id"]),
-                    text="Твой друг оплатил подписку 🎉 Начислил тебе +7 дней бесплатно.",
-                )
-            except Exception:
-                pass
-
-    await message.answer(f"Оплата прошла. Доступ активен до: {new_paid_until}")
+async def successful_payment(message: Message, db: Storage, user_row, bot, outbox):
+    sp = message.successful_payment
+    # всё — одной транзакцией; повторная доставка того же платежа срок второй раз не продлит
+    res = db.apply_payment(
+        user_row.id, sp.telegram_payment_charge_id, sp.provider_payment_charge_id,
+        sp.total_amount, sp.currency, sp.invoice_payload, days=30, reward_days=7,
+    )
+
+    if res["referrer_chat_id"]:
+        # уже после коммита: уходит через очередь с низким приоритетом, ошибки логирует outbox
+        outbox.notify(bot.send_message(
+            chat_id=res["referrer_chat_id"],
+            text="Твой друг оплатил подписку 🎉 Начислил тебе +7 дней бесплатно.",
+        ))
+
+    await message.answer(f"Оплата прошла. Доступ активен до: {res['paid_until']}")
@@ -5,7 +5,8 @@ from aiogram.fsm.state import StatesGroup, State
 from aiogram.types import Message, CallbackQuery
 
 from bot.keyboards import activity_keyboard, goal_keyboard
-from bot.services.access import ensure_status
+from bot.services.targets import FORMULA_VERSION, compute_targets
+from bot.storage import Storage
 
 router = Router()
 
@@ -21,44 +22,8 @@ class Onb(StatesGroup):
     palm_w = State()
 
 
-def _calc_targets(sex: str, age: int, height_cm: float, weight_kg: float, activity: str, goal: str):
-    """
-    Упрощённая формула Mifflin–St Jeor + множители активности.
-    Это MVP: достаточно стабильно для старта.
-    """
-    if sex == "m":
-        bmr = 10 * weight_kg + 6.25 * height_cm - 5 * age + 5
-    else:
-        bmr = 10 * weight_kg + 6.25 * height_cm - 5 * age - 161
-
-    af = {
-        "sedentary": 1.2,
-        "light": 1.375,
-        "moderate": 1.55,
-        "high": 1.725,
-        "athlete": 1.9,
-    }.get(activity, 1.375)
-
-    tdee = bmr * af
-
-    if goal == "lose":
-        kcal = int(round(tdee - 400))
-    elif goal == "gain":
-        kcal = int(round(tdee + 300))
-    else:
-        kcal = int(round(tdee))
-
-    kcal = max(1200, kcal)  # нижняя страховка для MVP
-
-    # очень грубо, но полезно как ориентир
-    protein_g = int(round(weight_kg * (1.6 if goal == "lose" else 1.4)))
-    fiber_g = 25 if sex == "f" else 30
-    return kcal, protein_g, fiber_g
-
-
 @router.message(Command("start"))
-async def start_cmd(message: Message, db, user_row, state: FSMContext):
-    ensure_status(db, user_row)
+async def start_cmd(message: Message, db: Storage, user_row, state: FSMContext):
     await state.clear()
     await state.set_state(Onb.sex)
     await message.answer("Анкета. Пол? Ответь одной буквой: f / m")
@@ -127,7 +92,7 @@ async def activity_cb(cb: CallbackQuery, state: FSMContext):
 
 
 @router.callback_query(Onb.goal, F.data.startswith("goal:"))
-async def goal_cb(cb: CallbackQuery, db, user_row, state: FSMContext):
+async def goal_cb(cb: CallbackQuery, db: Storage, user_row, state: FSMContext):
     goal = cb.data.split(":", 1)[1]
     await state.update_data(goal=goal)
 
@@ -138,7 +103,7 @@ async def goal_cb(cb: CallbackQuery, db, user_row, state: FSMContext):
     weight_kg = float(data["weight_kg"])
     activity = data["activity"]
 
-    user = ensure_status(db, user_row)
+    user = user_row
 
     db.upsert_profile(
         user_id=user.id,
@@ -152,8 +117,9 @@ async def goal_cb(cb: CallbackQuery, db, user_row, state: FSMContext):
         palm_w_cm=None,
     )
 
-    kcal, protein_g, fiber_g = _calc_targets(sex, age, height_cm, weight_kg, activity, goal)
-    db.upsert_targets(user.id, kcal_target=kcal, protein_g=protein_g, fiber_g=fiber_g)
+    kcal, protein_g, fiber_g = compute_targets(sex, age, height_cm, weight_kg, activity, goal)
+    db.upsert_targets(user.id, kcal_target=kcal, protein_g=protein_g, fiber_g=fiber_g,
+                      formula_version=FORMULA_VERSION)
 
     await cb.message.answer(
         f"Готово.\n"
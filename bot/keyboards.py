@@ -36,3 +36,11 @@ def goal_keyboard() -> InlineKeyboardMarkup:
          InlineKeyboardButton(text="Поддержание", callback_data="goal:maintain"),
          InlineKeyboardButton(text="Набор", callback_data="goal:gain")]
     ])
+
+def repeat_keyboard(meals: list[dict]) -> InlineKeyboardMarkup:
+    rows = []
+    for m in meals:
+        label = m["norm_text"] if len(m["norm_text"]) <= 40 else m["norm_text"][:39] + "…"
+        rows.append([InlineKeyboardButton(text=f"{label} · ~{m['kcal_mid']}",
+                                          callback_data=f"rep:{m['entry_id']}")])
+    return InlineKeyboardMarkup(inline_keyboard=rows)
@@ -0,0 +1,114 @@
+from __future__ import annotations
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from datetime import datetime
+
+from bot.metrics import REGISTRY
+
+log = logging.getLogger(__name__)
+
+LOOP_LAG = REGISTRY.gauge("bot_event_loop_lag_seconds", "Last measured event loop lag")
+LOOP_STALLS = REGISTRY.counter("bot_event_loop_stalls_total", "Event loop stalls over threshold", ("handler",))
+
+
+def _task_name(task) -> str:
+    coro = task.get_coro() if task is not None else None
+    return getattr(coro, "__qualname__", None) or (task.get_name() if task is not None else "<callback>")
+
+
+class LoopLagMonitor:
+    """
+    Сэмплер задержки цикла событий.
+    Корутина-пульс раз в interval отмечает время; сторожевой поток, увидев, что пульса нет
+    дольше interval + threshold, снимает стек потока цикла и по MetricsMiddleware.active
+    находит апдейт и хэндлер, которые сейчас держат цикл. Остановки — в кольцевом буфере.
+    """
+
+    def __init__(self, metrics_mw=None, interval: float = 0.1, threshold: float = 0.1,
+                 capacity: int = 50, stack_depth: int = 12):
+        self.mw = metrics_mw
+        self.interval = interval
+        self.threshold = threshold
+        self.stack_depth = stack_depth
+        self.stalls: deque[dict] = deque(maxlen=capacity)
+        self.lag = 0.0
+        self.max_lag = 0.0
+
+        self._beat = time.perf_counter()
+        self._captured: dict | None = None  # остановка, пойманная в текущем «молчании» цикла
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._loop_thread: int | None = None
+        self._task: asyncio.Task | None = None
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self._beat = time.perf_counter()
+        self._task = self._loop.create_task(self._pulse())
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._watch, name="loop-lag-watchdog", daemon=True)
+        self._thread.start()
+
+    async def stop(self):
+        self._stop.set()
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        if self._thread:
+            self._thread.join(timeout=1)
+
+    async def _pulse(self):
+        while True:
+            start = time.perf_counter()
+            self._beat = start
+            await asyncio.sleep(self.interval)
+            now = time.perf_counter()
+            self.lag = max(0.0, now - start - self.interval)
+            self.max_lag = max(self.max_lag, self.lag)
+            LOOP_LAG.set(round(self.lag, 6))
+            captured, self._captured = self._captured, None
+            if captured is not None:
+                captured["lag_ms"] = round(self.lag * 1000, 1)
+                log.warning("event loop stalled %.0f ms in %s (update %s)",
+                            captured["lag_ms"], captured["handler"], captured["update_id"])
+
+    def _watch(self):
+        step = min(self.interval, self.threshold) / 2
+        while not self._stop.wait(step):
+            silent = time.perf_counter() - self._beat
+            if silent > self.interval + self.threshold and self._captured is None:
+                self._captured = self._capture(silent)
+
+    def _capture(self, silent: float) -> dict:
+        task = asyncio.current_task(self._loop)     # с явным loop работает и из чужого потока
+        info = self.mw.active.get(task) if (self.mw is not None and task is not None) else None
+        if info is not None:
+            handler, update_id = info[0], info[1]
+        else:
+            handler, update_id = _task_name(task), None
+
+        frame = sys._current_frames().get(self._loop_thread)
+        stack = traceback.format_stack(frame, limit=self.stack_depth) if frame is not None else []
+        stall = {
+            "at": datetime.utcnow().replace(microsecond=0).isoformat(),
+            "handler": handler,
+            "update_id": update_id,
+            "lag_ms": round((silent - self.interval) * 1000, 1),  # уточнится, когда цикл оживёт
+            "stack": [line.rstrip() for line in stack],
+        }
+        self.stalls.append(stall)
+        LOOP_STALLS.inc(handler)
+        return stall
+
+    def dump(self, limit: int = 10) -> list[dict]:
+        return list(self.stalls)[-limit:]
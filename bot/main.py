@@ -1,4 +1,8 @@
+# первым делом: отсюда считаются стартовые метрики
+from bot.startup import mark, warm_up, FirstReplyProbe
+
 import asyncio
+import logging
 
 from aiogram import Bot, Dispatcher
 from aiogram.client.default import DefaultBotProperties
@@ -7,32 +11,121 @@ from aiogram.enums import ParseMode
 from bot.config import load_config
 from bot.db import DB
 from bot.middleware import DbUserMiddleware
+from bot.metrics import MetricsMiddleware, RequestMetrics, instrument_db, register_runtime
+from bot.outbox import Outbox
 
 from bot.handlers.start import router as start_router
 from bot.handlers.food import router as food_router
 from bot.handlers.misc import router as misc_router
+from bot.handlers.history import router as history_router
 from bot.handlers.payments import router as payments_router
+from bot.handlers.admin import router as admin_router
+
+log = logging.getLogger(__name__)
+
+
+def build_dispatcher(cfg, db, outbox, metrics: MetricsMiddleware | None = None) -> Dispatcher:
+    dp = Dispatcher()
+    dp["outbox"] = outbox
+    dp["cfg"] = cfg
+
+    dp.update.middleware(DbUserMiddleware(db=db, cfg=cfg))
+    if metrics is not None:
+        dp["metrics"] = metrics
+        dp.message.middleware(metrics)
+        dp.callback_query.middleware(metrics)
+        dp.pre_checkout_query.middleware(metrics)
+
+    # history раньше food: пока ждём файл импорта (Imp.waiting), текст сначала видит history
+    for router in (start_router, history_router, food_router, misc_router, payments_router, admin_router):
+        # роутеры модульные: в бенчмарках/тестах диспетчер собирается не один раз за процесс.
+        # Публичного способа отцепить роутер в aiogram нет (сеттер parent_router повторную привязку
+        # запрещает), поэтому _parent_router сбрасываем напрямую — это внутренность aiogram 3.6
+        # (версия закреплена в requirements.txt); при обновлении aiogram проверить это место.
+        parent = router.parent_router
+        if parent is not None:
+            parent.sub_routers.remove(router)
+            router._parent_router = None
+        dp.include_router(router)
+    return dp
+
+
+async def _after_polling_started(db, bot, outbox, cfg, state: dict):
+    # всё, что не нужно для первого ответа, — после старта поллинга
+    from bot.scheduler import build_scheduler
+
+    scheduler = build_scheduler(db, bot, outbox, cfg)
+    scheduler.start()
+    state["scheduler"] = scheduler
+    if cfg.metrics_port:
+        from bot.metrics import start_http
+
+        state["metrics_http"] = await start_http(cfg.metrics_host, cfg.metrics_port)
+    if cfg.warmup:
+        await warm_up(db)
 
 
 async def main():
+    logging.basicConfig(level=logging.INFO)
     cfg = load_config()
-    db = DB(cfg.db_path)
+    db = instrument_db(DB(cfg.db_path))
+    if cfg.db_profile_ms is not None:
+        db.enable_profiling(cfg.db_profile_ms)
+    mark("db_ready")
 
     bot = Bot(
         token=cfg.bot_token,
         default=DefaultBotProperties(parse_mode=ParseMode.HTML),
     )
-    dp = Dispatcher()
+    outbox = Outbox()
+    bot.session.middleware(FirstReplyProbe())
+    bot.session.middleware(outbox)
+    bot.session.middleware(RequestMetrics())
 
-    dp.update.middleware(DbUserMiddleware(db=db, cfg=cfg))
+    metrics = MetricsMiddleware()
+    register_runtime(db, outbox, metrics)
+    dp = build_dispatcher(cfg, db, outbox, metrics)
+    recorder = None
+    if cfg.record_updates:
+        from bot.recorder import UpdateRecorder   # запись апдейтов включается редко — модуль только по флагу
 
-    dp.include_router(start_router)
-    dp.include_router(food_router)
-    dp.include_router(misc_router)
-    dp.include_router(payments_router)
+        salt = cfg.record_salt.encode() if cfg.record_salt else None
+        recorder = UpdateRecorder(cfg.record_updates, salt)
+        dp.update.outer_middleware(recorder)
+    state: dict = {}
+    background: set[asyncio.Task] = set()
+
+    async def on_startup():
+        mark("polling_started")
+        # монитор лага — сразу со стартом поллинга (до него цикл всё равно занят только запуском);
+        # dp["loop_monitor"] читается на каждом апдейте, так что /stalls и /diag видят его с первого
+        from bot.looplag import LoopLagMonitor
+
+        state["loop_monitor"] = dp["loop_monitor"] = LoopLagMonitor(metrics)
+        state["loop_monitor"].start()
+        task = asyncio.create_task(_after_polling_started(db, bot, outbox, cfg, state))
+        background.add(task)
+        task.add_done_callback(background.discard)
+
+    dp.startup.register(on_startup)
 
     await bot.delete_webhook(drop_pending_updates=True)
-    await dp.start_polling(bot)
+    try:
+        await dp.start_polling(bot)
+    finally:
+        if "scheduler" in state:
+            state["scheduler"].shutdown(wait=False)
+        if "metrics_http" in state:
+            await state["metrics_http"].cleanup()
+        if "loop_monitor" in state:
+            await state["loop_monitor"].stop()
+        from bot.services.chart import shutdown_pool
+
+        shutdown_pool()
+        await outbox.close()
+        if recorder is not None:
+            recorder.close()
+        db.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,298 @@
+from __future__ import annotations
+import asyncio
+import functools
+import logging
+import threading
+import time
+from bisect import bisect_left
+from typing import Any, Callable, Iterable
+
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+
+log = logging.getLogger(__name__)
+
+# секунды; от микросекундных обращений к кэшу до долгих отправок
+DEFAULT_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+def _escape(v) -> str:
+    return str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _fmt_labels(names: tuple[str, ...], values: tuple, le: str | None = None) -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if le is not None:
+        parts.append(f'le="{le}"')
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = (), buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        self._series: dict[tuple, list] = {}  # labels -> [counts per bucket + inf, sum]
+
+    def observe(self, value: float, *labels):
+        s = self._series.get(labels)
+        if s is None:
+            s = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        s[0][bisect_left(self.buckets, value)] += 1
+        s[1] += value
+
+    def timed(self, *labels) -> Callable:
+        def deco(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                t = time.perf_counter()
+                try:
+                    return fn(*args, **kwargs)
+                finally:
+                    self.observe(time.perf_counter() - t, *labels)
+            return wrapper
+        return deco
+
+    def count(self, *labels) -> int:
+        s = self._series.get(labels)
+        return sum(s[0]) if s else 0
+
+    def quantile(self, q: float, *labels) -> float:
+        """Оценка квантиля по бакетам (верхняя граница бакета)."""
+        s = self._series.get(labels)
+        if not s:
+            return 0.0
+        total = sum(s[0])
+        rank = q * total
+        acc = 0
+        for i, c in enumerate(s[0]):
+            acc += c
+            if acc >= rank and c:
+                return self.buckets[i] if i < len(self.buckets) else float("inf")
+        return float("inf")
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        for labels, (counts, total) in sorted(self._series.items()):
+            acc = 0
+            for bound, c in zip(self.buckets, counts):
+                acc += c
+                yield f"{self.name}_bucket{_fmt_labels(self.labels, labels, str(bound))} {acc}"
+            acc += counts[-1]
+            yield f"{self.name}_bucket{_fmt_labels(self.labels, labels, '+Inf')} {acc}"
+            yield f"{self.name}_sum{_fmt_labels(self.labels, labels)} {total}"
+            yield f"{self.name}_count{_fmt_labels(self.labels, labels)} {acc}"
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, *labels, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def set_function(self, fn: Callable[[], float], *labels):
+        # счётчик, который ведёт сам объект (например, итоги outbox): читается в момент выгрузки
+        self._values[labels] = fn
+
+    def value(self, *labels) -> float:
+        v = self._values.get(labels, 0)
+        return v() if callable(v) else v
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        for labels in sorted(self._values):
+            yield f"{self.name}{_fmt_labels(self.labels, labels)} {self.value(*labels)}"
+
+
+class Gauge:
+    """Значение либо выставляется set(), либо читается функцией в момент выгрузки."""
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values: dict[tuple, Any] = {}
+
+    def set(self, value: float, *labels):
+        self._values[labels] = value
+
+    def set_function(self, fn: Callable[[], float], *labels):
+        self._values[labels] = fn
+
+    def value(self, *labels) -> float:
+        v = self._values.get(labels, 0)
+        return v() if callable(v) else v
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} gauge"
+        for labels in sorted(self._values):
+            try:
+                v = self.value(*labels)
+            except Exception:
+                continue
+            yield f"{self.name}{_fmt_labels(self.labels, labels)} {v}"
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: dict[str, Any] = {}
+
+    def _add(self, metric):
+        existing = self._metrics.get(metric.name)
+        if existing is not None:
+            return existing
+        self._metrics[metric.name] = metric
+        return metric
+
+    def histogram(self, name: str, help: str, labels: tuple[str, ...] = (), buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+        return self._add(Histogram(name, help, labels, buckets))
+
+    def counter(self, name: str, help: str, labels: tuple[str, ...] = ()) -> Counter:
+        return self._add(Counter(name, help, labels))
+
+    def gauge(self, name: str, help: str, labels: tuple[str, ...] = ()) -> Gauge:
+        return self._add(Gauge(name, help, labels))
+
+    def get(self, name: str):
+        return self._metrics.get(name)
+
+    def render(self) -> str:
+        lines: list[str] = []
+        for m in self._metrics.values():
+            lines.extend(m.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+HANDLER_SECONDS = REGISTRY.histogram("bot_handler_seconds", "Handler latency", ("handler",))
+HANDLER_ERRORS = REGISTRY.counter("bot_handler_errors_total", "Handler exceptions", ("handler",))
+UPDATES_IN_FLIGHT = REGISTRY.gauge("bot_updates_in_flight", "Updates being handled right now")
+QUERY_SECONDS = REGISTRY.histogram("bot_db_query_seconds", "DB method latency", ("query",))
+FUNC_SECONDS = REGISTRY.histogram("bot_function_seconds", "CPU-bound helpers latency", ("name",))
+TG_REQUEST_SECONDS = REGISTRY.histogram("bot_telegram_request_seconds", "Bot API request latency", ("method",))
+UPDATES_IN_FLIGHT.set(0)
+
+
+class MetricsMiddleware(BaseMiddleware):
+    """
+    Inner-middleware: вешается на dp.message / dp.callback_query / ...,
+    к этому моменту aiogram уже выбрал хэндлер и кладёт его в data["handler"].
+    """
+
+    def __init__(self):
+        self.hist = HANDLER_SECONDS
+        self.errors = HANDLER_ERRORS
+        # задача asyncio -> (хэндлер, update_id, старт); по ней монитор цикла находит виновника
+        self.active: dict[asyncio.Task, tuple[str, int | None, float]] = {}
+
+    @property
+    def in_flight(self) -> int:
+        return len(self.active)
+
+    async def __call__(self, handler, event, data: dict):
+        h = data.get("handler")
+        name = h.callback.__name__ if h is not None else "unknown"
+        task = asyncio.current_task()
+        t = time.perf_counter()
+        self.active[task] = (name, getattr(data.get("event_update"), "update_id", None), t)
+        try:
+            return await handler(event, data)
+        except Exception:
+            self.errors.inc(name)
+            raise
+        finally:
+            self.hist.observe(time.perf_counter() - t, name)
+            self.active.pop(task, None)
+
+
+class RequestMetrics(BaseRequestMiddleware):
+    """Время запросов к Bot API; регистрировать после Outbox, чтобы не считать ожидание в очереди."""
+
+    async def __call__(self, make_request, bot, method):
+        t = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        finally:
+            TG_REQUEST_SECONDS.observe(time.perf_counter() - t, method.__api_method__)
+
+
+# только запросы из хэндлеров и планировщика; админка, обслуживание (flush/merge/warm-up/импорт)
+# и генераторы-пачки в латентность запросов не смешиваем
+QUERY_METHODS = (
+    "add_food_entry", "apply_payment", "apply_promo_for_new_user", "bulk_upsert_targets",
+    "expire_subscriptions", "expire_trials", "find_user", "frequent_meals", "get_discount_for_user",
+    "get_food_entry", "get_meta", "get_or_create_promo_code", "get_or_create_user", "get_profile",
+    "get_targets", "get_tdee_state", "log_weight", "mark_summary_sent", "referral_rank", "referral_stats",
+    "referral_top", "repeat_food_entry", "rollups", "save_tdee_states", "search_meals", "set_meta",
+    "set_paid_until", "set_user_status", "set_user_tz", "tdee_states", "today_kcal_sum",
+    "update_food_entry", "upsert_profile", "upsert_targets", "user_timezones", "weight_history",
+)
+
+
+def instrument_db(db, hist: Histogram = QUERY_SECONDS, methods: Iterable[str] = QUERY_METHODS):
+    """
+    Оборачивает методы-запросы экземпляра DB: время каждого вызова под его именем.
+    Вложенные вызовы (repeat_food_entry -> add_food_entry) пишутся только внешним методом.
+    """
+    local = threading.local()
+
+    def timed(name, fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if getattr(local, "inside", False):
+                return fn(*args, **kwargs)
+            local.inside = True
+            t = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                local.inside = False
+                hist.observe(time.perf_counter() - t, name)
+        return wrapper
+
+    for name in methods:
+        setattr(db, name, timed(name, getattr(db, name)))
+    return db
+
+
+def register_runtime(db, outbox, mw: MetricsMiddleware | None = None, registry: Registry = REGISTRY):
+    caches = registry.gauge("bot_cache_hit_ratio", "Cache hit ratio", ("cache",))
+    sizes = registry.gauge("bot_cache_size", "Cache entries", ("cache",))
+    for name, cache in db.caches.items():
+        caches.set_function(cache.hit_rate, name)
+        sizes.set_function(cache.__len__, name)
+    registry.gauge("bot_meta_dirty", "user_meta keys waiting for flush").set_function(db.meta_pending)
+    registry.gauge("bot_outbox_depth", "Messages waiting in outbox").set_function(outbox.depth)
+    sent = registry.counter("bot_outbox_messages_total", "Outbox messages by result", ("result",))
+    sent.set_function(lambda: outbox.sent, "sent")
+    sent.set_function(lambda: outbox.retried, "retried")
+    sent.set_function(lambda: outbox.failed, "failed")
+    if mw is not None:
+        UPDATES_IN_FLIGHT.set_function(lambda: mw.in_flight)
+
+
+async def start_http(host: str, port: int, registry: Registry = REGISTRY):
+    """GET /metrics в текстовом формате Prometheus."""
+    from aiohttp import web
+
+    async def handle(request):
+        return web.Response(body=registry.render().encode(),
+                            headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    log.info("metrics on http://%s:%d/metrics", host, port)
+    return runner
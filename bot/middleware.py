@@ -2,10 +2,11 @@ from aiogram import BaseMiddleware
 from aiogram.types import TelegramObject
 
 from bot.services.access import ensure_status
+from bot.storage import Storage
 
 
 class DbUserMiddleware(BaseMiddleware):
-    def __init__(self, db, cfg):
+    def __init__(self, db: Storage, cfg):
         self.db = db
         self.cfg = cfg
 
@@ -29,7 +30,7 @@ class DbUserMiddleware(BaseMiddleware):
             chat_id=chat_id,
             default_status=default_status
         )
-        user_row = ensure_status(self.db, user_row)
+        user_row = ensure_status(user_row)
 
         data["db"] = self.db
         data["user_row"] = user_row
@@ -0,0 +1,232 @@
+from __future__ import annotations
+import asyncio
+import contextvars
+import heapq
+import itertools
+import logging
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Optional
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+
+log = logging.getLogger(__name__)
+
+PRIORITY_REPLY = 0   # ответ на текущее сообщение пользователя
+PRIORITY_BULK = 1    # уведомления, рассылки, фоновые задачи
+
+_priority: contextvars.ContextVar[int] = contextvars.ContextVar("outbox_priority", default=PRIORITY_REPLY)
+
+# методы, которые Telegram считает «сообщениями в чат» и ограничивает по частоте
+PACED_METHODS = {
+    "sendMessage", "sendPhoto", "sendDocument", "sendInvoice", "sendMediaGroup",
+    "sendAudio", "sendVideo", "sendVoice", "sendAnimation", "sendSticker",
+    "sendLocation", "sendContact", "sendPoll", "forwardMessage", "copyMessage",
+}
+
+
+class _TokenBucket:
+    __slots__ = ("rate", "burst", "tokens", "ts")
+
+    def __init__(self, rate: float, burst: float, now: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.ts = now
+
+    def reserve(self, now: float) -> float:
+        """Забирает один токен (в долг, если нужно) и возвращает, сколько ждать до отправки."""
+        self.tokens = min(self.burst, self.tokens + (now - self.ts) * self.rate)
+        self.ts = now
+        self.tokens -= 1
+        if self.tokens >= 0:
+            return 0.0
+        return -self.tokens / self.rate
+
+    def idle(self, now: float) -> bool:
+        return self.tokens + (now - self.ts) * self.rate >= self.burst
+
+
+@dataclass(order=True)
+class _Job:
+    priority: int
+    seq: int
+    ready_at: float = field(compare=False)
+    chat_id: Any = field(compare=False)
+    make_request: Any = field(compare=False)
+    bot: Any = field(compare=False)
+    method: Any = field(compare=False)
+    future: asyncio.Future = field(compare=False)
+    attempts: int = field(default=0, compare=False)
+
+
+class Outbox(BaseRequestMiddleware):
+    """
+    Исходящая очередь поверх сессии бота: все send*-вызовы проходят через неё.
+    Соблюдает общий лимит (global_rate сообщений/сек) и лимит на чат,
+    на 429 повторяет отправку через retry_after от сервера,
+    ответы пользователю обгоняют массовые уведомления.
+    """
+
+    def __init__(self, global_rate: float = 30.0, chat_rate: float = 1.0, chat_burst: float = 3.0,
+                 max_retries: int = 5, max_buckets: int = 10_000):
+        self.global_rate = global_rate
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self.max_buckets = max_buckets
+
+        self._global: Optional[_TokenBucket] = None
+        self._chats: dict[Any, _TokenBucket] = {}
+        self._waiting: list[tuple[float, int, _Job]] = []   # куча по ready_at
+        self._ready: list[_Job] = []                        # куча по (priority, seq)
+        self._seq = itertools.count()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._inflight: set[asyncio.Task] = set()
+        self._background: set[asyncio.Task] = set()
+
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+
+    # --- публичный API ---
+
+    def depth(self) -> int:
+        return len(self._waiting) + len(self._ready)
+
+    def notify(self, coro: Awaitable[Any]) -> asyncio.Task:
+        """
+        Запускает отправку (например, bot.send_message(...)) с низким приоритетом, не дожидаясь её.
+        Ошибки логируются, а не пробрасываются в хэндлер.
+        """
+        token = _priority.set(PRIORITY_BULK)
+        try:
+            task = asyncio.ensure_future(coro)
+        finally:
+            _priority.reset(token)
+        self._background.add(task)
+        task.add_done_callback(self._notify_done)
+        return task
+
+    async def close(self):
+        for t in list(self._background):
+            t.cancel()
+        if self._worker:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+        while self._ready or self._waiting:
+            job = heapq.heappop(self._ready) if self._ready else heapq.heappop(self._waiting)[2]
+            if not job.future.done():
+                job.future.cancel()
+
+    # --- middleware ---
+
+    async def __call__(self, make_request, bot, method):
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is None or method.__api_method__ not in PACED_METHODS:
+            return await make_request(bot, method)
+
+        loop = asyncio.get_running_loop()
+        self._ensure_worker(loop)
+        now = loop.time()
+        job = _Job(
+            priority=_priority.get(),
+            seq=next(self._seq),
+            ready_at=now + self._chat_bucket(chat_id, now).reserve(now),
+            chat_id=chat_id,
+            make_request=make_request,
+            bot=bot,
+            method=method,
+            future=loop.create_future(),
+        )
+        self._push(job)
+        return await job.future
+
+    # --- внутреннее ---
+
+    def _notify_done(self, task: asyncio.Task):
+        self._background.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            log.warning("outbox: notification failed: %r", task.exception())
+
+    def _chat_bucket(self, chat_id, now: float) -> _TokenBucket:
+        b = self._chats.get(chat_id)
+        if b is None:
+            if len(self._chats) >= self.max_buckets:
+                self._chats = {k: v for k, v in self._chats.items() if not v.idle(now)}
+            b = self._chats[chat_id] = _TokenBucket(self.chat_rate, self.chat_burst, now)
+        return b
+
+    def _push(self, job: _Job):
+        heapq.heappush(self._waiting, (job.ready_at, job.seq, job))
+        self._wakeup.set()
+
+    def _ensure_worker(self, loop):
+        if self._worker is None or self._worker.done():
+            self._wakeup = asyncio.Event()
+            self._global = _TokenBucket(self.global_rate, self.global_rate, loop.time())
+            self._worker = loop.create_task(self._run())
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            now = loop.time()
+            while self._waiting and self._waiting[0][0] <= now:
+                heapq.heappush(self._ready, heapq.heappop(self._waiting)[2])
+
+            if not self._ready:
+                self._wakeup.clear()
+                timeout = self._waiting[0][0] - now if self._waiting else None
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            delay = self._global.reserve(now)
+            if delay > 0:
+                await asyncio.sleep(delay)
+                # пока ждали, мог прийти более срочный ответ
+                while self._waiting and self._waiting[0][0] <= loop.time():
+                    heapq.heappush(self._ready, heapq.heappop(self._waiting)[2])
+
+            job = heapq.heappop(self._ready)
+            if job.future.done():
+                continue
+            task = loop.create_task(self._send(job))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+
+    async def _send(self, job: _Job):
+        try:
+            result = await job.make_request(job.bot, job.method)
+        except TelegramRetryAfter as e:
+            job.attempts += 1
+            if job.attempts > self.max_retries:
+                self.failed += 1
+                if not job.future.done():
+                    job.future.set_exception(e)
+                return
+            self.retried += 1
+            loop = asyncio.get_running_loop()
+            now = loop.time()
+            # сервер сказал ждать — все сообщения в этот чат тоже ждут
+            bucket = self._chat_bucket(job.chat_id, now)
+            bucket.tokens = min(bucket.tokens, 0.0) - e.retry_after * bucket.rate
+            bucket.ts = now
+            job.ready_at = now + e.retry_after
+            self._push(job)
+            return
+        except Exception as e:
+            self.failed += 1
+            if not job.future.done():
+                job.future.set_exception(e)
+            return
+        self.sent += 1
+        if not job.future.done():
+            job.future.set_result(result)
@@ -0,0 +1,132 @@
+from __future__ import annotations
+import logging
+import re
+import time
+from collections import deque
+
+log = logging.getLogger(__name__)
+
+_WS = re.compile(r"\s+")
+_EXPLAINABLE = ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH", "REPLACE")
+
+
+def normalize_sql(sql: str) -> str:
+    return _WS.sub(" ", sql).strip()
+
+
+def param_shape(params) -> str:
+    """Типы/длины параметров без значений: (int, str[19], None)."""
+    if params is None:
+        return "()"
+    if isinstance(params, dict):
+        return "{" + ", ".join(f"{k}: {param_shape((v,))[1:-1]}" for k, v in params.items()) + "}"
+    out = []
+    for p in params:
+        if p is None:
+            out.append("None")
+        elif isinstance(p, (str, bytes)):
+            out.append(f"{type(p).__name__}[{len(p)}]")
+        else:
+            out.append(type(p).__name__)
+    return "(" + ", ".join(out) + ")"
+
+
+class StatementStats:
+    __slots__ = ("count", "total", "max", "samples")
+
+    def __init__(self, window: int):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.samples: deque[float] = deque(maxlen=window)  # последние длительности, для квантилей
+
+    def add(self, seconds: float):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.samples.append(seconds)
+
+    def quantile(self, q: float) -> float:
+        if not self.samples:
+            return 0.0
+        s = sorted(self.samples)
+        return s[min(len(s) - 1, int(q * len(s)))]
+
+
+class ProfilingConnection:
+    """
+    Обёртка над sqlite3.Connection: время каждого execute/executemany по тексту запроса.
+    Запросы дольше threshold_ms пишутся в лог с формой параметров и EXPLAIN QUERY PLAN.
+    Для SELECT время — до первой строки (execute), выборка fetch* сюда не входит.
+    """
+
+    def __init__(self, conn, threshold_ms: float = 50.0, window: int = 2048):
+        self._conn = conn
+        self.threshold = threshold_ms / 1000
+        self.window = window
+        self.stats: dict[str, StatementStats] = {}
+        self.slow: deque[dict] = deque(maxlen=100)
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def __enter__(self):
+        return self._conn.__enter__()
+
+    def __exit__(self, *exc):
+        return self._conn.__exit__(*exc)
+
+    def _record(self, sql: str, params, seconds: float, many: bool = False):
+        key = normalize_sql(sql)
+        st = self.stats.get(key)
+        if st is None:
+            st = self.stats[key] = StatementStats(self.window)
+        st.add(seconds)
+        if seconds >= self.threshold:
+            self._log_slow(key, params, seconds, many)
+
+    def _log_slow(self, sql: str, params, seconds: float, many: bool):
+        plan = []
+        if sql.split(" ", 1)[0].upper() in _EXPLAINABLE:
+            try:
+                plan = [r[-1] for r in self._conn.execute("EXPLAIN QUERY PLAN " + sql, params or ())]
+            except Exception as e:  # например, параметры уже не валидны
+                plan = [f"<explain failed: {e}>"]
+        entry = {
+            "sql": sql,
+            "params": ("many " if many else "") + param_shape(params),
+            "ms": round(seconds * 1000, 2),
+            "plan": plan,
+        }
+        self.slow.append(entry)
+        log.warning("slow query %.1f ms %s params=%s plan=%s", entry["ms"], sql, entry["params"], " | ".join(plan))
+
+    def execute(self, sql: str, params=()):
+        t = time.perf_counter()
+        try:
+            return self._conn.execute(sql, params)
+        finally:
+            self._record(sql, params, time.perf_counter() - t)
+
+    def executemany(self, sql: str, seq):
+        seq = list(seq)
+        t = time.perf_counter()
+        try:
+            return self._conn.executemany(sql, seq)
+        finally:
+            self._record(sql, seq[0] if seq else (), time.perf_counter() - t, many=True)
+
+    def dump(self, limit: int = 20) -> list[dict]:
+        rows = [
+            {
+                "sql": sql,
+                "count": st.count,
+                "total_ms": round(st.total * 1000, 2),
+                "p50_ms": round(st.quantile(0.50) * 1000, 3),
+                "p99_ms": round(st.quantile(0.99) * 1000, 3),
+                "max_ms": round(st.max * 1000, 3),
+            }
+            for sql, st in self.stats.items()
+        ]
+        rows.sort(key=lambda r: r["total_ms"], reverse=True)
+        return rows[:limit]
@@ -0,0 +1,115 @@
+from __future__ import annotations
+import gzip
+import hashlib
+import hmac
+import json
+import logging
+import os
+import time
+from typing import Any, Iterator
+
+from aiogram import BaseMiddleware
+from aiogram.types import Update
+
+log = logging.getLogger(__name__)
+
+
+# order_info (имя, телефон, email, адрес) в PreCheckoutQuery/SuccessfulPayment необязателен — выкидываем целиком
+_DROP_KEYS = frozenset({"order_info"})
+
+
+class Pseudonymizer:
+    """
+    Стабильная (в пределах соли) замена id пользователей/чатов; имена и username убираются.
+    Платёжные и контактные данные не пишутся: order_info выкидывается, у Contact и адреса доставки
+    поля обязательные — остаются пустыми, чтобы запись по-прежнему проигрывалась.
+    """
+
+    def __init__(self, salt: bytes):
+        self.salt = salt
+        self._cache: dict[int, int] = {}
+
+    def id(self, real: int) -> int:
+        fake = self._cache.get(real)
+        if fake is None:
+            digest = hmac.new(self.salt, str(abs(real)).encode(), hashlib.sha256).digest()
+            fake = int.from_bytes(digest[:5], "big") + 1   # до 2^40, как и настоящие id
+            if real < 0:  # группы/каналы отрицательные — знак сохраняем
+                fake = -fake
+            if len(self._cache) < 100_000:
+                self._cache[real] = fake
+        return fake
+
+    def scrub(self, obj: Any) -> Any:
+        if isinstance(obj, list):
+            return [self.scrub(x) for x in obj]
+        if not isinstance(obj, dict):
+            return obj
+        out = {k: self.scrub(v) for k, v in obj.items() if k not in _DROP_KEYS}
+        if isinstance(out.get("shipping_address"), dict):
+            out["shipping_address"] = {k: "" for k in out["shipping_address"]}
+        # Contact (есть phone_number)
+        if "phone_number" in out:
+            out["phone_number"] = ""
+            out.pop("vcard", None)
+            if isinstance(out.get("user_id"), int):
+                out["user_id"] = self.id(out["user_id"])
+            if "first_name" in out:
+                out["first_name"] = f"u{abs(out['user_id'])}" if "user_id" in out else "contact"
+            if "last_name" in out:
+                out["last_name"] = ""
+        # User (есть is_bot) и Chat (есть type)
+        if "id" in out and isinstance(out["id"], int) and ("is_bot" in out or "type" in out):
+            out["id"] = self.id(out["id"])
+            for k in ("first_name", "last_name", "username", "title"):
+                if k in out:
+                    out[k] = f"u{abs(out['id'])}" if k != "last_name" else ""
+        return out
+
+
+class UpdateRecorder(BaseMiddleware):
+    """
+    Outer-middleware на dp.update: пишет входящие апдейты в gzip JSONL
+    ({"ts": unix-время, "update": {...}}) с псевдонимизированными id.
+    """
+
+    def __init__(self, path: str, salt: bytes | None = None):
+        self.path = path
+        dirn = os.path.dirname(path)
+        if dirn:
+            os.makedirs(dirn, exist_ok=True)
+        self.pseudo = Pseudonymizer(salt or os.urandom(16))
+        self._f = gzip.open(path, "at", encoding="utf-8")
+        self.count = 0
+
+    async def __call__(self, handler, event, data: dict):
+        if isinstance(event, Update):
+            try:
+                raw = event.model_dump(mode="json", exclude_none=True, by_alias=True)
+                line = json.dumps({"ts": round(time.time(), 3), "update": self.pseudo.scrub(raw)},
+                                  ensure_ascii=False)
+                self._f.write(line + "\n")
+                self.count += 1
+                if self.count % 100 == 0:
+                    self._f.flush()  # sync-flush: записанное читается даже после падения процесса
+            except Exception:
+                log.exception("recorder: failed to write update")
+        return await handler(event, data)
+
+    def close(self):
+        self._f.close()
+
+
+def read_records(path: str) -> Iterator[dict]:
+    """Потоково читает запись; оборванный хвост (процесс упал до close) пропускается."""
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        try:
+            for line in f:
+                line = line.strip()
+                if line:
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        return
+        except EOFError:
+            return
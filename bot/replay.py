@@ -0,0 +1,131 @@
+"""
+Проигрывание записанных апдейтов (bot.recorder) в локальный экземпляр бота.
+
+    python -m bot.replay updates.jsonl.gz --speed 1      # в реальном темпе
+    python -m bot.replay updates.jsonl.gz --speed 10     # в 10 раз быстрее
+    python -m bot.replay updates.jsonl.gz --speed max    # без пауз
+
+Исходящие вызовы уходят по HTTP в FakeBotApiServer (поднимается сам, либо --api URL),
+так что в замер попадают сериализация и сетевой стек aiogram, но не Telegram.
+"""
+from __future__ import annotations
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+
+from bot.config import Config
+from bot.db import DB
+from bot.fake_api import FakeBotApiServer
+from bot.main import build_dispatcher
+from bot.metrics import MetricsMiddleware
+from bot.outbox import Outbox
+from bot.recorder import read_records
+
+
+def _percentile(values: list[float], q: float) -> float:
+    if not values:
+        return 0.0
+    s = sorted(values)
+    return s[min(len(s) - 1, int(q * len(s)))]
+
+
+async def replay(path: str, speed: float | None, db_path: str, api_url: str | None = None,
+                 paced: bool = False, max_in_flight: int = 1000) -> dict:
+    """speed=None — максимальная скорость; иначе множитель реального времени."""
+    server = None
+    if api_url is None:
+        server = await FakeBotApiServer().start()
+        api_url = server.url
+
+    cfg = Config("1:REPLAY", db_path, "Asia/Yerevan", set(), None, 300, 50, warmup=False, metrics_port=0)
+    db = DB(db_path)
+    session = AiohttpSession(api=TelegramAPIServer.from_base(api_url))
+    bot = Bot("42:REPLAY", session=session)
+    outbox = Outbox() if paced else Outbox(global_rate=1e9, chat_rate=1e9, chat_burst=1e9)
+    bot.session.middleware(outbox)
+    dp = build_dispatcher(cfg, db, outbox, MetricsMiddleware())
+
+    latencies: list[float] = []
+    errors = 0
+    tasks: set[asyncio.Task] = set()
+
+    async def feed(raw: dict):
+        nonlocal errors
+        t = time.perf_counter()
+        try:
+            await dp.feed_raw_update(bot, raw)
+        except Exception:
+            errors += 1
+        latencies.append(time.perf_counter() - t)
+
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    first_ts = None
+    n = 0
+    for rec in read_records(path):
+        if speed is not None:
+            first_ts = rec["ts"] if first_ts is None else first_ts
+            due = start + (rec["ts"] - first_ts) / speed
+            delay = due - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        # как при поллинге: каждый апдейт — отдельная задача
+        task = asyncio.create_task(feed(rec["update"]))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+        n += 1
+        if len(tasks) >= max_in_flight:
+            # не читаем файл дальше, пока не освободится место: задач в памяти не больше max_in_flight
+            await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    await asyncio.gather(*tasks)
+    elapsed = loop.time() - start
+
+    await outbox.close()
+    await bot.session.close()
+    db.close()
+    calls = dict(server.counts) if server else None
+    if server:
+        await server.stop()
+
+    return {
+        "updates": n,
+        "errors": errors,
+        "seconds": round(elapsed, 3),
+        "updates_per_sec": round(n / elapsed, 1) if elapsed else None,
+        "latency_ms": {"p50": round(_percentile(latencies, 0.5) * 1000, 3),
+                       "p99": round(_percentile(latencies, 0.99) * 1000, 3)},
+        "api_calls": calls,
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("path", help="файл записи (.jsonl.gz)")
+    ap.add_argument("--speed", default="max", help="1, N (множитель) или max")
+    ap.add_argument("--api", help="URL Bot API сервера (по умолчанию — встроенный фейковый)")
+    ap.add_argument("--db", help="путь к БД (по умолчанию временный файл)")
+    ap.add_argument("--paced", action="store_true", help="соблюдать лимиты Telegram в outbox")
+    ap.add_argument("--out", help="куда записать JSON с результатом")
+    args = ap.parse_args()
+    speed = None if args.speed == "max" else float(args.speed)
+
+    with tempfile.TemporaryDirectory() as td:
+        db_path = args.db or os.path.join(td, "replay.db")
+        result = asyncio.run(replay(args.path, speed, db_path, args.api, args.paced))
+
+    text = json.dumps(result, ensure_ascii=False, indent=2)
+    print(text)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+
+
+if __name__ == "__main__":
+    main()
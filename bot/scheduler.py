@@ -0,0 +1,153 @@
+from __future__ import annotations
+import asyncio
+import logging
+import os
+import time
+from datetime import date, datetime, timedelta
+from typing import Callable
+
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
+
+from bot.backup import run_backup
+from bot.services.history import send_weekly_charts
+from bot.services.summary import local_day_window, send_daily_summaries
+from bot.services.targets import FORMULA_VERSION, compute_targets_batch
+from bot.services.tdee import INTAKE_CATCHUP_DAYS, MIN_WEIGHINS, TdeeState, adapt_targets, fold_daily_intake
+
+log = logging.getLogger(__name__)
+
+# name -> {"runs", "errors", "last_ms", "max_ms", "last_rows", "last_run"}
+JOB_STATS: dict[str, dict] = {}
+
+
+def _record(name: str, started: float, rows: int | None, error: bool):
+    ms = (time.perf_counter() - started) * 1000
+    st = JOB_STATS.setdefault(name, {"runs": 0, "errors": 0, "last_ms": 0.0, "max_ms": 0.0,
+                                     "last_rows": None, "last_run": None})
+    st["runs"] += 1
+    st["errors"] += int(error)
+    st["last_ms"] = round(ms, 2)
+    st["max_ms"] = round(max(st["max_ms"], ms), 2)
+    st["last_rows"] = rows
+    st["last_run"] = datetime.utcnow().replace(microsecond=0).isoformat()
+    if not error:
+        log.info("job %s: %s rows in %.1f ms", name, rows, ms)
+
+
+def timed(name: str, fn: Callable) -> Callable:
+    """Оборачивает задачу: пишет длительность и число затронутых строк (то, что вернула fn)."""
+    async def run():
+        started = time.perf_counter()
+        try:
+            rows = fn()
+            if hasattr(rows, "__await__"):
+                rows = await rows
+        except Exception:
+            _record(name, started, None, error=True)
+            log.exception("job %s failed", name)
+            return
+        _record(name, started, rows, error=False)
+    run.__name__ = run.__qualname__ = name
+    return run
+
+
+def expire_access(db) -> int:
+    now = datetime.utcnow().replace(microsecond=0).isoformat()
+    return db.expire_trials(now) + db.expire_subscriptions(now)
+
+
+async def recompute_targets(db, chunk: int = 1000) -> int:
+    # потоково: пачка анкет -> колонки -> compute_targets_batch -> executemany; между пачками отдаём цикл
+    done = 0
+    for batch in db.stale_target_batches(FORMULA_VERSION, chunk):
+        user_id, sex, age, height_cm, weight_kg, activity, goal = zip(*batch)
+        kcal, protein, fiber = compute_targets_batch(sex, age, height_cm, weight_kg, activity, goal)
+        done += db.bulk_upsert_targets(list(zip(user_id, kcal, protein, fiber)), FORMULA_VERSION)
+        await asyncio.sleep(0)
+    return done
+
+
+async def fold_intake(db, default_tz: str, chunk: int = 1000, now_utc: datetime | None = None) -> int:
+    """
+    Завершённые дни из food_daily -> EMA потребления. День пользователя завершён, когда он прошёл
+    и по его часовому поясу, и в UTC (food_daily ведётся по UTC-датам). Пропущенные ночи догоняются
+    до INTAKE_CATCHUP_DAYS назад; уже учтённые дни add_intake пропускает сам.
+    """
+    now_utc = now_utc or datetime.utcnow()
+    utc_yesterday = now_utc.date() - timedelta(days=1)
+    first = (utc_yesterday - timedelta(days=INTAKE_CATCHUP_DAYS - 1)).isoformat()
+    local_yesterday: dict[str, str] = {}
+    done = 0
+    for batch in db.intake_batches(first, utc_yesterday.isoformat(), chunk):
+        for r in batch:
+            tz = r["tz"] or default_tz
+            if tz not in local_yesterday:
+                today = date.fromisoformat(local_day_window(tz, now_utc)[0])
+                local_yesterday[tz] = min(today - timedelta(days=1), utc_yesterday).isoformat()
+            r["until"] = local_yesterday[tz]
+        done += fold_daily_intake(db, batch)
+        await asyncio.sleep(0)
+    return done
+
+
+async def adjust_targets(db, default_tz: str, chunk: int = 1000, now_utc: datetime | None = None) -> int:
+    # сначала вчерашнее потребление, дальше по накопленному состоянию TDEE: O(1) на пользователя
+    await fold_intake(db, default_tz, chunk, now_utc)
+    done = 0
+    fields = TdeeState.__dataclass_fields__
+    for batch in db.adaptive_batches(MIN_WEIGHINS, chunk):
+        rows = []
+        for r in batch:
+            st = TdeeState(**{k: r[k] for k in fields})
+            new = adapt_targets(st, r["goal"], r["kcal_target"])
+            if new is not None:
+                rows.append((r["user_id"], new[0], new[1], r["fiber_g"]))
+        if rows:
+            done += db.bulk_upsert_targets(rows, FORMULA_VERSION)
+        await asyncio.sleep(0)
+    return done
+
+
+def build_scheduler(db, bot, outbox, cfg) -> AsyncIOScheduler:
+    scheduler = AsyncIOScheduler(timezone="UTC")
+    scheduler.add_job(
+        timed("expire_access", lambda: expire_access(db)),
+        "interval", minutes=1, id="expire_access",
+        max_instances=1, coalesce=True, next_run_time=datetime.utcnow(),
+    )
+    scheduler.add_job(
+        timed("flush_meta", db.flush_meta),
+        "interval", seconds=5, id="flush_meta", max_instances=1, coalesce=True,
+    )
+    # каждые 15 минут: ловим и пояса со сдвигом :30/:45, и недосланный после рестарта прогон
+    scheduler.add_job(
+        timed("daily_summary", lambda: send_daily_summaries(db, bot, outbox, cfg.tz)),
+        "interval", minutes=15, id="daily_summary",
+        max_instances=1, coalesce=True, next_run_time=datetime.utcnow(),
+    )
+    # после смены FORMULA_VERSION пересчитает всех на первом прогоне, дальше — только новых без целей
+    scheduler.add_job(
+        timed("recompute_targets", lambda: recompute_targets(db)),
+        "interval", hours=1, id="recompute_targets",
+        max_instances=1, coalesce=True, next_run_time=datetime.utcnow(),
+    )
+    scheduler.add_job(
+        timed("merge_fts", db.merge_fts),
+        "interval", minutes=10, id="merge_fts", max_instances=1, coalesce=True,
+    )
+    scheduler.add_job(
+        timed("adjust_targets", lambda: adjust_targets(db, cfg.tz)),
+        "cron", hour=3, id="adjust_targets", max_instances=1, coalesce=True,
+    )
+    if cfg.chart_weekly:
+        scheduler.add_job(
+            timed("weekly_charts", lambda: send_weekly_charts(db, bot, outbox)),
+            "cron", day_of_week="mon", hour=9, id="weekly_charts", max_instances=1, coalesce=True,
+        )
+    if cfg.backup_hours:
+        backup_dir = cfg.backup_dir or os.path.join(os.path.dirname(os.path.abspath(db.path)), "backups")
+        scheduler.add_job(
+            timed("backup", lambda: run_backup(db.path, backup_dir, cfg.backup_keep)),
+            "interval", hours=cfg.backup_hours, id="backup", max_instances=1, coalesce=True,
+        )
+    return scheduler
@@ -1,6 +1,7 @@
 from __future__ import annotations
+from dataclasses import replace
 from datetime import datetime
-from bot.db import DB, UserRow
+from bot.db import UserRow
 
 def is_active(user: UserRow) -> bool:
     if user.status == "beta":
@@ -16,11 +17,11 @@ def is_active(user: UserRow) -> bool:
         return False
     return False
 
-def ensure_status(db: DB, user: UserRow) -> UserRow:
-    # move trial->expired if needed
-    if user.status == "trial" and user.trial_end:
-        if datetime.fromisoformat(user.trial_end) <= datetime.utcnow():
-            db.conn.execute("UPDATE users SET status='expired' WHERE id=?", (user.id,))
-            db.conn.commit()
-            return db.get_or_create_user(user.tg_id, user.chat_id, user.status)
+def ensure_status(user: UserRow) -> UserRow:
+    # только в памяти: в БД статус переводит периодическая задача (bot.scheduler)
+    now = datetime.utcnow().replace(microsecond=0).isoformat()
+    if user.status == "trial" and user.trial_end and user.trial_end <= now:
+        return replace(user, status="expired")
+    if user.status == "active" and user.paid_until and user.paid_until <= now:
+        return replace(user, status="expired")
     return user
@@ -207,3 +207,20 @@ def from_json(s: str) -> dict:
         return json.loads(s)
     except Exception:
         return {}
+
+def result_from_entry(entry: dict) -> AnalysisResult:
+    """Собирает AnalysisResult из строки food_entries: числа из колонок, остальное из parsed_json."""
+    meta = from_json(entry["parsed_json"])
+    return AnalysisResult(
+        components=list(meta.get("components") or []),
+        kcal_low=int(entry["kcal_low"]),
+        kcal_high=int(entry["kcal_high"]),
+        kcal_mid=int(entry["kcal_mid"]),
+        conf=float(entry["conf"]),
+        err_low=float(entry["err_low"]),
+        err_high=float(entry["err_high"]),
+        note=meta.get("note") or "",
+        needs_refine=bool(meta.get("needs_refine")),
+        refine_kind=meta.get("refine_kind"),
+        has_reference=bool(meta.get("has_reference")),
+    )
@@ -0,0 +1,163 @@
+from __future__ import annotations
+import asyncio
+import struct
+import zlib
+from typing import TYPE_CHECKING, Optional
+
+if TYPE_CHECKING:
+    from concurrent.futures import ProcessPoolExecutor
+
+# График ккал по дням против цели: растр в палитре + PNG-кодировщик на zlib, без Pillow.
+# Модуль импортируется в процессе-рисовальщике — только стандартная библиотека.
+
+RENDER_VERSION = 1      # поднять при изменении картинки — кэш file_id устареет
+WIDTH, HEIGHT = 640, 360
+BAND = 0.10             # как history.ADHERENCE_BAND: полоса «в норме»
+
+PALETTE = (
+    (255, 255, 255),    # 0 фон
+    (230, 230, 230),    # 1 сетка
+    (90, 90, 90),       # 2 оси и подписи
+    (76, 175, 80),      # 3 в норме
+    (255, 152, 0),      # 4 перебор
+    (66, 133, 244),     # 5 недобор
+    (229, 57, 53),      # 6 цель
+    (232, 245, 233),    # 7 полоса нормы
+)
+BG, GRID, INK, OK, OVER, UNDER, TARGET, BAND_FILL = range(8)
+
+# цифры 3x5, строки сверху вниз, старший бит — левый пиксель
+DIGITS = {
+    "0": (7, 5, 5, 5, 7), "1": (2, 6, 2, 2, 7), "2": (7, 1, 7, 4, 7), "3": (7, 1, 7, 1, 7),
+    "4": (5, 5, 7, 1, 1), "5": (7, 4, 7, 1, 7), "6": (7, 4, 7, 5, 7), "7": (7, 1, 1, 2, 2),
+    "8": (7, 5, 7, 5, 7), "9": (7, 5, 7, 1, 7), ".": (0, 0, 0, 0, 2), "-": (0, 0, 7, 0, 0),
+}
+
+
+class Canvas:
+    def __init__(self, width: int, height: int, color: int = BG):
+        self.w, self.h = width, height
+        self.px = bytearray([color]) * (width * height)
+
+    def rect(self, x0: int, y0: int, x1: int, y1: int, color: int):
+        x0, x1 = max(0, min(x0, x1)), min(self.w, max(x0, x1))
+        y0, y1 = max(0, min(y0, y1)), min(self.h, max(y0, y1))
+        if x1 <= x0:
+            return
+        row = bytes([color]) * (x1 - x0)
+        for y in range(y0, y1):
+            i = y * self.w
+            self.px[i + x0:i + x1] = row
+
+    def hline(self, x0: int, x1: int, y: int, color: int, dash: int = 0):
+        if dash <= 0:
+            self.rect(x0, y, x1, y + 1, color)
+            return
+        for x in range(x0, x1, dash * 2):
+            self.rect(x, y, min(x + dash, x1), y + 1, color)
+
+    def text(self, x: int, y: int, s: str, color: int = INK, scale: int = 2):
+        for ch in s:
+            glyph = DIGITS.get(ch)
+            if glyph is not None:
+                for gy, bits in enumerate(glyph):
+                    for gx in range(3):
+                        if bits & (4 >> gx):
+                            self.rect(x + gx * scale, y + gy * scale, x + (gx + 1) * scale, y + (gy + 1) * scale,
+                                      color)
+            x += 4 * scale
+
+    @staticmethod
+    def text_width(s: str, scale: int = 2) -> int:
+        return len(s) * 4 * scale - scale
+
+
+def encode_png(width: int, height: int, pixels: bytes, palette=PALETTE) -> bytes:
+    """Палитровый PNG (8 бит на пиксель), фильтр 0: растр из одноцветных областей жмётся в единицы КБ."""
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    raw = bytearray()
+    for y in range(height):
+        raw.append(0)
+        raw += pixels[y * width:(y + 1) * width]
+    return (b"\x89PNG\r\n\x1a\n"
+            + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 3, 0, 0, 0))
+            + chunk(b"PLTE", b"".join(bytes(c) for c in palette))
+            + chunk(b"IDAT", zlib.compress(bytes(raw), 9))
+            + chunk(b"IEND", b""))
+
+
+def _nice_step(top: float) -> int:
+    for step in (250, 500, 1000, 2000, 5000):
+        if top / step <= 6:
+            return step
+    return 10000
+
+
+def render_chart(days: list[tuple[str, Optional[int]]], target: int,
+                 width: int = WIDTH, height: int = HEIGHT) -> bytes:
+    """days — [(YYYY-MM-DD, ккал или None)] по порядку; столбцы против линии цели, подписи — числа месяца."""
+    left, right, top, bottom = 56, 12, 16, 30
+    pw, ph = width - left - right, height - top - bottom
+    c = Canvas(width, height)
+
+    peak = max([v for _, v in days if v is not None] + [target]) * 1.15
+    step = _nice_step(peak)
+    ymax = max(step, -(-int(peak) // step) * step)
+
+    def y_of(v: float) -> int:
+        return top + ph - int(round(ph * min(v, ymax) / ymax))
+
+    c.rect(left, y_of(target * (1 + BAND)), left + pw, y_of(target * (1 - BAND)), BAND_FILL)
+    for v in range(0, ymax + 1, step):
+        y = y_of(v)
+        c.hline(left, left + pw, y, GRID)
+        label = str(v)
+        c.text(left - 6 - Canvas.text_width(label), y - 5, label)
+
+    n = max(len(days), 1)
+    slot = pw / n
+    bar = max(2, int(slot * 0.7))
+    label_every = 1 if n <= 10 else (2 if n <= 16 else 3)
+    for i, (day, v) in enumerate(days):
+        x0 = left + int(i * slot + (slot - bar) / 2)
+        if v is not None and v > 0:
+            color = OK if abs(v - target) <= target * BAND else (OVER if v > target else UNDER)
+            c.rect(x0, y_of(v), x0 + bar, top + ph, color)
+        if (n - 1 - i) % label_every == 0:
+            label = str(int(day[8:10]))
+            c.text(x0 + (bar - Canvas.text_width(label)) // 2, top + ph + 8, label)
+
+    c.hline(left, left + pw, y_of(target), TARGET, dash=6)
+    c.hline(left, left + pw, y_of(target) + 1, TARGET, dash=6)
+    c.rect(left, top, left + 1, top + ph + 1, INK)
+    c.hline(left, left + pw, top + ph, INK)
+    return encode_png(width, height, c.px)
+
+
+# один процесс-рисовальщик на бота: CPU-работа не попадает в цикл событий и не держит GIL основного процесса
+_POOL: Optional[ProcessPoolExecutor] = None
+
+
+def _pool() -> ProcessPoolExecutor:
+    global _POOL
+    if _POOL is None:
+        # multiprocessing грузим при первом графике, а не при старте бота
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+
+        # spawn, а не fork: у бота уже есть потоки (to_thread, sqlite), fork их состояние не переносит
+        _POOL = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn"))
+    return _POOL
+
+
+async def render_png(days: list[tuple[str, Optional[int]]], target: int) -> bytes:
+    return await asyncio.get_running_loop().run_in_executor(_pool(), render_chart, days, target)
+
+
+def shutdown_pool():
+    global _POOL
+    if _POOL is not None:
+        _POOL.shutdown(wait=False, cancel_futures=True)
+        _POOL = None
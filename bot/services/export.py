@@ -0,0 +1,68 @@
+from __future__ import annotations
+import asyncio
+import csv
+import gzip
+import io
+import json
+import os
+import tempfile
+from typing import Iterable
+
+FORMATS = ("csv", "json")
+CSV_FIELDS = ("ts", "text", "kcal_low", "kcal_mid", "kcal_high", "conf", "components", "photo")
+
+# одновременно не больше стольких выгрузок: каждая держит поток и читает диск
+_EXPORTS = asyncio.Semaphore(2)
+
+
+def _record(row: dict) -> dict:
+    try:
+        components = json.loads(row["parsed_json"] or "{}").get("components") or []
+    except (ValueError, AttributeError):
+        components = []
+    return {
+        "ts": row["ts"],
+        "text": row["text"] or "",
+        "kcal_low": row["kcal_low"],
+        "kcal_mid": row["kcal_mid"],
+        "kcal_high": row["kcal_high"],
+        "conf": round(row["conf"], 2),
+        "components": components,
+        "photo": bool(row["photo_file_id"]),
+    }
+
+
+def write_export(rows: Iterable[dict], fmt: str, path: str) -> int:
+    """Построчно из генератора в gzip-файл; память не зависит от длины истории."""
+    n = 0
+    with gzip.open(path, "wb") as raw, io.TextIOWrapper(raw, encoding="utf-8", newline="") as f:
+        if fmt == "csv":
+            w = csv.writer(f)
+            w.writerow(CSV_FIELDS)
+            for row in rows:
+                rec = _record(row)
+                rec["components"] = "; ".join(rec["components"])
+                w.writerow([rec[k] for k in CSV_FIELDS])
+                n += 1
+        else:
+            for row in rows:
+                f.write(json.dumps(_record(row), ensure_ascii=False) + "\n")
+                n += 1
+    return n
+
+
+async def export_user(db, user_id: int, fmt: str = "csv") -> tuple[str, int]:
+    """(путь к временному .gz, число записей). Файл удаляет вызывающий."""
+    if fmt not in FORMATS:
+        raise ValueError(fmt)
+    suffix = ".csv.gz" if fmt == "csv" else ".jsonl.gz"
+    fd, path = tempfile.mkstemp(prefix="export_", suffix=suffix)
+    os.close(fd)
+    try:
+        async with _EXPORTS:
+            # чтение и сжатие — в потоке со своим соединением, цикл событий свободен
+            n = await asyncio.to_thread(write_export, db.export_rows(user_id), fmt, path)
+    except BaseException:
+        os.unlink(path)
+        raise
+    return path, n
@@ -0,0 +1,197 @@
+from __future__ import annotations
+import asyncio
+import logging
+import zlib
+from datetime import date, datetime, timedelta
+
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import BufferedInputFile
+
+from bot.db import week_key
+from bot.services.chart import RENDER_VERSION, render_png
+
+log = logging.getLogger(__name__)
+
+ADHERENCE_BAND = 0.10   # день «в норме», если ~ккал в пределах ±10% от цели
+STREAK_SCAN_DAYS = 120  # серию считаем не дальше этого
+WEEKDAYS = ("пн", "вт", "ср", "чт", "пт", "сб", "вс")
+
+
+def _month_end(d: date) -> date:
+    nxt = date(d.year + d.month // 12, d.month % 12 + 1, 1)
+    return nxt - timedelta(days=1)
+
+
+def split_range(start: date, end: date) -> list[tuple[str, str, str]]:
+    """
+    Покрытие [start, end] минимальным числом строк сводок: целые месяцы — из food_monthly,
+    целые недели — из food_weekly, остаток — из food_daily. Возвращает (уровень, первый ключ, последний ключ)
+    для подряд идущих отрезков одного уровня; 90 дней — это 2–3 месяца и горстка недель/дней.
+    """
+    parts: list[list[str]] = []
+
+    def push(level: str, key: str):
+        if parts and parts[-1][0] == level:
+            parts[-1][2] = key
+        else:
+            parts.append([level, key, key])
+
+    def weeks_and_days(a: date, b: date):
+        d = a
+        while d <= b:
+            if d.weekday() == 0 and d + timedelta(days=6) <= b:
+                push("week", week_key(d))
+                d += timedelta(days=7)
+            else:
+                push("day", d.isoformat())
+                d += timedelta(days=1)
+
+    # целые месяцы внутри диапазона — посередине, края добираем неделями и днями
+    first = start if start.day == 1 else _month_end(start) + timedelta(days=1)
+    last = first
+    while _month_end(last) <= end:
+        last = _month_end(last) + timedelta(days=1)
+    if last == first:
+        weeks_and_days(start, end)
+    else:
+        weeks_and_days(start, first - timedelta(days=1))
+        push("month", first.isoformat()[:7])
+        push("month", (last - timedelta(days=1)).isoformat()[:7])
+        weeks_and_days(last, end)
+    return [tuple(p) for p in parts]
+
+
+def summarize(db, user_id: int, start: date, end: date) -> dict:
+    """Суммы за период из сводок; rows — сколько строк сводок прочитано."""
+    total = {"n": 0, "days": 0, "kcal_low": 0, "kcal_mid": 0, "kcal_high": 0, "rows": 0}
+    for level, first, last in split_range(start, end):
+        for r in db.rollups(user_id, level, first, last):
+            total["rows"] += 1
+            for k in ("n", "days", "kcal_low", "kcal_mid", "kcal_high"):
+                total[k] += r[k]
+    total["avg_mid"] = round(total["kcal_mid"] / total["days"]) if total["days"] else None
+    return total
+
+
+def in_band(mid: int, target: int) -> bool:
+    return abs(mid - target) <= target * ADHERENCE_BAND
+
+
+def streaks(days: dict[str, int], target: int, start: date, end: date) -> tuple[int, int]:
+    """(текущая серия дней «в норме» к end; лучшая серия в периоде). Незаписанный end серию не рвёт."""
+    def ok(d: date) -> bool:
+        mid = days.get(d.isoformat())
+        return mid is not None and in_band(mid, target)
+
+    best = run = 0
+    d = start
+    while d <= end:
+        run = run + 1 if ok(d) else 0
+        best = max(best, run)
+        d += timedelta(days=1)
+
+    current = 0
+    d = end if end.isoformat() in days else end - timedelta(days=1)
+    while d >= start and ok(d):
+        current += 1
+        d -= timedelta(days=1)
+    return current, best
+
+
+def current_streak(db, user_id: int, target: int, today: date) -> int:
+    start = today - timedelta(days=STREAK_SCAN_DAYS)
+    days = {r["key"]: r["kcal_mid"] for r in db.rollups(user_id, "day", start.isoformat(), today.isoformat())}
+    return streaks(days, target, start, today)[0]
+
+
+def render_days(db, user_id: int, target: int, start: date, end: date) -> str:
+    rows = db.rollups(user_id, "day", start.isoformat(), end.isoformat())
+    by_day = {r["key"]: r for r in rows}
+    lines = [f"{start:%d.%m} — {end:%d.%m}, цель {target} ккал"]
+    d = start
+    while d <= end:
+        r = by_day.get(d.isoformat())
+        head = f"{WEEKDAYS[d.weekday()]} {d:%d.%m}"
+        if r is None:
+            lines.append(f"{head}: —")
+        else:
+            mark = " ✓" if in_band(r["kcal_mid"], target) else ""
+            lines.append(f"{head}: ~{r['kcal_mid']} ({r['kcal_low']}–{r['kcal_high']}){mark}")
+        d += timedelta(days=1)
+
+    logged = [r["kcal_mid"] for r in rows]
+    if logged:
+        ok = sum(1 for m in logged if in_band(m, target))
+        lines.append(f"\nСреднее: ~{round(sum(logged) / len(logged))} ккал за {len(logged)} дн. с записями")
+        lines.append(f"В норме (±{ADHERENCE_BAND:.0%}): {ok} из {len(logged)} дн.")
+    return "\n".join(lines)
+
+
+def render_periods(db, user_id: int, target: int, start: date, end: date, by: str = "week") -> str:
+    """Строка на неделю (by="week") или месяц (by="month"); каждая — summarize по сводкам."""
+    lines = [f"{start:%d.%m.%Y} — {end:%d.%m.%Y}, цель {target} ккал"]
+    d = start
+    while d <= end:
+        period_end = _month_end(d) if by == "month" else d + timedelta(days=6 - d.weekday())
+        stop = min(end, period_end)
+        s = summarize(db, user_id, d, stop)
+        if s["days"]:
+            lines.append(f"{d:%d.%m}–{stop:%d.%m}: ~{s['avg_mid']} ккал/день, записей {s['days']} дн.")
+        else:
+            lines.append(f"{d:%d.%m}–{stop:%d.%m}: —")
+        d = stop + timedelta(days=1)
+
+    total = summarize(db, user_id, start, end)
+    if total["days"]:
+        lines.append(f"\nСреднее: ~{total['avg_mid']} ккал за {total['days']} дн. с записями "
+                     f"(диапазон {round(total['kcal_low'] / total['days'])}–{round(total['kcal_high'] / total['days'])})")
+    return "\n".join(lines)
+
+
+def chart_days(db, user_id: int, end: date, span: int) -> list[tuple[str, int | None]]:
+    start = end - timedelta(days=span - 1)
+    by_day = {r["key"]: r["kcal_mid"] for r in db.rollups(user_id, "day", start.isoformat(), end.isoformat())}
+    return [((start + timedelta(days=i)).isoformat(), by_day.get((start + timedelta(days=i)).isoformat()))
+            for i in range(span)]
+
+
+def chart_version(days: list[tuple[str, int | None]], target: int) -> str:
+    # версия данных: те же дни, суммы и цель -> та же картинка
+    return f"{RENDER_VERSION}.{zlib.crc32(repr((days, target)).encode()):08x}"
+
+
+async def send_chart(bot, db, user_id: int, chat_id: int, target: int, span: int, end: date) -> str:
+    """
+    Картинка за span дней. Готовый file_id из user_meta («chart<span>» = «версия|file_id»), если данные
+    не менялись; иначе рендер в процессе-рисовальщике и загрузка. Возвращает "cached" или "rendered".
+    """
+    days = chart_days(db, user_id, end, span)
+    version = chart_version(days, target)
+    key = f"chart{span}"
+    caption = f"{days[0][0][8:10]}.{days[0][0][5:7]} — {end:%d.%m}, цель {target} ккал"
+    cached = db.get_meta(user_id, key)
+    if cached and cached.split("|", 1)[0] == version:
+        try:
+            await bot.send_photo(chat_id=chat_id, photo=cached.split("|", 1)[1], caption=caption)
+            return "cached"
+        except TelegramBadRequest:
+            log.info("chart file_id expired for user %s", user_id)
+
+    png = await render_png(days, target)
+    msg = await bot.send_photo(chat_id=chat_id, photo=BufferedInputFile(png, "chart.png"), caption=caption)
+    if msg.photo:
+        db.set_meta(user_id, key, f"{version}|{msg.photo[-1].file_id}")
+    return "rendered"
+
+
+async def send_weekly_charts(db, bot, outbox, chunk: int = 200) -> int:
+    """Понедельничный график за 7 дней всем, кто записывал еду на прошлой неделе; через outbox, пачками."""
+    end = datetime.utcnow().date() - timedelta(days=1)
+    since = (end - timedelta(days=6)).isoformat()
+    sent = 0
+    for batch in db.chart_batches(since, chunk):
+        tasks = [outbox.notify(send_chart(bot, db, r["id"], r["chat_id"], r["kcal_target"], 7, end))
+                 for r in batch]
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        sent += sum(1 for r in results if not isinstance(r, BaseException))
+    return sent
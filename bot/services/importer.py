@@ -0,0 +1,224 @@
+from __future__ import annotations
+import asyncio
+import csv
+import gzip
+import io
+import json
+from datetime import datetime, timezone
+from typing import Iterator, Optional
+
+from bot.services.analyzer import AnalysisResult, analyze, to_json
+
+MAX_ROWS = 200_000
+ANALYZE_CACHE = 5_000   # одинаковые подписи в истории встречаются постоянно — разбираем один раз
+
+# синонимы колонок из выгрузок других трекеров (сравнение без регистра)
+TS_KEYS = ("ts", "datetime", "date_time", "timestamp", "date", "time", "eaten_at", "дата")
+TEXT_KEYS = ("text", "food", "name", "meal", "description", "caption", "title", "item", "блюдо", "еда")
+KCAL_KEYS = ("kcal_mid", "kcal", "calories", "energy", "energy_kcal", "cal", "калории", "ккал")
+TS_FORMATS = ("%d.%m.%Y %H:%M", "%d.%m.%Y", "%m/%d/%Y %H:%M", "%m/%d/%Y", "%Y/%m/%d %H:%M")
+
+
+def _open_text(path: str) -> io.TextIOBase:
+    with open(path, "rb") as f:
+        gz = f.read(2) == b"\x1f\x8b"
+    raw = gzip.open(path, "rb") if gz else open(path, "rb")
+    return io.TextIOWrapper(raw, encoding="utf-8-sig", newline="")
+
+
+def _iter_json_array(f: io.TextIOBase, bufsize: int = 1 << 16) -> Iterator[dict]:
+    # потоковый разбор [ {...}, {...} ]: raw_decode по буферу, без загрузки файла целиком
+    dec = json.JSONDecoder()
+    buf, pos, eof = "", 0, False
+    while True:
+        while pos < len(buf) and buf[pos] in " \t\r\n,[]":
+            pos += 1
+        if pos >= len(buf):
+            if eof:
+                return
+            buf, pos = f.read(bufsize), 0
+            eof = not buf
+            continue
+        try:
+            obj, end = dec.raw_decode(buf, pos)
+        except ValueError:
+            if eof:
+                raise
+            more = f.read(bufsize)
+            eof = not more
+            buf, pos = buf[pos:] + more, 0
+            continue
+        pos = end
+        if isinstance(obj, dict):
+            yield obj
+
+
+class _Concat(io.TextIOBase):
+    """Уже прочитанное начало + остаток файла как один поток."""
+
+    def __init__(self, head: str, rest: io.TextIOBase):
+        self._head, self._rest = head, rest
+
+    def read(self, n: int = -1) -> str:
+        if self._head:
+            out, self._head = self._head, ""
+            return out
+        return self._rest.read(n)
+
+
+def parse_file(path: str) -> Iterator[dict]:
+    """Строки файла как dict: CSV (с заголовком), JSONL или JSON-массив; .gz распознаётся сам."""
+    with _open_text(path) as f:
+        head = f.read(1)
+        while head and head.isspace():
+            head = f.read(1)
+        rest = head + f.read(4096) + f.readline()   # до конца строки, чтобы не резать запись
+
+        def chained():   # начало уже прочитано — отдаём его первым, дальше файл построчно
+            yield from io.StringIO(rest)
+            yield from f
+
+        if head == "[":
+            yield from _iter_json_array(_Concat(rest, f))
+        elif head == "{":
+            for line in chained():
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+        else:
+            sample = rest[:4096]
+            try:
+                dialect = csv.Sniffer().sniff(sample, delimiters=",;\t")
+            except csv.Error:
+                dialect = csv.excel
+            yield from csv.DictReader(chained(), dialect=dialect)
+
+
+def _columns(keys, synonyms: tuple[str, ...]) -> list:
+    """Колонки строки, подходящие под синонимы, в порядке приоритета."""
+    lowered = {str(k).strip().lower(): k for k in keys if k is not None}
+    return [lowered[s] for s in synonyms if s in lowered]
+
+
+def _pick(row: dict, cols: list):
+    for k in cols:
+        v = row.get(k)
+        if v not in (None, ""):
+            return v
+    return None
+
+
+def parse_ts(value) -> Optional[str]:
+    if isinstance(value, (int, float)):
+        return datetime.fromtimestamp(float(value), timezone.utc).replace(tzinfo=None, microsecond=0).isoformat()
+    s = str(value).strip()
+    try:
+        dt = datetime.fromisoformat(s.replace("Z", "+00:00"))
+    except ValueError:
+        for fmt in TS_FORMATS:
+            try:
+                dt = datetime.strptime(s, fmt)
+                break
+            except ValueError:
+                continue
+        else:
+            return None
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+    if len(s) <= 10:   # только дата — ставим полдень, чтобы день не уехал
+        dt = dt.replace(hour=12)
+    return dt.replace(microsecond=0).isoformat()
+
+
+def _num(value) -> Optional[float]:
+    if value in (None, ""):
+        return None
+    try:
+        return float(str(value).replace(",", ".").replace(" ", ""))
+    except ValueError:
+        return None
+
+
+class RowMapper:
+    """Строка чужого формата -> поля food_entries; без калорий — через analyze (с кэшем по тексту)."""
+
+    def __init__(self):
+        self.analyzed = 0
+        self._cache: dict[str, AnalysisResult] = {}
+        self._layout: dict[tuple, tuple[list, list, list]] = {}   # набор ключей -> колонки ts/text/kcal
+
+    def _analyze(self, text: str) -> AnalysisResult:
+        ar = self._cache.get(text)
+        if ar is None:
+            ar = analyze(text, has_photo=False)
+            ar.note += " | импорт"
+            self.analyzed += 1
+            if len(self._cache) < ANALYZE_CACHE:
+                self._cache[text] = ar
+        return ar
+
+    def map(self, row: dict) -> Optional[dict]:
+        keys = tuple(row)
+        layout = self._layout.get(keys)
+        if layout is None:   # у CSV он один на файл, у JSON — на каждый вид объектов
+            layout = (_columns(keys, TS_KEYS), _columns(keys, TEXT_KEYS), _columns(keys, KCAL_KEYS))
+            if len(self._layout) < 100:
+                self._layout[keys] = layout
+        ts_cols, text_cols, kcal_cols = layout
+        raw_ts = _pick(row, ts_cols)
+        ts = parse_ts(raw_ts) if raw_ts is not None else None
+        text = _pick(row, text_cols)
+        text = str(text).strip()[:500] if text is not None else ""
+        if ts is None or not text:
+            return None
+
+        mid = _num(_pick(row, kcal_cols))
+        if mid is None or mid < 0:
+            ar = self._analyze(text)
+        else:
+            low = _num(row.get("kcal_low"))
+            high = _num(row.get("kcal_high"))
+            mid = int(round(mid))
+            conf = _num(row.get("conf"))   # 0 — честная нулевая уверенность, не «нет значения»
+            comps = row.get("components")
+            if isinstance(comps, str):
+                comps = [c.strip() for c in comps.split(";") if c.strip()]
+            ar = AnalysisResult(
+                components=list(comps or [text[:60]]),
+                kcal_low=int(round(low)) if low is not None else int(round(mid * 0.85)),
+                kcal_high=int(round(high)) if high is not None else int(round(mid * 1.15)),
+                kcal_mid=mid,
+                conf=conf if conf is not None else 0.7,
+                err_low=0.10, err_high=0.15,
+                note="импорт",
+                needs_refine=False, refine_kind=None, has_reference=False,
+            )
+        return {"ts": ts, "text": text, "parsed_json": to_json(ar), "kcal_low": ar.kcal_low,
+                "kcal_high": ar.kcal_high, "kcal_mid": ar.kcal_mid, "conf": ar.conf,
+                "err_low": ar.err_low, "err_high": ar.err_high}
+
+
+def run_import(db, user_id: int, path: str, progress: dict, chunk: int = 200) -> dict:
+    """Синхронно, для потока: parse -> map -> DB.import_entries пачками. progress обновляется по ходу."""
+    mapper = RowMapper()
+    progress.update(read=0, bad=0, truncated=False)
+
+    def entries():
+        for raw in parse_file(path):
+            if progress["read"] >= MAX_ROWS:
+                progress["truncated"] = True    # дальше файла не читаем — об этом скажем пользователю
+                break
+            progress["read"] += 1
+            e = mapper.map(raw) if isinstance(raw, dict) else None
+            if e is None:
+                progress["bad"] += 1
+                continue
+            yield e
+
+    inserted, duplicates = db.import_entries(user_id, entries(), chunk=chunk, progress=progress)
+    return {"read": progress["read"], "bad": progress["bad"], "inserted": inserted,
+            "duplicates": duplicates, "analyzed": mapper.analyzed, "truncated": progress["truncated"]}
+
+
+async def import_file(db, user_id: int, path: str, progress: dict, chunk: int = 200) -> dict:
+    return await asyncio.to_thread(run_import, db, user_id, path, progress, chunk)
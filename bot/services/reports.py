@@ -0,0 +1,113 @@
+from __future__ import annotations
+import asyncio
+import csv
+import json
+import os
+import shutil
+import tempfile
+from datetime import datetime
+
+FORMATS = ("json", "csv")
+
+# Все отчёты — агрегаты одним запросом; когорта — месяц регистрации (users.created_at).
+REPORTS = {
+    # trial -> оплата по таблице payments; revenue — в рублях (amount хранится в копейках).
+    # had_access — когда-либо был paid_until: сюда же попадают продления за рефералов и оплаты до payments
+    "conversion": """
+        WITH p AS (SELECT user_id, SUM(amount) AS amount FROM payments GROUP BY user_id)
+        SELECT substr(u.created_at, 1, 7) AS cohort,
+               COUNT(*) AS users,
+               SUM(u.trial_start IS NOT NULL) AS trials,
+               COUNT(p.user_id) AS payers,
+               ROUND(1.0 * COUNT(p.user_id) / MAX(SUM(u.trial_start IS NOT NULL), 1), 3) AS trial_to_paid,
+               COALESCE(SUM(p.amount), 0) / 100 AS revenue,
+               SUM(u.paid_until IS NOT NULL) AS had_access,
+               SUM(u.status = 'active') AS active_now
+        FROM users u LEFT JOIN p ON p.user_id = u.id
+        GROUP BY cohort ORDER BY cohort""",
+
+    # воронка рефералов: каждый следующий статус включает предыдущие
+    "referrals": """
+        SELECT substr(created_at, 1, 7) AS cohort,
+               COUNT(*) AS invited,
+               SUM(status IN ('discount_reserved', 'paid', 'rewarded')) AS discount_reserved,
+               SUM(status IN ('paid', 'rewarded') OR first_payment_at IS NOT NULL) AS paid,
+               SUM(status = 'rewarded') AS rewarded
+        FROM referrals GROUP BY cohort ORDER BY cohort""",
+
+    # удержание: были ли записи на 1-й день, на 2-й неделе (7–13) и на 5-й (28–34) после регистрации.
+    # Читает food_daily (одна строка на день), а не food_entries
+    "retention": """
+        WITH c AS (
+          SELECT id, substr(created_at, 1, 7) AS cohort, substr(created_at, 1, 10) AS d0 FROM users
+        ), a AS (
+          SELECT c.id,
+                 MAX(d.day = date(c.d0, '+1 day')) AS d1,
+                 MAX(d.day BETWEEN date(c.d0, '+7 days') AND date(c.d0, '+13 days')) AS w1,
+                 MAX(d.day BETWEEN date(c.d0, '+28 days') AND date(c.d0, '+34 days')) AS w4
+          FROM c JOIN food_daily d ON d.user_id = c.id AND d.day > c.d0 AND d.day <= date(c.d0, '+34 days')
+          GROUP BY c.id
+        )
+        SELECT c.cohort, COUNT(*) AS users,
+               COALESCE(SUM(a.d1), 0) AS d1, COALESCE(SUM(a.w1), 0) AS w1, COALESCE(SUM(a.w4), 0) AS w4,
+               SUM(c.d0 <= date(:asof, '-35 days')) AS w4_eligible
+        FROM c LEFT JOIN a ON a.id = c.id GROUP BY c.cohort ORDER BY c.cohort""",
+
+    # среднее записанное потребление за день с записями
+    "cohort_kcal": """
+        SELECT substr(u.created_at, 1, 7) AS cohort,
+               COUNT(DISTINCT d.user_id) AS loggers,
+               COUNT(*) AS logged_days,
+               ROUND(AVG(d.kcal_mid)) AS avg_kcal_day,
+               ROUND(AVG(d.n), 2) AS avg_entries_day
+        FROM food_daily d JOIN users u ON u.id = d.user_id
+        GROUP BY cohort ORDER BY cohort""",
+}
+
+# отчёты тяжёлые, но редкие: по одному за раз
+_REPORTS = asyncio.Semaphore(1)
+
+
+def build_reports(db, names=None, asof: str | None = None) -> dict:
+    """{имя: {"columns": [...], "rows": [[...]]}} — все отчёты из одного снимка."""
+    asof = asof or datetime.utcnow().date().isoformat()
+    return db.report_rows({name: REPORTS[name] for name in names or REPORTS}, {"asof": asof})
+
+
+def write_reports(reports: dict, fmt: str, directory: str) -> list[str]:
+    """JSON — один файл на всё, CSV — по файлу на отчёт."""
+    stamp = datetime.utcnow().strftime("%Y%m%d_%H%M")
+    if fmt == "json":
+        path = os.path.join(directory, f"reports_{stamp}.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"generated_at": stamp, "reports": reports}, f, ensure_ascii=False, indent=1)
+        return [path]
+    paths = []
+    for name, rep in reports.items():
+        path = os.path.join(directory, f"{name}_{stamp}.csv")
+        with open(path, "w", encoding="utf-8", newline="") as f:
+            w = csv.writer(f)
+            w.writerow(rep["columns"])
+            w.writerows(rep["rows"])
+        paths.append(path)
+    return paths
+
+
+def _run(db, names, fmt: str, directory: str) -> list[str]:
+    return write_reports(build_reports(db, names), fmt, directory)
+
+
+async def run_reports(db, names=None, fmt: str = "json") -> tuple[str, list[str]]:
+    """(временный каталог, файлы). Каталог удаляет вызывающий."""
+    if fmt not in FORMATS:
+        raise ValueError(fmt)
+    directory = tempfile.mkdtemp(prefix="reports_")
+    try:
+        async with _REPORTS:
+            # запросы (в одном read-only снимке, db.report_rows) и запись файлов — в потоке:
+            # цикл событий и писатель свободны
+            paths = await asyncio.to_thread(_run, db, names, fmt, directory)
+    except BaseException:
+        shutil.rmtree(directory, ignore_errors=True)
+        raise
+    return directory, paths
@@ -0,0 +1,58 @@
+from __future__ import annotations
+import asyncio
+from datetime import datetime, time, timedelta, timezone
+from zoneinfo import ZoneInfo
+
+SUMMARY_HOUR = 21  # локальное время, с которого шлём итог дня
+
+
+def render_summary(row: dict) -> str:
+    target = row["kcal_target"]
+    text = (
+        f"Итоги дня: ~{row['mid']} ккал (диапазон {row['low']}–{row['high']})\n"
+        f"Цель: {target} ккал\n"
+    )
+    if row["mid"] <= target:
+        text += f"Осталось: ~{target - row['mid']} ккал"
+    else:
+        text += f"Перебор: ~{row['mid'] - target} ккал"
+    return text
+
+
+def local_day_window(tz_name: str, now_utc: datetime) -> tuple[str, str, str, int]:
+    """(локальная дата, начало и конец локального дня в UTC ISO, текущий локальный час)."""
+    tz = ZoneInfo(tz_name)
+    local = now_utc.replace(tzinfo=timezone.utc).astimezone(tz)
+    start = datetime.combine(local.date(), time(0), tzinfo=tz)
+    end = start + timedelta(days=1)
+
+    def utc_iso(d: datetime) -> str:
+        return d.astimezone(timezone.utc).replace(tzinfo=None).isoformat()
+
+    return local.date().isoformat(), utc_iso(start), utc_iso(end), local.hour
+
+
+async def send_daily_summaries(db, bot, outbox, default_tz: str, hour: int = SUMMARY_HOUR,
+                               chunk: int = 500, now_utc: datetime | None = None) -> int:
+    """
+    Итог дня всем, у кого локально уже `hour`:00 и кто сегодня его ещё не получал.
+    Пачка сначала помечается в БД, потом отправляется, поэтому повтор после рестарта
+    продолжает с неотмеченных пользователей и никому не шлёт дважды.
+    В памяти — одна пачка: следующую читаем, когда предыдущая ушла через outbox.
+    Только отправка: в среднее потребление день вливает ночной adjust_targets, когда он завершён.
+    """
+    now_utc = now_utc or datetime.utcnow()
+    sent = 0
+    for tz in db.user_timezones():
+        day, start_iso, end_iso, local_hour = local_day_window(tz or default_tz, now_utc)
+        if local_hour < hour:
+            continue
+        for batch in db.summary_batches(tz, day, start_iso, end_iso, chunk=chunk):
+            db.mark_summary_sent([r["id"] for r in batch], day)
+            tasks = [
+                outbox.notify(bot.send_message(chat_id=r["chat_id"], text=render_summary(r)))
+                for r in batch if r["n"] > 0
+            ]
+            await asyncio.gather(*tasks, return_exceptions=True)
+            sent += len(tasks)
+    return sent
@@ -1,5 +1,14 @@
 from __future__ import annotations
 import math
+from typing import Sequence
+
+# версия формулы; сохраняется в daily_targets.formula_version.
+# Поднять при любом изменении расчёта ниже — джоба recompute_targets пересчитает устаревшие строки.
+#   1 — старая формула анкеты (start._calc_targets: TDEE-400/+300, белок 1.6/1.4)
+#   2 — единый движок: дефицит 15% / профицит 10%, белок 1.8/1.4/1.6 г/кг, пол 1200 ккал
+FORMULA_VERSION = 2
+
+KCAL_FLOOR = 1200  # нижняя страховка
 
 ACTIVITY_FACTOR = {
     "sedentary": 1.2,
@@ -8,34 +17,49 @@ ACTIVITY_FACTOR = {
     "high": 1.725,
     "athlete": 1.9,
 }
+DEFAULT_ACTIVITY_FACTOR = 1.375
+
+GOAL_KCAL_FACTOR = {"lose": 0.85, "maintain": 1.0, "gain": 1.10}   # ~15% дефицит / мягкий профицит
+GOAL_PROTEIN_G_PER_KG = {"lose": 1.8, "maintain": 1.4, "gain": 1.6}
+SEX_BMR_SHIFT = {"m": 5, "f": -161}
+SEX_FIBER_G = {"m": 30, "f": 25}
 
 def mifflin_st_jeor(sex: str, age: int, height_cm: float, weight_kg: float) -> float:
     # BMR
-    s = 5 if sex == "m" else -161
+    s = SEX_BMR_SHIFT.get(sex, SEX_BMR_SHIFT["f"])
     return 10 * weight_kg + 6.25 * height_cm - 5 * age + s
 
 def compute_targets(sex: str, age: int, height_cm: float, weight_kg: float, activity: str, goal: str) -> tuple[int,int,int]:
     bmr = mifflin_st_jeor(sex, age, height_cm, weight_kg)
-    tdee = bmr * ACTIVITY_FACTOR.get(activity, 1.375)
-
-    if goal == "lose":
-        kcal = tdee * 0.85  # ~15% deficit
-    elif goal == "gain":
-        kcal = tdee * 1.10  # mild surplus
-    else:
-        kcal = tdee
-
-    kcal_target = int(round(kcal))
+    tdee = bmr * ACTIVITY_FACTOR.get(activity, DEFAULT_ACTIVITY_FACTOR)
+    kcal_target = max(KCAL_FLOOR, int(round(tdee * GOAL_KCAL_FACTOR.get(goal, 1.0))))
 
     # Simple evidence-aligned heuristics (not medical):
     # protein: higher if losing, moderate otherwise
-    if goal == "lose":
-        protein = 1.8 * weight_kg
-    elif goal == "gain":
-        protein = 1.6 * weight_kg
-    else:
-        protein = 1.4 * weight_kg
-
-    protein_g = int(round(protein))
-    fiber_g = 25 if sex == "f" else 30
+    protein_g = int(round(GOAL_PROTEIN_G_PER_KG.get(goal, 1.4) * weight_kg))
+    fiber_g = SEX_FIBER_G.get(sex, SEX_FIBER_G["m"])
     return kcal_target, protein_g, fiber_g
+
+
+def compute_targets_batch(sex: Sequence[str], age: Sequence[int], height_cm: Sequence[float],
+                          weight_kg: Sequence[float], activity: Sequence[str], goal: Sequence[str],
+                          ) -> tuple[list[int], list[int], list[int]]:
+    """
+    Та же формула, что compute_targets, но по колонкам: на входе массивы одинаковой длины,
+    на выходе три колонки (kcal, белок, клетчатка). Справочники раскрываются в колонки
+    один раз, дальше — поэлементная арифметика без ветвлений на строку.
+    """
+    n = len(sex)
+    if not (len(age) == len(height_cm) == len(weight_kg) == len(activity) == len(goal) == n):
+        raise ValueError("columns must have equal length")
+
+    shift = [SEX_BMR_SHIFT.get(s, -161) for s in sex]
+    af = [ACTIVITY_FACTOR.get(a, DEFAULT_ACTIVITY_FACTOR) for a in activity]
+    gk = [GOAL_KCAL_FACTOR.get(g, 1.0) for g in goal]
+    gp = [GOAL_PROTEIN_G_PER_KG.get(g, 1.4) for g in goal]
+
+    bmr = [10 * w + 6.25 * h - 5 * a + s for w, h, a, s in zip(weight_kg, height_cm, age, shift)]
+    kcal = [max(KCAL_FLOOR, int(round(b * f * k))) for b, f, k in zip(bmr, af, gk)]
+    protein = [int(round(p * w)) for p, w in zip(gp, weight_kg)]
+    fiber = [SEX_FIBER_G.get(s, SEX_FIBER_G["m"]) for s in sex]
+    return kcal, protein, fiber
@@ -0,0 +1,114 @@
+from __future__ import annotations
+from dataclasses import asdict, dataclass, replace
+from datetime import date
+from typing import Optional
+
+from bot.services.targets import GOAL_KCAL_FACTOR, GOAL_PROTEIN_G_PER_KG, KCAL_FLOOR
+
+# Адаптивный TDEE: расход = среднее потребление − изменение массы × энергия 1 кг.
+# Состояние на пользователя — несколько чисел (tdee_state), обновляется за O(1):
+# взвешивание двигает тренд веса (Holt: уровень + наклон), завершённый день из food_daily —
+# EMA потребления (ночной adjust_targets). Историю food_entries не перечитываем никогда.
+
+KCAL_PER_KG = 7700
+WEIGHT_ALPHA = 0.10     # доля нового взвешивания за сутки (полураспад ~6.6 дня)
+SLOPE_BETA = 0.10       # сглаживание наклона тренда
+INTAKE_ALPHA = 0.10     # доля нового дня в среднем потреблении
+INTAKE_CATCHUP_DAYS = 7 # пропущенные ночные прогоны догоняем, но не глубже недели
+
+MIN_WEIGHINS = 4        # раньше — цели не трогаем
+MIN_INTAKE_DAYS = 7
+MIN_SPAN_DAYS = 14
+MAX_STEP_KCAL = 100     # за одну корректировку цель сдвигается не больше чем на столько
+
+
+@dataclass
+class TdeeState:
+    user_id: int
+    weight: Optional[float] = None        # тренд веса, кг
+    weight_slope: float = 0.0             # кг/сутки
+    weight_day: Optional[str] = None      # дата последнего взвешивания
+    weight_n: int = 0
+    intake: Optional[float] = None        # EMA потребления, ккал/сутки
+    intake_day: Optional[str] = None      # последний учтённый день
+    intake_n: int = 0
+    first_day: Optional[str] = None       # первое взвешивание — для MIN_SPAN_DAYS
+
+
+def _days(a: str, b: str) -> int:
+    return (date.fromisoformat(b) - date.fromisoformat(a)).days
+
+
+def add_weight(st: TdeeState, day: str, kg: float) -> TdeeState:
+    if st.weight is None or st.weight_day is None:
+        return replace(st, weight=kg, weight_slope=0.0, weight_day=day, weight_n=1, first_day=day)
+    dt = _days(st.weight_day, day)
+    if dt < 0:  # взвешивание задним числом в тренд не вписывается
+        return st
+    # чем дольше не взвешивались, тем больше вес у нового замера
+    alpha = 1 - (1 - WEIGHT_ALPHA) ** max(dt, 1)
+    level = alpha * kg + (1 - alpha) * (st.weight + st.weight_slope * dt)
+    slope = st.weight_slope
+    if dt > 0:
+        slope = SLOPE_BETA * (level - st.weight) / dt + (1 - SLOPE_BETA) * st.weight_slope
+    # повторное взвешивание в тот же день уточняет тренд, но новым замером для MIN_WEIGHINS не считается
+    return replace(st, weight=level, weight_slope=slope, weight_day=day,
+                   weight_n=st.weight_n + 1 if dt > 0 else st.weight_n)
+
+
+def add_intake(st: TdeeState, day: str, kcal: float) -> TdeeState:
+    # пустые дни не учитываем: «не записал» ≠ «не ел»; повтор того же дня игнорируем
+    if kcal <= 0 or (st.intake_day is not None and day <= st.intake_day):
+        return st
+    intake = kcal if st.intake is None else INTAKE_ALPHA * kcal + (1 - INTAKE_ALPHA) * st.intake
+    return replace(st, intake=intake, intake_day=day, intake_n=st.intake_n + 1)
+
+
+def estimate_tdee(st: TdeeState) -> Optional[float]:
+    if st.weight_n < MIN_WEIGHINS or st.intake_n < MIN_INTAKE_DAYS or st.intake is None:
+        return None
+    if st.first_day is None or st.weight_day is None or _days(st.first_day, st.weight_day) < MIN_SPAN_DAYS:
+        return None
+    return st.intake - st.weight_slope * KCAL_PER_KG
+
+
+def adapt_targets(st: TdeeState, goal: str, kcal_target: int) -> Optional[tuple[int, int]]:
+    """Новые (kcal, белок) или None, если данных мало или менять нечего."""
+    tdee = estimate_tdee(st)
+    if tdee is None:
+        return None
+    want = tdee * GOAL_KCAL_FACTOR.get(goal, 1.0)
+    step = max(-MAX_STEP_KCAL, min(MAX_STEP_KCAL, want - kcal_target))
+    kcal = max(KCAL_FLOOR, int(round(kcal_target + step)))
+    protein = int(round(GOAL_PROTEIN_G_PER_KG.get(goal, 1.4) * st.weight))
+    if kcal == kcal_target:
+        return None
+    return kcal, protein
+
+
+def load_state(db, user_id: int) -> TdeeState:
+    row = db.get_tdee_state(user_id)
+    return TdeeState(**row) if row else TdeeState(user_id=user_id)
+
+
+def fold_daily_intake(db, rows: list[dict]) -> int:
+    """
+    rows — пачка из intake_batches, у каждой строки until — последний завершённый день пользователя.
+    Дни после intake_day и не позже until вливаются в EMA потребления по порядку.
+    """
+    rows = [r for r in rows if any(d <= r["until"] for d, _ in r["days"])]
+    if not rows:
+        return 0
+    states = db.tdee_states([r["id"] for r in rows])
+    changed = []
+    for r in rows:
+        row = states.get(r["id"])
+        st = new = TdeeState(**row) if row else TdeeState(user_id=r["id"])
+        for day, kcal in r["days"]:
+            if day <= r["until"]:
+                new = add_intake(new, day, kcal)
+        if new is not st:
+            changed.append(asdict(new))
+    if changed:
+        db.save_tdee_states(changed)
+    return len(changed)
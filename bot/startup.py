@@ -0,0 +1,51 @@
+from __future__ import annotations
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+
+log = logging.getLogger(__name__)
+
+# импортируется первым из bot.main — это и есть «старт процесса» для метрик
+PROCESS_T0 = time.perf_counter()
+
+# name -> мс от старта процесса
+STARTUP_METRICS: dict[str, float] = {}
+
+
+def mark(name: str) -> float:
+    ms = round((time.perf_counter() - PROCESS_T0) * 1000, 1)
+    STARTUP_METRICS.setdefault(name, ms)
+    log.info("startup: %s after %.1f ms", name, ms)
+    return ms
+
+
+class FirstReplyProbe(BaseRequestMiddleware):
+    """Засекает время до первого успешно отправленного сообщения (time-to-first-reply)."""
+
+    def __init__(self):
+        self.done = False
+
+    async def __call__(self, make_request, bot, method):
+        result = await make_request(bot, method)
+        if not self.done and method.__api_method__.startswith("send"):
+            self.done = True
+            mark("first_reply")
+        return result
+
+
+async def warm_up(db, days: int = 3, limit: int = 5000):
+    """Фоновый прогрев после старта поллинга: кэши пользователей/целей и анализатор."""
+    await asyncio.sleep(0)
+    started = time.perf_counter()
+    since = (datetime.utcnow() - timedelta(days=days)).replace(microsecond=0).isoformat()
+    n = db.warm_up(since, limit=limit)
+    await asyncio.sleep(0)
+
+    from bot.services.analyzer import analyze
+    analyze("прогрев: курица с рисом, соуса мало", has_photo=True)
+
+    log.info("startup: warmed %d users in %.1f ms", n, (time.perf_counter() - started) * 1000)
+    mark("warm_up_done")
@@ -0,0 +1,694 @@
+"""
+Хранилище бота: протокол Storage и хранилище в памяти.
+
+Хэндлеры, middleware и сервисы работают только через методы Storage — без conn и SQL. Реализации:
+  bot.db.DB          — SQLite (прод);
+  MemoryStorage      — словари и отсортированные списки с теми же ключами, что первичные ключи
+                       и индексы SQLite: для тестов и бенчмарков логики хэндлеров без диска.
+Отчёты /report — SQL-запросы, поэтому они в отдельном протоколе SqlReports, который есть только у DB.
+Поведение обеих проверяет общий набор тестов tests/test_storage.py.
+"""
+from __future__ import annotations
+import math
+import re
+import secrets
+import string
+import unicodedata
+from bisect import bisect_left, bisect_right, insort
+from datetime import date, datetime, timedelta
+from typing import Iterator, Optional, Protocol, runtime_checkable
+
+from bot import codec
+from bot.cache import LRUCache
+from bot.db import FREQUENT_MAX, ROLLUP_LEVELS, TDEE_COLS, UserRow, extend_paid_until, normalize_meal, week_key
+
+ACTIVE_STATUSES = ("beta", "trial", "active")
+
+
+@runtime_checkable
+class Storage(Protocol):
+    """Все операции, которые нужны хэндлерам, сервисам и планировщику."""
+
+    path: str
+    caches: dict[str, LRUCache]     # имя -> кэш, для /diag и метрик; у хранилища в памяти пусто
+
+    def close(self) -> None: ...
+    def now_iso(self) -> str: ...
+
+    # пользователи и доступ
+    def get_or_create_user(self, tg_id: int, chat_id: int, default_status: str) -> UserRow: ...
+    def find_user(self, tg_id: int) -> Optional[UserRow]: ...
+    def set_user_status(self, user_id: int, status: str) -> None: ...
+    def set_user_tz(self, user_id: int, tz: str | None) -> None: ...
+    def set_paid_until(self, user_id: int, paid_until_iso: str) -> None: ...
+    def expire_trials(self, now_iso: str) -> int: ...
+    def expire_subscriptions(self, now_iso: str) -> int: ...
+    def user_timezones(self) -> list[str | None]: ...
+    def summary_batches(self, tz: str | None, day: str, start_iso: str, end_iso: str,
+                        chunk: int = 500) -> Iterator[list[dict]]: ...
+    def chart_batches(self, since_day: str, chunk: int = 500) -> Iterator[list[dict]]: ...
+    def mark_summary_sent(self, user_ids: list[int], day: str) -> None: ...
+    def warm_up(self, since_iso: str, limit: int = 5000) -> int: ...
+
+    # анкета, цели, адаптивный TDEE
+    def upsert_profile(self, user_id: int, **fields) -> None: ...
+    def get_profile(self, user_id: int) -> Optional[dict]: ...
+    def upsert_targets(self, user_id: int, kcal_target: int, protein_g: int, fiber_g: int,
+                       formula_version: int | None = None) -> None: ...
+    def get_targets(self, user_id: int) -> Optional[dict]: ...
+    def stale_target_batches(self, formula_version: int, chunk: int = 1000) -> Iterator[list[tuple]]: ...
+    def bulk_upsert_targets(self, rows: list[tuple[int, int, int, int]], formula_version: int) -> int: ...
+    def get_tdee_state(self, user_id: int) -> Optional[dict]: ...
+    def tdee_states(self, user_ids: list[int]) -> dict[int, dict]: ...
+    def save_tdee_states(self, states: list[dict]) -> None: ...
+    def log_weight(self, user_id: int, day: str, weight_kg: float, state: dict) -> None: ...
+    def weight_history(self, user_id: int, since_day: str) -> list[tuple[str, float]]: ...
+    def adaptive_batches(self, min_weighins: int, chunk: int = 1000) -> Iterator[list[dict]]: ...
+    def intake_batches(self, first_day: str, last_day: str, chunk: int = 1000) -> Iterator[list[dict]]: ...
+
+    # записи еды и сводки
+    def add_food_entry(self, user_id: int, ts_iso: str, text: str | None, photo_file_id: str | None,
+                       parsed_json: str, kcal_low: int, kcal_high: int, kcal_mid: int,
+                       conf: float, err_low: float, err_high: float) -> int: ...
+    def get_food_entry(self, entry_id: int, user_id: int) -> Optional[dict]: ...
+    def update_food_entry(self, entry_id: int, user_id: int, parsed_json: str, kcal_low: int, kcal_high: int,
+                          kcal_mid: int, conf: float, err_low: float, err_high: float) -> None: ...
+    def repeat_food_entry(self, entry_id: int, user_id: int, ts_iso: str) -> Optional[int]: ...
+    def today_kcal_sum(self, user_id: int, day_utc: datetime) -> tuple[int, int, int]: ...
+    def rollups(self, user_id: int, level: str, first: str, last: str) -> list[dict]: ...
+    def frequent_meals(self, user_id: int, prefix: str | None = None, limit: int = 8) -> list[dict]: ...
+    def search_meals(self, user_id: int, query: str, limit: int = 8) -> list[dict]: ...
+    def merge_fts(self, pages: int = 500) -> int: ...
+    def export_rows(self, user_id: int, chunk: int = 500) -> Iterator[dict]: ...
+    def import_entries(self, user_id: int, entries, chunk: int = 200,
+                       progress: dict | None = None) -> tuple[int, int]: ...
+
+    # user_meta (запись отложенная)
+    def get_meta(self, user_id: int, key: str) -> Optional[str]: ...
+    def set_meta(self, user_id: int, key: str, value: str) -> None: ...
+    def flush_meta(self) -> int: ...
+    def meta_pending(self) -> int: ...
+
+    # рефералы и оплаты
+    def get_or_create_promo_code(self, user_id: int) -> str: ...
+    def apply_promo_for_new_user(self, referred_user_id: int, code: str) -> tuple[bool, str, int | None]: ...
+    def get_discount_for_user(self, user_id: int) -> int: ...
+    def referral_stats(self, user_id: int) -> dict: ...
+    def referral_top(self, limit: int = 10) -> list[dict]: ...
+    def referral_rank(self, user_id: int) -> Optional[int]: ...
+    def rebuild_referral_stats(self) -> dict: ...
+    def apply_payment(self, user_id: int, charge_id: str, provider_charge_id: str | None, amount: int,
+                      currency: str, payload: str | None, days: int = 30, reward_days: int = 7) -> dict: ...
+
+    # админка
+    def enable_profiling(self, threshold_ms: float = 50.0) -> None: ...
+    def disable_profiling(self) -> None: ...
+    def query_stats(self, limit: int = 20) -> Optional[list[dict]]: ...
+
+
+@runtime_checkable
+class SqlReports(Protocol):
+    """Только у SQLite: отчёты /report — это SQL-запросы (bot.services.reports.REPORTS)."""
+
+    def report_rows(self, queries: dict[str, str], params: dict) -> dict: ...
+
+
+def _fts_tokens(text: str) -> list[str]:
+    # как unicode61 remove_diacritics 2: нижний регистр, без диакритики (ё -> е, й -> и), слова из букв/цифр
+    folded = "".join(c for c in unicodedata.normalize("NFD", (text or "").lower()) if not unicodedata.combining(c))
+    return re.findall(r"\w+", folded)
+
+
+class MemoryStorage:
+    """
+    Storage в памяти процесса. Ключи — как у первичных ключей и индексов SQLite:
+    users по id и tg_id (UNIQUE), (status, trial_end) и (status, paid_until) отсортированными списками,
+    записи по id и (user_id, ts), сводки по (user_id, день|неделя|месяц), частые блюда и user_meta по своим PK,
+    referral_stats по (paid DESC, invited DESC), reward_ledger по user_id,
+    полнотекстовый поиск — обратный индекс токен -> id записей с отсортированным словарём для префиксов.
+    Пачки пользователей читаются keyset'ом по отсортированным id, как в SQLite, а не сортировкой всех.
+    Разбор записи хранится так же упакованным (bot.codec) — get_food_entry возвращает те же числа, что SQLite.
+    """
+
+    path = ":memory:"
+
+    def __init__(self):
+        self.caches: dict[str, LRUCache] = {}
+        self._users: dict[int, dict] = {}
+        self._user_by_tg: dict[int, int] = {}
+        self._users_by_status: dict[str, dict[str, list[tuple[str, int]]]] = {
+            "trial_end": {}, "paid_until": {}}                             # idx_users_status_trial_end|paid_until
+        self._users_by_tz: dict[str | None, list[int]] = {}                # tz -> id по возрастанию
+        self._last_day: list[tuple[str, int]] = []                         # (последний день в food_daily, user_id)
+        self._user_last_day: dict[int, str] = {}
+        self._profiles: dict[int, dict] = {}
+        self._targets: dict[int, dict] = {}
+        self._tdee: dict[int, dict] = {}
+        self._weights: dict[int, dict[str, float]] = {}
+        self._entries: dict[int, dict] = {}
+        self._entries_by_user: dict[int, list[tuple[str, int]]] = {}     # idx_food_entries_user_ts
+        self._rollups: dict[str, dict[int, dict[str, dict]]] = {level: {} for level in ROLLUP_LEVELS}  # (user_id, ключ)
+        self._frequent: dict[int, dict[str, dict]] = {}
+        self._fts: dict[int, dict[str, set[int]]] = {}                    # user_id -> токен -> id записей
+        self._fts_words: dict[int, list[str]] = {}                         # отсортированные токены для префиксов
+        self._meta: dict[tuple[int, str], str] = {}
+        self._promo_by_user: dict[int, str] = {}
+        self._promo_owner: dict[str, int] = {}
+        self._referrals: dict[int, dict] = {}                              # referred_user_id (UNIQUE)
+        self._referral_stats: dict[int, dict] = {}
+        self._referral_rank: list[tuple[int, int, int]] = []              # (-paid, -invited, user_id)
+        self._ledger: dict[int, list[dict]] = {}                           # user_id -> начисления
+        self._payments: dict[str, dict] = {}
+        self._next_user_id = 1
+        self._next_entry_id = 1
+
+    def close(self):
+        pass
+
+    def now_iso(self) -> str:
+        return datetime.utcnow().replace(microsecond=0).isoformat()
+
+    # пользователи и доступ
+
+    def get_or_create_user(self, tg_id: int, chat_id: int, default_status: str) -> UserRow:
+        uid = self._user_by_tg.get(tg_id)
+        if uid is None:
+            now = self.now_iso()
+            beta = default_status == "beta"
+            trial_end = (datetime.utcnow() + timedelta(days=3)).replace(microsecond=0).isoformat()
+            uid = self._next_user_id
+            self._next_user_id += 1
+            self._users[uid] = {
+                "id": uid, "tg_id": tg_id, "chat_id": chat_id, "created_at": now, "status": default_status,
+                "trial_start": None if beta else now, "trial_end": None if beta else trial_end,
+                "paid_until": None, "tz": None, "summary_day": None,
+            }
+            self._user_by_tg[tg_id] = uid
+            self._index_user(self._users[uid])
+        u = self._users[uid]
+        if chat_id and u["chat_id"] != chat_id:
+            u["chat_id"] = chat_id
+        return self._user_row(u)
+
+    @staticmethod
+    def _user_row(u: dict) -> UserRow:
+        return UserRow(id=u["id"], tg_id=u["tg_id"], chat_id=u["chat_id"], status=u["status"],
+                       trial_start=u["trial_start"], trial_end=u["trial_end"], paid_until=u["paid_until"], tz=u["tz"])
+
+    def find_user(self, tg_id: int) -> Optional[UserRow]:
+        uid = self._user_by_tg.get(tg_id)
+        return self._user_row(self._users[uid]) if uid is not None else None
+
+    @staticmethod
+    def _remove(index: list, key):
+        i = bisect_left(index, key)
+        if i < len(index) and index[i] == key:
+            del index[i]
+
+    def _index_user(self, u: dict):
+        for column, by_status in self._users_by_status.items():
+            if u[column] is not None:
+                insort(by_status.setdefault(u["status"], []), (u[column], u["id"]))
+        insort(self._users_by_tz.setdefault(u["tz"], []), u["id"])
+
+    def _unindex_user(self, u: dict):
+        for column, by_status in self._users_by_status.items():
+            if u[column] is not None:
+                self._remove(by_status.get(u["status"], []), (u[column], u["id"]))
+        self._remove(self._users_by_tz.get(u["tz"], []), u["id"])
+
+    def _update_user(self, user_id: int, **fields):
+        # как UPDATE users: строка переставляется во всех индексах, где участвуют изменённые поля
+        u = self._users.get(user_id)
+        if u is None:
+            return
+        self._unindex_user(u)
+        u.update(fields)
+        self._index_user(u)
+
+    def set_user_status(self, user_id: int, status: str):
+        self._update_user(user_id, status=status)
+
+    def set_user_tz(self, user_id: int, tz: str | None):
+        self._update_user(user_id, tz=tz)
+
+    def set_paid_until(self, user_id: int, paid_until_iso: str):
+        self._update_user(user_id, paid_until=paid_until_iso, status="active")
+
+    def _expire(self, status: str, column: str, now_iso: str) -> int:
+        # диапазон (status, column <= now) по индексу, без обхода всех пользователей
+        index = self._users_by_status[column].get(status, [])
+        due = [uid for _, uid in index[:bisect_right(index, (now_iso, math.inf))]]
+        for uid in due:
+            self._update_user(uid, status="expired")
+        return len(due)
+
+    def expire_trials(self, now_iso: str) -> int:
+        return self._expire("trial", "trial_end", now_iso)
+
+    def expire_subscriptions(self, now_iso: str) -> int:
+        return self._expire("active", "paid_until", now_iso)
+
+    def user_timezones(self) -> list[str | None]:
+        return [tz for tz, ids in self._users_by_tz.items() if ids]
+
+    @staticmethod
+    def _batches(rows: list, chunk: int):
+        for i in range(0, len(rows), chunk):
+            yield rows[i:i + chunk]
+
+    @staticmethod
+    def _keyset(ids: list[int], chunk: int, row):
+        """Как keyset-пагинация SQLite: по отсортированным id с last_id; row(id) -> строка или None (отфильтрован)."""
+        last_id = 0
+        while True:
+            i = bisect_right(ids, last_id)
+            batch = []
+            while i < len(ids) and len(batch) < chunk:
+                r = row(ids[i])
+                i += 1
+                if r is not None:
+                    batch.append(r)
+            if not batch:
+                return
+            yield batch
+            last_id = ids[i - 1]
+
+    def _logged_since(self, since_day: str) -> list[int]:
+        # пользователи, у которых в food_daily есть день >= since_day, по возрастанию id
+        return sorted(uid for _, uid in self._last_day[bisect_left(self._last_day, (since_day,)):])
+
+    def _entry_range(self, user_id: int, start_iso: str, end_iso: str) -> list[int]:
+        idx = self._entries_by_user.get(user_id, [])
+        lo = bisect_left(idx, (start_iso,))
+        hi = bisect_left(idx, (end_iso,))
+        return [eid for _, eid in idx[lo:hi]]
+
+    def summary_batches(self, tz: str | None, day: str, start_iso: str, end_iso: str, chunk: int = 500):
+        def row(uid):
+            u, t = self._users[uid], self._targets.get(uid)
+            if t is None or u["status"] not in ACTIVE_STATUSES or u["summary_day"] == day:
+                return None
+            entries = [self._entries[eid] for eid in self._entry_range(uid, start_iso, end_iso)]
+            return {"id": uid, "chat_id": u["chat_id"], "kcal_target": t["kcal_target"],
+                    "low": sum(e["kcal_low"] for e in entries), "mid": sum(e["kcal_mid"] for e in entries),
+                    "high": sum(e["kcal_high"] for e in entries), "n": len(entries)}
+
+        yield from self._keyset(self._users_by_tz.get(tz, []), chunk, row)
+
+    def chart_batches(self, since_day: str, chunk: int = 500):
+        def row(uid):
+            u, t = self._users[uid], self._targets.get(uid)
+            if t is None or u["status"] not in ACTIVE_STATUSES:
+                return None
+            return {"id": uid, "chat_id": u["chat_id"], "kcal_target": t["kcal_target"]}
+
+        yield from self._keyset(self._logged_since(since_day), chunk, row)
+
+    def mark_summary_sent(self, user_ids: list[int], day: str):
+        for uid in user_ids:
+            if uid in self._users:
+                self._users[uid]["summary_day"] = day
+
+    def warm_up(self, since_iso: str, limit: int = 5000) -> int:
+        # кэшей нет — только столько же пользователей, сколько прогрел бы SQLite
+        n = sum(1 for idx in self._entries_by_user.values() if idx and idx[-1][0] >= since_iso)
+        return min(n, limit)
+
+    # анкета, цели, адаптивный TDEE
+
+    def upsert_profile(self, user_id: int, **fields):
+        cols = ("sex", "age", "height_cm", "weight_kg", "activity", "goal", "palm_len_cm", "palm_w_cm")
+        self._profiles[user_id] = {"user_id": user_id, **{c: fields.get(c) for c in cols},
+                                   "updated_at": self.now_iso()}
+
+    def get_profile(self, user_id: int) -> Optional[dict]:
+        p = self._profiles.get(user_id)
+        return dict(p) if p else None
+
+    def upsert_targets(self, user_id: int, kcal_target: int, protein_g: int, fiber_g: int,
+                       formula_version: int | None = None):
+        self._targets[user_id] = {"user_id": user_id, "kcal_target": kcal_target, "protein_g": protein_g,
+                                  "fiber_g": fiber_g, "updated_at": self.now_iso(), "formula_version": formula_version}
+
+    def get_targets(self, user_id: int) -> Optional[dict]:
+        t = self._targets.get(user_id)
+        return dict(t) if t else None
+
+    def stale_target_batches(self, formula_version: int, chunk: int = 1000):
+        rows = []
+        for uid in sorted(self._profiles):
+            t = self._targets.get(uid)
+            if t is None or t["formula_version"] is None or t["formula_version"] < formula_version:
+                p = self._profiles[uid]
+                rows.append((uid, p["sex"], p["age"], p["height_cm"], p["weight_kg"], p["activity"], p["goal"]))
+        yield from self._batches(rows, chunk)
+
+    def bulk_upsert_targets(self, rows: list[tuple[int, int, int, int]], formula_version: int) -> int:
+        for uid, kcal, protein, fiber in rows:
+            self.upsert_targets(uid, kcal, protein, fiber, formula_version)
+        return len(rows)
+
+    def get_tdee_state(self, user_id: int) -> Optional[dict]:
+        st = self._tdee.get(user_id)
+        return dict(st) if st else None
+
+    def tdee_states(self, user_ids: list[int]) -> dict[int, dict]:
+        return {uid: dict(self._tdee[uid]) for uid in user_ids if uid in self._tdee}
+
+    def save_tdee_states(self, states: list[dict]):
+        for st in states:
+            self._tdee[st["user_id"]] = {c: st[c] for c in TDEE_COLS}
+
+    def log_weight(self, user_id: int, day: str, weight_kg: float, state: dict):
+        self._weights.setdefault(user_id, {})[day] = weight_kg
+        if user_id in self._profiles:
+            self._profiles[user_id].update(weight_kg=weight_kg, updated_at=self.now_iso())
+        self.save_tdee_states([state])
+
+    def weight_history(self, user_id: int, since_day: str) -> list[tuple[str, float]]:
+        return sorted((d, w) for d, w in self._weights.get(user_id, {}).items() if d >= since_day)
+
+    def adaptive_batches(self, min_weighins: int, chunk: int = 1000):
+        rows = []
+        for uid in sorted(self._tdee):
+            st, p, t = self._tdee[uid], self._profiles.get(uid), self._targets.get(uid)
+            if p is None or t is None or st["weight_n"] < min_weighins:
+                continue
+            rows.append({**st, "goal": p["goal"], "kcal_target": t["kcal_target"], "protein_g": t["protein_g"],
+                         "fiber_g": t["fiber_g"]})
+        yield from self._batches(rows, chunk)
+
+    def intake_batches(self, first_day: str, last_day: str, chunk: int = 1000):
+        daily = self._rollups["day"]
+
+        def row(uid):
+            u = self._users[uid]
+            if u["status"] not in ACTIVE_STATUSES:
+                return None
+            days = sorted((d, r["kcal_mid"]) for d, r in daily[uid].items() if first_day <= d <= last_day)
+            return {"id": uid, "tz": u["tz"], "days": days} if days else None
+
+        yield from self._keyset(self._logged_since(first_day), chunk, row)
+
+    # записи еды и сводки
+
+    def _insert_entry(self, user_id: int, ts_iso: str, text: str | None, photo_file_id: str | None,
+                      packed: bytes, kcal_low: int, kcal_high: int, kcal_mid: int) -> int:
+        eid = self._next_entry_id
+        self._next_entry_id += 1
+        self._entries[eid] = {"id": eid, "user_id": user_id, "ts": ts_iso, "text": text,
+                              "photo_file_id": photo_file_id, "packed": packed,
+                              "kcal_low": kcal_low, "kcal_high": kcal_high, "kcal_mid": kcal_mid}
+        insort(self._entries_by_user.setdefault(user_id, []), (ts_iso, eid))
+        if text:
+            index, words = self._fts.setdefault(user_id, {}), self._fts_words.setdefault(user_id, [])
+            for tok in set(_fts_tokens(text)):
+                if tok not in index:
+                    index[tok] = set()
+                    insort(words, tok)
+                index[tok].add(eid)
+        self._rollup(user_id, ts_iso, 1, kcal_low, kcal_mid, kcal_high)
+        return eid
+
+    def add_food_entry(self, user_id: int, ts_iso: str, text: str | None, photo_file_id: str | None,
+                       parsed_json: str, kcal_low: int, kcal_high: int, kcal_mid: int,
+                       conf: float, err_low: float, err_high: float) -> int:
+        eid = self._insert_entry(user_id, ts_iso, text, photo_file_id, codec.pack(parsed_json, conf, err_low, err_high),
+                                 kcal_low, kcal_high, kcal_mid)
+        if text:
+            self._bump_frequent(user_id, normalize_meal(text), eid, ts_iso)
+        return eid
+
+    def _rollup(self, user_id: int, ts_iso: str, dn: int, dlow: int, dmid: int, dhigh: int):
+        day = ts_iso[:10]
+        last = self._user_last_day.get(user_id)
+        if last is None or day > last:
+            if last is not None:
+                self._remove(self._last_day, (last, user_id))
+            insort(self._last_day, (day, user_id))
+            self._user_last_day[user_id] = day
+        new_day = day not in self._rollups["day"].get(user_id, {})
+        keys = {"day": day, "week": week_key(date.fromisoformat(day)), "month": day[:7]}
+        for level, key in keys.items():
+            r = self._rollups[level].setdefault(user_id, {}).setdefault(
+                key, {"n": 0, "days": 0, "kcal_low": 0, "kcal_mid": 0, "kcal_high": 0})
+            r["n"] += dn
+            r["days"] += new_day if level != "day" else 0
+            r["kcal_low"] += dlow
+            r["kcal_mid"] += dmid
+            r["kcal_high"] += dhigh
+
+    def rollups(self, user_id: int, level: str, first: str, last: str) -> list[dict]:
+        rows = self._rollups[level].get(user_id, {})
+        return [{"key": k, **rows[k], "days": 1 if level == "day" else rows[k]["days"]}
+                for k in sorted(k for k in rows if first <= k <= last)]
+
+    def get_food_entry(self, entry_id: int, user_id: int) -> Optional[dict]:
+        e = self._entries.get(entry_id)
+        if e is None or e["user_id"] != user_id:
+            return None
+        return codec.entry_row(e)
+
+    def update_food_entry(self, entry_id: int, user_id: int, parsed_json: str, kcal_low: int, kcal_high: int,
+                          kcal_mid: int, conf: float, err_low: float, err_high: float):
+        e = self._entries.get(entry_id)
+        if e is None or e["user_id"] != user_id:
+            return
+        self._rollup(user_id, e["ts"], 0, kcal_low - e["kcal_low"], kcal_mid - e["kcal_mid"],
+                     kcal_high - e["kcal_high"])
+        e.update(packed=codec.pack(parsed_json, conf, err_low, err_high),
+                 kcal_low=kcal_low, kcal_high=kcal_high, kcal_mid=kcal_mid)
+
+    def repeat_food_entry(self, entry_id: int, user_id: int, ts_iso: str) -> Optional[int]:
+        e = self.get_food_entry(entry_id, user_id)
+        if e is None:
+            return None
+        return self.add_food_entry(user_id, ts_iso, e["text"], None, e["parsed_json"], e["kcal_low"],
+                                   e["kcal_high"], e["kcal_mid"], e["conf"], e["err_low"], e["err_high"])
+
+    def today_kcal_sum(self, user_id: int, day_utc: datetime) -> tuple[int, int, int]:
+        r = self._rollups["day"].get(user_id, {}).get(day_utc.date().isoformat())
+        if r is None:
+            return 0, 0, 0
+        return r["kcal_low"], r["kcal_mid"], r["kcal_high"]
+
+    def _bump_frequent(self, user_id: int, norm: str, entry_id: int, ts_iso: str):
+        if not norm:
+            return
+        meals = self._frequent.setdefault(user_id, {})
+        m = meals.get(norm)
+        if m is not None:
+            m.update(cnt=m["cnt"] + 1, entry_id=entry_id, last_ts=ts_iso)
+            return
+        meals[norm] = {"entry_id": entry_id, "cnt": 1, "last_ts": ts_iso}
+        if len(meals) > FREQUENT_MAX:
+            ranked = sorted(meals, key=lambda k: (meals[k]["cnt"], meals[k]["last_ts"]), reverse=True)
+            for k in ranked[FREQUENT_MAX:]:
+                del meals[k]
+
+    def frequent_meals(self, user_id: int, prefix: str | None = None, limit: int = 8) -> list[dict]:
+        if not self._frequent.get(user_id):
+            # после импорта частые сброшены: пересобираем по последним записям, как SQLite
+            idx = self._entries_by_user.get(user_id, [])
+            recent = [self._entries[eid] for _, eid in idx if self._entries[eid]["text"] is not None][-1000:]
+            for e in recent:
+                self._bump_frequent(user_id, normalize_meal(e["text"]), e["id"], e["ts"])
+        meals = self._frequent.get(user_id, {})
+        p = normalize_meal(prefix) if prefix else None
+        keys = [k for k in meals if p is None or p <= k < p + "\uffff"]
+        keys.sort(key=lambda k: (meals[k]["cnt"], meals[k]["last_ts"]), reverse=True)
+        return [{"norm_text": k, "entry_id": meals[k]["entry_id"], "cnt": meals[k]["cnt"],
+                 "last_ts": meals[k]["last_ts"], "kcal_mid": self._entries[meals[k]["entry_id"]]["kcal_mid"]}
+                for k in keys[:limit]]
+
+    def search_meals(self, user_id: int, query: str, limit: int = 8) -> list[dict]:
+        words = [w for w in normalize_meal(query).replace('"', " ").split() if len(w) >= 2]
+        tokens = [t for w in words for t in _fts_tokens(w)]
+        if not tokens:
+            return []
+        index, vocab = self._fts.get(user_id, {}), self._fts_words.get(user_id, [])
+        found: Optional[set[int]] = None
+        for tok in tokens:
+            ids: set[int] = set()
+            i = bisect_left(vocab, tok)
+            while i < len(vocab) and vocab[i].startswith(tok):
+                ids |= index[vocab[i]]
+                i += 1
+            found = ids if found is None else found & ids
+            if not found:
+                return []
+        seen, out = set(), []
+        for eid in sorted(found, reverse=True)[:limit * 5]:
+            e = self._entries[eid]
+            norm = normalize_meal(e["text"] or "")
+            if norm and norm not in seen:
+                seen.add(norm)
+                out.append({"norm_text": norm, "entry_id": eid, "last_ts": e["ts"], "kcal_mid": e["kcal_mid"]})
+            if len(out) >= limit:
+                break
+        return out
+
+    def merge_fts(self, pages: int = 500) -> int:
+        return pages
+
+    def export_rows(self, user_id: int, chunk: int = 500):
+        # список id снят сразу: итерация в потоке не видит записей, добавленных после начала
+        for _, eid in list(self._entries_by_user.get(user_id, [])):
+            e = codec.entry_row(self._entries[eid])
+            e.pop("user_id")
+            yield e
+
+    def import_entries(self, user_id: int, entries, chunk: int = 200, progress: dict | None = None) -> tuple[int, int]:
+        inserted = duplicates = 0
+        for e in entries:
+            idx = self._entries_by_user.get(user_id, [])
+            i = bisect_left(idx, (e["ts"],))
+            dup = False
+            while i < len(idx) and idx[i][0] == e["ts"]:
+                if self._entries[idx[i][1]]["text"] == e["text"]:
+                    dup = True
+                    break
+                i += 1
+            if dup:
+                duplicates += 1
+            else:
+                self._insert_entry(user_id, e["ts"], e["text"], None,
+                                   codec.pack(e["parsed_json"], e["conf"], e["err_low"], e["err_high"]),
+                                   e["kcal_low"], e["kcal_high"], e["kcal_mid"])
+                inserted += 1
+            if progress is not None and (inserted + duplicates) % chunk == 0:
+                progress.update(inserted=inserted, duplicates=duplicates)
+        if inserted:
+            self._frequent.pop(user_id, None)
+        if progress is not None:
+            progress.update(inserted=inserted, duplicates=duplicates)
+        return inserted, duplicates
+
+    # user_meta: пишется сразу, откладывать нечего
+
+    def get_meta(self, user_id: int, key: str) -> Optional[str]:
+        return self._meta.get((user_id, key))
+
+    def set_meta(self, user_id: int, key: str, value: str):
+        self._meta[(user_id, key)] = value
+
+    def flush_meta(self) -> int:
+        return 0
+
+    def meta_pending(self) -> int:
+        return 0
+
+    # рефералы и оплаты
+
+    def get_or_create_promo_code(self, user_id: int) -> str:
+        code = self._promo_by_user.get(user_id)
+        if code is None:
+            alphabet = string.ascii_uppercase + string.digits
+            code = "NIGMA-" + "".join(secrets.choice(alphabet) for _ in range(6))
+            self._promo_by_user[user_id] = code
+            self._promo_owner[code] = user_id
+        return code
+
+    def apply_promo_for_new_user(self, referred_user_id: int, code: str) -> tuple[bool, str, int | None]:
+        if referred_user_id in self._referrals:
+            return False, "Промокод уже применён ранее.", None
+        referrer_user_id = self._promo_owner.get(code)
+        if referrer_user_id is None:
+            return False, "Промокод не найден.", None
+        if referrer_user_id == referred_user_id:
+            return False, "Нельзя применить свой промокод.", None
+        self._referrals[referred_user_id] = {
+            "referrer_user_id": referrer_user_id, "referred_user_id": referred_user_id, "code": code,
+            "status": "discount_reserved", "created_at": self.now_iso(), "first_payment_at": None,
+        }
+        self._bump_referral_stats(referrer_user_id, invited=1)
+        return True, "Ок. Скидка будет применена при первой оплате после триала.", referrer_user_id
+
+    def get_discount_for_user(self, user_id: int) -> int:
+        r = self._referrals.get(user_id)
+        return 1 if r and r["status"] == "discount_reserved" else 0
+
+    def _bump_referral_stats(self, user_id: int, invited: int = 0, paid: int = 0, reward_days: int = 0):
+        st = self._referral_stats.get(user_id)
+        if st is None:
+            st = self._referral_stats[user_id] = {"invited": 0, "paid": 0, "reward_days": 0}
+        else:
+            self._remove(self._referral_rank, (-st["paid"], -st["invited"], user_id))
+        st["invited"] += invited
+        st["paid"] += paid
+        st["reward_days"] += reward_days
+        insort(self._referral_rank, (-st["paid"], -st["invited"], user_id))
+
+    def referral_stats(self, user_id: int) -> dict:
+        return dict(self._referral_stats.get(user_id) or {"invited": 0, "paid": 0, "reward_days": 0})
+
+    def referral_top(self, limit: int = 10) -> list[dict]:
+        rows = []
+        for _, _, uid in self._referral_rank:
+            if len(rows) >= limit:
+                break
+            st = self._referral_stats[uid]
+            if st["invited"] > 0:
+                rows.append({"user_id": uid, **st})
+        return rows
+
+    def referral_rank(self, user_id: int) -> Optional[int]:
+        st = self._referral_stats.get(user_id)
+        if st is None or st["invited"] == 0:
+            return None
+        # впереди — все ключи индекса меньше (-paid, -invited): больше оплативших или столько же и больше приглашённых
+        return 1 + bisect_left(self._referral_rank, (-st["paid"], -st["invited"]))
+
+    def rebuild_referral_stats(self) -> dict:
+        want: dict[int, dict] = {}
+        for r in self._referrals.values():
+            st = want.setdefault(r["referrer_user_id"], {"invited": 0, "paid": 0, "reward_days": 0})
+            st["invited"] += 1
+            st["paid"] += r["status"] in ("paid", "rewarded") or r["first_payment_at"] is not None
+        for uid, st in want.items():
+            st["reward_days"] = sum(l["days"] for l in self._ledger.get(uid, ()) if l["reason"].startswith("referral:"))
+        have = {uid: st for uid, st in self._referral_stats.items() if st["invited"] + st["paid"] + st["reward_days"]}
+        mismatched = sum(1 for uid in set(want) | set(have) if want.get(uid) != have.get(uid))
+        self._referral_stats = want
+        self._referral_rank = sorted((-st["paid"], -st["invited"], uid) for uid, st in want.items())
+        return {"rows": len(want), "mismatched": mismatched}
+
+    def apply_payment(self, user_id: int, charge_id: str, provider_charge_id: str | None, amount: int,
+                      currency: str, payload: str | None, days: int = 30, reward_days: int = 7) -> dict:
+        if charge_id in self._payments:
+            return {"new": False, "paid_until": self._payments[charge_id]["paid_until"], "referrer_chat_id": None}
+        now = datetime.utcnow().replace(microsecond=0)
+        now_iso = now.isoformat()
+        u = self._users.get(user_id)
+        paid_until = extend_paid_until(u["paid_until"] if u else None, now, days)
+        self._update_user(user_id, paid_until=paid_until, status="active")
+        self._payments[charge_id] = {
+            "charge_id": charge_id, "provider_charge_id": provider_charge_id, "user_id": user_id, "amount": amount,
+            "currency": currency, "payload": payload, "paid_until": paid_until, "created_at": now_iso,
+        }
+        referrer_chat_id = None
+        ref = self._referrals.get(user_id)
+        if ref and ref["status"] == "discount_reserved":
+            referrer_id = ref["referrer_user_id"]
+            ref.update(status="rewarded", first_payment_at=now_iso)
+            self._ledger.setdefault(referrer_id, []).append(
+                {"user_id": referrer_id, "days": reward_days, "reason": f"referral:{user_id}", "created_at": now_iso})
+            self._bump_referral_stats(referrer_id, paid=1, reward_days=reward_days)
+            r = self._users.get(referrer_id)
+            if r is not None:
+                self._update_user(referrer_id, paid_until=extend_paid_until(r["paid_until"], now, reward_days),
+                                  status="active")
+                referrer_chat_id = int(r["chat_id"]) if r["chat_id"] else None
+        return {"new": True, "paid_until": paid_until, "referrer_chat_id": referrer_chat_id}
+
+    # админка: SQL-профилирования у хранилища в памяти нет; SQL-отчётов (SqlReports) — тоже
+
+    def enable_profiling(self, threshold_ms: float = 50.0):
+        pass
+
+    def disable_profiling(self):
+        pass
+
+    def query_stats(self, limit: int = 20) -> Optional[list[dict]]:
+        return None
@@ -0,0 +1,26 @@
+from bot.db import DB
+from bot.scheduler import expire_access
+from bot.services.access import ensure_status, is_active
+import os, tempfile
+
+
+def test_expiry_job_and_in_memory_check():
+    with tempfile.TemporaryDirectory() as td:
+        db = DB(os.path.join(td, "t.db"))
+        u = db.get_or_create_user(1, 10, "trial")
+        p = db.get_or_create_user(2, 20, "trial")
+        db.conn.execute("UPDATE users SET trial_end='2000-01-01T00:00:00'")
+        db.set_paid_until(p.id, "2000-02-01T00:00:00")
+        db.conn.commit()
+        db.users.clear()
+
+        u = db.get_or_create_user(1, 10, "trial")
+        assert u.status == "trial"
+        assert ensure_status(u).status == "expired"
+        assert not is_active(ensure_status(u))
+
+        assert expire_access(db) == 2
+        assert db.get_or_create_user(1, 10, "trial").status == "expired"
+        assert db.get_or_create_user(2, 20, "trial").status == "expired"
+        assert expire_access(db) == 0
+        db.close()
@@ -1,4 +1,4 @@
-from bot.services.analyzer import analyze, apply_refinement
+from bot.services.analyzer import analyze, apply_refinement, to_json, result_from_entry
 
 def test_analyze_caption():
     ar = analyze("Индейка в сливочном соусе с картошкой, соуса мало", has_photo=True, has_reference=True)
@@ -10,3 +10,11 @@ def test_analyze_caption():
 def test_analyze_fallback():
     ar = analyze("что-то непонятное", has_photo=False, has_reference=False)
     assert ar.kcal_mid > 0
+
+def test_result_from_stored_entry():
+    ar = analyze("курица в соусе", has_photo=True)
+    entry = {"parsed_json": to_json(ar), "kcal_low": ar.kcal_low, "kcal_high": ar.kcal_high,
+             "kcal_mid": ar.kcal_mid, "conf": ar.conf, "err_low": ar.err_low, "err_high": ar.err_high}
+    assert result_from_entry(entry) == ar
+    ar2 = apply_refinement(result_from_entry(entry), "sauce", "high")
+    assert ar2.kcal_mid == ar.kcal_mid + 120
@@ -0,0 +1,80 @@
+import asyncio
+import gzip
+import os, tempfile, threading
+
+import pytest
+
+from bot import backup as bk
+from bot.db import DB
+
+
+def _fill(db, n, start=0):
+    u = db.get_or_create_user(1, 1, "trial")
+    for i in range(start, start + n):
+        db.add_food_entry(u.id, f"2026-01-01T00:00:{i % 60:02d}", f"суп {i}", None, "{}", 1, 3, 2, 0.5, 0.1, 0.2)
+    return u
+
+
+def _age(path, stamp):
+    # имена снимков — до секунды; для ротации в тесте «состариваем» их
+    new = os.path.join(os.path.dirname(path), f"bot-{stamp}.db.gz")
+    os.rename(path, new)
+    os.rename(path + ".sha256", new + ".sha256")
+    return new
+
+
+def test_backup_verify_rotate_restore():
+    with tempfile.TemporaryDirectory() as td:
+        path, bdir = os.path.join(td, "bot.db"), os.path.join(td, "backups")
+        db = DB(path)
+        _fill(db, 500)
+
+        res = bk.backup(path, bdir, keep=2, step_pages=4, step_sleep=0)
+        assert res["gz_bytes"] < res["db_bytes"] and bk.verify(res["path"]) == "ok"
+        assert bk.BACKUP_BYTES.value("gz") == res["gz_bytes"]
+        oldest = _age(res["path"], "20000101-000000")
+
+        # снимок, снятый под записью, всё равно целый
+        stop = threading.Event()
+
+        def writer():
+            w = DB(path)
+            i = 1000
+            while not stop.is_set():
+                _fill(w, 1, i)
+                i += 1
+            w.close()
+
+        t = threading.Thread(target=writer)
+        t.start()
+        try:
+            under_load = asyncio.run(bk.run_backup(path, bdir, keep=2))
+        finally:
+            stop.set()
+            t.join()
+        assert under_load > 0
+        middle = _age(bk.list_backups(bdir)[-1], "20000102-000000")
+        assert bk.verify(middle) == "ok"
+
+        bk.backup(path, bdir, keep=2)
+        kept = bk.list_backups(bdir)
+        assert kept[0] == middle and len(kept) == 2
+        assert not os.path.exists(oldest) and not os.path.exists(oldest + ".sha256")
+
+        # повреждённый снимок не проходит проверку и не восстанавливается
+        bad = os.path.join(bdir, "bot-00000000-000000.db.gz")
+        with gzip.open(bad, "wb") as g:
+            g.write(b"not a database" * 100)
+        assert bk.verify(bad) != "ok"
+        with pytest.raises(RuntimeError):
+            bk.restore(bad, os.path.join(td, "restored.db"))
+
+        db.add_food_entry(1, "2026-02-01T00:00:00", "после бэкапа", None, "{}", 1, 3, 2, 0.5, 0.1, 0.2)
+        n_in_backup = len(list(db.export_rows(1))) - 1
+        db.close()
+        with pytest.raises(FileExistsError):
+            bk.restore(kept[-1], path)
+        bk.restore(kept[-1], path, force=True)
+        db = DB(path)
+        assert len(list(db.export_rows(1))) == n_in_backup
+        db.close()
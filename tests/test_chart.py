@@ -0,0 +1,76 @@
+import asyncio
+import struct, zlib
+import os, tempfile, time
+
+from aiogram import Bot
+from aiogram.types import Update
+
+from bot.config import Config
+from bot.db import DB
+from bot.fake_api import FakeSession
+from bot.main import build_dispatcher
+from bot.outbox import Outbox
+from bot.services.chart import PALETTE, render_chart, shutdown_pool
+
+
+def _chunks(png: bytes):
+    assert png[:8] == b"\x89PNG\r\n\x1a\n"
+    i = 8
+    while i < len(png):
+        n, kind = struct.unpack(">I4s", png[i:i + 8])
+        data = png[i + 8:i + 8 + n]
+        assert struct.unpack(">I", png[i + 8 + n:i + 12 + n])[0] == zlib.crc32(kind + data)
+        yield kind, data
+        i += 12 + n
+
+
+def test_render_chart_is_valid_png():
+    days = [(f"2026-01-{d:02d}", None if d % 5 == 0 else 1500 + d * 40) for d in range(1, 31)]
+    png = render_chart(days, 1900, width=320, height=180)
+    chunks = dict(_chunks(png))
+    w, h, depth, color = struct.unpack(">IIBB", chunks[b"IHDR"][:10])
+    assert (w, h, depth, color) == (320, 180, 8, 3)
+    assert len(chunks[b"PLTE"]) == 3 * len(PALETTE)
+    raw = zlib.decompress(chunks[b"IDAT"])
+    assert len(raw) == h * (w + 1) and max(raw) < len(PALETTE)
+    assert render_chart(days, 1900, width=320, height=180) == png
+
+
+def test_chart_command_caches_file_id_by_data_version():
+    async def run(path):
+        cfg = Config("1:X", path, "Asia/Yerevan", set(), None, 300, 50)
+        db = DB(path)
+        u = db.get_or_create_user(5, 5, "trial")
+        db.upsert_targets(u.id, 2000, 100, 25)
+        today = time.strftime("%Y-%m-%d", time.gmtime())
+        db.add_food_entry(u.id, f"{today}T08:00:00", "каша", None, "{}", 300, 500, 400, 0.6, 0.1, 0.2)
+        outbox = Outbox()
+        session = FakeSession()
+        bot = Bot("42:TEST", session=session)
+        bot.session.middleware(outbox)
+        dp = build_dispatcher(cfg, db, outbox)
+
+        async def send(i, text):
+            upd = Update.model_validate({"update_id": i, "message": {
+                "message_id": i, "date": int(time.time()), "chat": {"id": 5, "type": "private"},
+                "from": {"id": 5, "is_bot": False, "first_name": "a"}, "text": text}}, context={"bot": bot})
+            await dp.feed_update(bot, upd)
+
+        await send(1, "/chart")
+        await send(2, "/chart")          # те же данные — тот же file_id, без рендера
+        db.add_food_entry(u.id, f"{today}T13:00:00", "суп", None, "{}", 200, 400, 300, 0.6, 0.1, 0.2)
+        await send(3, "/chart")          # данные изменились — новая картинка
+        await send(4, "/chart 30")
+        await outbox.close()
+        db.close()
+        return session.sent("sendPhoto")
+
+    try:
+        with tempfile.TemporaryDirectory() as td:
+            photos = asyncio.run(run(os.path.join(td, "t.db")))
+    finally:
+        shutdown_pool()
+    kinds = [p["photo"] for p in photos]
+    assert kinds[0].startswith("attach://") and kinds[2].startswith("attach://") and kinds[3].startswith("attach://")
+    assert kinds[1] == "photo1"
+    assert photos[3]["caption"].endswith("цель 2000 ккал")
@@ -1,4 +1,4 @@
-from bot.db import DB
+from bot.db import DB, SCHEMA_VERSION
 from datetime import datetime
 import os, tempfile
 
@@ -13,3 +13,245 @@ def test_db_flow():
         low, mid, high = db.today_kcal_sum(u.id, datetime.utcnow())
         assert mid >= 20
         db.close()
+
+
+def test_schema_version_skips_ddl_and_caches():
+    with tempfile.TemporaryDirectory() as td:
+        path = os.path.join(td, "t.db")
+        db = DB(path)
+        assert db.schema_version() == SCHEMA_VERSION
+        u = db.get_or_create_user(1, 10, "trial")
+        db.upsert_targets(u.id, 2000, 100, 25)
+        db.add_food_entry(u.id, datetime.utcnow().replace(microsecond=0).isoformat(), "coffee", None, "{}", 10, 30, 20, 0.5, 0.1, 0.2)
+        db.close()
+
+        db = DB(path)
+        assert db.warm_up("2000-01-01T00:00:00") == 1
+        assert db.get_or_create_user(1, 10, "trial").id == u.id
+        assert db.get_targets(u.id)["kcal_target"] == 2000
+        assert db.users.hits == 1 and db.targets.hits == 1
+
+        db.set_paid_until(u.id, "2100-01-01T00:00:00")
+        assert db.get_or_create_user(1, 10, "trial").status == "active"
+        db.close()
+
+
+def test_meta_write_behind():
+    with tempfile.TemporaryDirectory() as td:
+        path = os.path.join(td, "t.db")
+        db = DB(path)
+        u = db.get_or_create_user(1, 10, "trial")
+        assert db.get_meta(u.id, "tip") is None
+        db.set_meta(u.id, "tip", "2026-01-01")
+        db.set_meta(u.id, "tip", "2026-01-02")
+        assert db.get_meta(u.id, "tip") == "2026-01-02"
+        assert db.conn.execute("SELECT COUNT(*) FROM user_meta").fetchone()[0] == 0
+        assert db.flush_meta() == 1
+        assert db.flush_meta() == 0
+        db.set_meta(u.id, "other", "x")
+        db.close()
+
+        db = DB(path)
+        assert db.get_meta(u.id, "tip") == "2026-01-02"
+        assert db.get_meta(u.id, "other") == "x"
+        db.close()
+
+
+def test_profiling_collects_stats_and_plans():
+    with tempfile.TemporaryDirectory() as td:
+        db = DB(os.path.join(td, "t.db"))
+        assert db.query_stats() is None
+        db.enable_profiling(threshold_ms=0)
+        u = db.get_or_create_user(1, 10, "trial")
+        db.upsert_targets(u.id, 2000, 100, 25)
+        db.today_kcal_sum(u.id, datetime.utcnow())
+
+        stats = db.query_stats()
+        assert any(s["sql"].startswith("SELECT kcal_low, kcal_mid, kcal_high FROM food_daily") and s["count"] == 1
+                   for s in stats)
+        slow = [e for e in db.conn.slow if e["sql"].startswith("SELECT kcal_low, kcal_mid, kcal_high FROM food_daily")]
+        assert slow and slow[0]["params"] == "(int, str[10])"
+        assert any("PRIMARY KEY" in p for p in slow[0]["plan"])
+        db.disable_profiling()
+        db.close()
+
+
+def test_frequent_meals_and_search():
+    from bot.db import FREQUENT_MAX
+    with tempfile.TemporaryDirectory() as td:
+        db = DB(os.path.join(td, "t.db"))
+        u = db.get_or_create_user(1, 1, "trial")
+        other = db.get_or_create_user(2, 2, "trial")
+
+        def add(uid, text, ts, kcal=500):
+            return db.add_food_entry(uid, ts, text, None, '{"components": ["x"]}', kcal - 100, kcal + 100, kcal,
+                                     0.6, 0.2, 0.3)
+
+        add(u.id, "Курица с рисом", "2026-01-01T12:00:00")
+        last = add(u.id, "курица  с рисом.", "2026-01-02T12:00:00", kcal=520)
+        add(u.id, "Омлет", "2026-01-03T08:00:00")
+        add(other.id, "курица гриль", "2026-01-03T08:00:00")
+
+        top = db.frequent_meals(u.id)
+        assert [m["norm_text"] for m in top] == ["курица с рисом", "омлет"]
+        assert top[0]["cnt"] == 2 and top[0]["entry_id"] == last
+        assert [m["norm_text"] for m in db.frequent_meals(u.id, prefix="Кур")] == ["курица с рисом"]
+
+        # полнотекст: префиксы слов в любом месте, только свои записи
+        found = db.search_meals(u.id, "рис кур")
+        assert [m["norm_text"] for m in found] == ["курица с рисом"]
+        assert db.search_meals(u.id, "гриль") == []
+        assert db.search_meals(u.id, '"') == []
+
+        new_id = db.repeat_food_entry(last, u.id, "2026-01-04T12:00:00")
+        e = db.get_food_entry(new_id, u.id)
+        assert e["kcal_mid"] == 520 and e["parsed_json"] == '{"components": ["x"]}'
+        assert db.frequent_meals(u.id)[0]["cnt"] == 3
+
+        for i in range(FREQUENT_MAX + 5):
+            add(u.id, f"блюдо {i}", f"2026-02-01T00:{i:02d}:00")
+        assert len(db.frequent_meals(u.id, limit=1000)) == FREQUENT_MAX
+        db.close()
+
+
+def test_apply_payment_idempotent_and_atomic():
+    import sqlite3
+    import pytest
+    with tempfile.TemporaryDirectory() as td:
+        db = DB(os.path.join(td, "t.db"))
+        ref = db.get_or_create_user(1, 100, "trial")
+        u = db.get_or_create_user(2, 200, "trial")
+        db.apply_promo_for_new_user(u.id, db.get_or_create_promo_code(ref.id))
+
+        first = db.apply_payment(u.id, "tg-1", "prov-1", 15000, "RUB", "sub_30d")
+        assert first["new"] and first["referrer_chat_id"] == 100
+        assert db.get_or_create_user(2, 200, "trial").paid_until == first["paid_until"]
+        ref_paid = db.get_or_create_user(1, 100, "trial").paid_until
+        assert ref_paid is not None
+
+        again = db.apply_payment(u.id, "tg-1", "prov-1", 15000, "RUB", "sub_30d")
+        assert again == {"new": False, "paid_until": first["paid_until"], "referrer_chat_id": None}
+        assert db.get_or_create_user(1, 100, "trial").paid_until == ref_paid
+        assert db.conn.execute("SELECT COUNT(*) FROM reward_ledger").fetchone()[0] == 1
+
+        # вторая оплата продлевает от текущего срока, реферер второй раз не награждается
+        second = db.apply_payment(u.id, "tg-2", "prov-2", 30000, "RUB", "sub_30d")
+        assert second["paid_until"] > first["paid_until"] and second["referrer_chat_id"] is None
+
+        # сбой посреди транзакции не оставляет половины изменений
+        v = db.get_or_create_user(3, 300, "trial")
+        db.apply_promo_for_new_user(v.id, db.get_or_create_promo_code(ref.id))
+        db.conn.execute("DROP TABLE reward_ledger")
+        with pytest.raises(sqlite3.OperationalError):
+            db.apply_payment(v.id, "tg-3", None, 15000, "RUB", None)
+        assert db.conn.execute("SELECT 1 FROM payments WHERE charge_id='tg-3'").fetchone() is None
+        assert db.get_or_create_user(3, 300, "trial").paid_until is None
+        assert db.get_discount_for_user(v.id) == 1
+        db.close()
+
+
+def test_referral_counters_leaderboard_and_rebuild():
+    with tempfile.TemporaryDirectory() as td:
+        path = os.path.join(td, "t.db")
+        db = DB(path)
+        a, b = db.get_or_create_user(1, 1, "trial"), db.get_or_create_user(2, 2, "trial")
+        code_a, code_b = db.get_or_create_promo_code(a.id), db.get_or_create_promo_code(b.id)
+        invited = [db.get_or_create_user(10 + i, 10 + i, "trial") for i in range(5)]
+        for u in invited[:3]:
+            db.apply_promo_for_new_user(u.id, code_a)
+        for u in invited[3:]:
+            db.apply_promo_for_new_user(u.id, code_b)
+        db.apply_payment(invited[3].id, "c1", None, 15000, "RUB", None)
+        db.apply_payment(invited[3].id, "c1", None, 15000, "RUB", None)   # повтор — счётчики не двигаются
+
+        assert db.referral_stats(a.id) == {"invited": 3, "paid": 0, "reward_days": 0}
+        assert db.referral_stats(b.id) == {"invited": 2, "paid": 1, "reward_days": 7}
+        assert [r["user_id"] for r in db.referral_top(10)] == [b.id, a.id]
+        assert db.referral_rank(a.id) == 2 and db.referral_rank(invited[0].id) is None
+        plan = db.conn.execute("EXPLAIN QUERY PLAN SELECT user_id FROM referral_stats WHERE invited > 0 "
+                               "ORDER BY paid DESC, invited DESC LIMIT 10").fetchall()
+        assert any("idx_referral_stats_rank" in r["detail"] for r in plan)
+
+        assert db.rebuild_referral_stats() == {"rows": 2, "mismatched": 0}
+        db.conn.execute("UPDATE referral_stats SET invited=99 WHERE user_id=?", (a.id,))
+        db.conn.commit()
+        assert db.rebuild_referral_stats()["mismatched"] == 1
+        assert db.referral_stats(a.id)["invited"] == 3
+
+        # старая база без таблицы счётчиков: заполняется при миграции
+        db.conn.execute("DROP TABLE referral_stats")
+        db.conn.execute("PRAGMA user_version=7")
+        db.conn.commit()
+        db.close()
+        db = DB(path)
+        assert db.referral_stats(b.id) == {"invited": 2, "paid": 1, "reward_days": 7}
+        db.close()
+
+
+def test_packed_entries_roundtrip_and_legacy_migration():
+    import sqlite3
+    from bot import codec
+    from bot.services.analyzer import BASE_KCAL, analyze, apply_refinement, to_json
+
+    assert set(BASE_KCAL) | {"блюдо"} <= set(codec.COMPONENTS)
+    ar = apply_refinement(analyze("курица с рисом в соусе", has_photo=True, has_reference=True), "sauce", "low")
+    blob = codec.pack(to_json(ar), ar.conf, ar.err_low, ar.err_high)
+    assert len(blob) < 12 < len(to_json(ar).encode())
+    parsed, conf, err_low, err_high = codec.unpack(blob)
+    assert parsed == to_json(ar) and abs(conf - ar.conf) < 0.005 and abs(err_high - ar.err_high) < 0.005
+    # неизвестное — запасной формат, без потерь
+    odd = '{"components": ["борщ"], "note": "свой"}'
+    assert codec.unpack(codec.pack(odd, 0.123456, 0.1, 0.2)) == (odd, 0.123456, 0.1, 0.2)
+
+    with tempfile.TemporaryDirectory() as td:
+        path = os.path.join(td, "t.db")
+        db = DB(path)
+        u = db.get_or_create_user(1, 10, "trial")
+        db.close()
+        # база старого формата: food_entries с parsed_json и REAL-колонками
+        conn = sqlite3.connect(path)
+        conn.executescript("""
+            DROP TABLE food_entries;
+            CREATE TABLE food_entries (
+              id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL, ts TEXT NOT NULL, text TEXT,
+              photo_file_id TEXT, parsed_json TEXT NOT NULL, kcal_low INTEGER NOT NULL, kcal_high INTEGER NOT NULL,
+              kcal_mid INTEGER NOT NULL, conf REAL NOT NULL, err_low REAL NOT NULL, err_high REAL NOT NULL);
+            DROP TABLE food_fts;
+            PRAGMA user_version=8;
+        """)
+        conn.executemany(
+            "INSERT INTO food_entries (user_id, ts, text, parsed_json, kcal_low, kcal_high, kcal_mid, conf, err_low, err_high)"
+            " VALUES (?,?,?,?,?,?,?,?,?,?)",
+            [(u.id, "2026-01-01T08:00:00", "курица с рисом", to_json(ar), ar.kcal_low, ar.kcal_high, ar.kcal_mid,
+              ar.conf, ar.err_low, ar.err_high),
+             (u.id, "2026-01-01T09:00:00", "борщ", odd, 300, 500, 400, 0.5, 0.1, 0.2)])
+        conn.commit()
+        conn.close()
+
+        db = DB(path)
+        assert db.schema_version() == SCHEMA_VERSION
+        assert "parsed_json" not in {r["name"] for r in db.conn.execute("PRAGMA table_info(food_entries)")}
+        e1, e2 = db.get_food_entry(1, u.id), db.get_food_entry(2, u.id)
+        assert e1["parsed_json"] == to_json(ar) and e1["conf"] == round(ar.conf, 2)
+        assert e2["parsed_json"] == odd and e2["err_high"] == 0.2
+        assert [r["entry_id"] for r in db.search_meals(u.id, "курица")] == [1]
+        new_id = db.add_food_entry(u.id, "2026-01-02T08:00:00", "курица", None, to_json(ar), 1, 3, 2, 0.5, 0.1, 0.2)
+        assert new_id == 3 and db.get_food_entry(3, u.id)["parsed_json"] == to_json(ar)
+        assert [r["entry_id"] for r in db.search_meals(u.id, "курица")] == [3, 1]
+        db.close()
+
+
+def test_user_timezones_cached_and_indexed():
+    with tempfile.TemporaryDirectory() as td:
+        db = DB(os.path.join(td, "t.db"))
+        a = db.get_or_create_user(1, 10, "trial")
+        assert db.user_timezones() == [None]
+        db.set_user_tz(a.id, "Europe/Moscow")
+        db.get_or_create_user(2, 20, "trial")
+        assert set(db.user_timezones()) == {None, "Europe/Moscow"}
+        # повторный вызов таблицу не читает
+        db.conn.execute("UPDATE users SET tz='Asia/Tokyo'")
+        assert "Asia/Tokyo" not in db.user_timezones()
+        plan = " ".join(r[3] for r in db.conn.execute("EXPLAIN QUERY PLAN SELECT DISTINCT tz FROM users"))
+        assert "idx_users_tz" in plan
+        db.close()
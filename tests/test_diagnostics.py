@@ -0,0 +1,72 @@
+import asyncio
+import os, tempfile, time
+
+from aiogram import Bot
+from aiogram.types import Update
+
+from bot.config import Config
+from bot.db import DB
+from bot.diagnostics import collect, render
+from bot.fake_api import FakeSession
+from bot.main import build_dispatcher
+from bot.metrics import MetricsMiddleware
+from bot.outbox import Outbox
+
+
+def _msg(bot, uid, text):
+    return Update.model_validate({"update_id": 1, "message": {
+        "message_id": 1, "date": int(time.time()), "chat": {"id": uid, "type": "private"},
+        "from": {"id": uid, "is_bot": False, "first_name": "a"}, "text": text}}, context={"bot": bot})
+
+
+def test_diag_admin_only():
+    async def run(path):
+        cfg = Config("1:X", path, "Asia/Yerevan", set(), None, 300, 50, admin_ids=frozenset({7}))
+        db = DB(path)
+        outbox = Outbox()
+        session = FakeSession()
+        bot = Bot("42:TEST", session=session)
+        bot.session.middleware(outbox)
+        dp = build_dispatcher(cfg, db, outbox, MetricsMiddleware())
+        await dp.feed_update(bot, _msg(bot, 8, "/diag"))
+        await dp.feed_update(bot, _msg(bot, 7, "/diag"))
+        await outbox.close()
+        db.close()
+        return session.sent()
+
+    with tempfile.TemporaryDirectory() as td:
+        sent = asyncio.run(run(os.path.join(td, "t.db")))
+    to_admin = [p["text"] for p in sent if p["chat_id"] == 7]
+    assert len(to_admin) == 1 and "RSS" in to_admin[0] and "кэш users" in to_admin[0]
+    assert all("RSS" not in p["text"] for p in sent if p["chat_id"] == 8)
+
+
+def test_collect_snapshot():
+    with tempfile.TemporaryDirectory() as td:
+        db = DB(os.path.join(td, "t.db"))
+        d = collect(db, jobs={"expire_access": {"runs": 1, "errors": 0, "last_ms": 1.5, "max_ms": 1.5,
+                                                "last_rows": 0, "last_run": "2024-01-01T00:00:00"}})
+        db.close()
+    assert d["rss_mb"] > 0 and d["files"]["db"] > 0
+    assert "job expire_access" in render(d)
+
+
+def test_dbstats_bad_threshold():
+    async def run(path):
+        cfg = Config("1:X", path, "Asia/Yerevan", set(), None, 300, 50, admin_ids=frozenset({7}))
+        db = DB(path)
+        outbox = Outbox()
+        session = FakeSession()
+        bot = Bot("42:TEST", session=session)
+        bot.session.middleware(outbox)
+        dp = build_dispatcher(cfg, db, outbox, MetricsMiddleware())
+        await dp.feed_update(bot, _msg(bot, 7, "/dbstats on abc"))
+        await outbox.close()
+        profiling = db.query_stats() is not None
+        db.close()
+        return session.sent(), profiling
+
+    with tempfile.TemporaryDirectory() as td:
+        sent, profiling = asyncio.run(run(os.path.join(td, "t.db")))
+    assert [p["text"] for p in sent] == ["Формат: /dbstats on 50 | /dbstats off"]
+    assert not profiling
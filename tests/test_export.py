@@ -0,0 +1,66 @@
+import asyncio
+import csv, gzip, json
+import os, tempfile, time
+
+from aiogram import Bot
+from aiogram.types import Update
+
+from bot.config import Config
+from bot.db import DB
+from bot.fake_api import FakeSession
+from bot.main import build_dispatcher
+from bot.outbox import Outbox
+from bot.services.export import export_user
+
+
+def _fill(db, uid, n):
+    for i in range(n):
+        db.add_food_entry(uid, f"2026-01-01T{i // 60 % 24:02d}:{i % 60:02d}:00", f"суп, {i}", None,
+                          json.dumps({"components": ["суп", "хлеб"]}), 200, 400, 300, 0.55, 0.1, 0.2)
+
+
+def test_export_streams_csv_and_jsonl():
+    async def run(db, uid):
+        return await export_user(db, uid, "csv"), await export_user(db, uid, "json")
+
+    with tempfile.TemporaryDirectory() as td:
+        db = DB(os.path.join(td, "t.db"))
+        u = db.get_or_create_user(1, 1, "trial")
+        other = db.get_or_create_user(2, 2, "trial")
+        _fill(db, u.id, 1200)
+        _fill(db, other.id, 3)
+        (csv_path, n1), (json_path, n2) = asyncio.run(run(db, u.id))
+        assert n1 == n2 == 1200
+
+        with gzip.open(csv_path, "rt", encoding="utf-8", newline="") as f:
+            rows = list(csv.DictReader(f))
+        assert len(rows) == 1200 and rows[0]["text"] == "суп, 0" and rows[0]["components"] == "суп; хлеб"
+        with gzip.open(json_path, "rt", encoding="utf-8") as f:
+            first = json.loads(f.readline())
+        assert first["components"] == ["суп", "хлеб"] and first["kcal_mid"] == 300
+        os.unlink(csv_path)
+        os.unlink(json_path)
+        db.close()
+
+
+def test_export_command_sends_document():
+    async def run(path):
+        cfg = Config("1:X", path, "Asia/Yerevan", set(), None, 300, 50)
+        db = DB(path)
+        _fill(db, db.get_or_create_user(5, 5, "trial").id, 10)
+        outbox = Outbox()
+        session = FakeSession()
+        bot = Bot("42:TEST", session=session)
+        bot.session.middleware(outbox)
+        dp = build_dispatcher(cfg, db, outbox)
+        upd = Update.model_validate({"update_id": 1, "message": {
+            "message_id": 1, "date": int(time.time()), "chat": {"id": 5, "type": "private"},
+            "from": {"id": 5, "is_bot": False, "first_name": "a"}, "text": "/export json"}}, context={"bot": bot})
+        await dp.feed_update(bot, upd)
+        await outbox.close()
+        db.close()
+        return session.sent("sendDocument")
+
+    with tempfile.TemporaryDirectory() as td:
+        sent = asyncio.run(run(os.path.join(td, "t.db")))
+    assert len(sent) == 1 and sent[0]["caption"] == "Записей: 10"
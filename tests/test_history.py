@@ -0,0 +1,56 @@
+import os, tempfile
+from datetime import date, timedelta
+
+from bot.db import DB
+from bot.services.history import split_range, streaks, summarize
+
+
+def _add(db, uid, ts, mid):
+    return db.add_food_entry(uid, ts, "суп", None, "{}", mid - 50, mid + 50, mid, 0.5, 0.1, 0.2)
+
+
+def test_rollups_match_raw_entries_and_backfill():
+    with tempfile.TemporaryDirectory() as td:
+        path = os.path.join(td, "t.db")
+        db = DB(path)
+        u = db.get_or_create_user(1, 1, "trial")
+        start = date(2026, 1, 1)
+        for i in range(100):
+            d = start + timedelta(days=i)
+            _add(db, u.id, f"{d}T08:00:00", 400)
+            if i % 3:
+                eid = _add(db, u.id, f"{d}T19:00:00", 900)
+                db.update_food_entry(eid, u.id, "{}", 500, 700, 600, 0.6, 0.1, 0.2)  # уточнение: 900 -> 600
+
+        def raw(a, b):
+            return db.conn.execute(
+                "SELECT COUNT(*), SUM(kcal_mid), COUNT(DISTINCT substr(ts,1,10)) FROM food_entries "
+                "WHERE user_id=? AND ts>=? AND ts<?", (u.id, a.isoformat(), (b + timedelta(days=1)).isoformat()),
+            ).fetchone()
+
+        a, b = date(2026, 1, 5), date(2026, 4, 3)   # 89 дней
+        s = summarize(db, u.id, a, b)
+        assert (s["n"], s["kcal_mid"], s["days"]) == tuple(raw(a, b))
+        assert s["rows"] <= 15
+        assert db.today_kcal_sum(u.id, __import__("datetime").datetime(2026, 1, 2, 23)) == (850, 1000, 1150)
+
+        # старая база без сводок: миграция строит их из food_entries
+        db.conn.executescript("DROP TABLE food_daily; DROP TABLE food_weekly; DROP TABLE food_monthly; "
+                              "PRAGMA user_version=5;")
+        db.close()
+        db = DB(path)
+        s2 = summarize(db, u.id, a, b)
+        assert {k: s2[k] for k in ("n", "days", "kcal_low", "kcal_mid", "kcal_high")} == \
+               {k: s[k] for k in ("n", "days", "kcal_low", "kcal_mid", "kcal_high")}
+        db.close()
+
+
+def test_split_range_and_streaks():
+    parts = split_range(date(2026, 1, 5), date(2026, 4, 3))
+    assert [p[0] for p in parts] == ["week", "day", "month", "day"]
+    assert parts[2][1:] == ("2026-02", "2026-03")
+
+    t = 2000
+    days = {"2026-03-01": 2000, "2026-03-02": 2100, "2026-03-03": 2600, "2026-03-04": 1950, "2026-03-05": 2050}
+    assert streaks(days, t, date(2026, 3, 1), date(2026, 3, 5)) == (2, 2)
+    assert streaks(days, t, date(2026, 3, 1), date(2026, 3, 6)) == (2, 2)   # сегодня ещё пусто
@@ -0,0 +1,164 @@
+import asyncio
+import gzip, json
+import os, tempfile, time
+
+from aiogram import Bot
+from aiogram.types import Update
+
+from bot.config import Config
+from bot.db import DB
+from bot.fake_api import FakeSession
+from bot.main import build_dispatcher
+from bot.outbox import Outbox
+from bot.services import importer
+from bot.services.export import export_user
+from bot.services.importer import parse_file, parse_ts, run_import
+
+
+def _check_rollups(db, uid):
+    day = db.conn.execute(
+        """SELECT COUNT(*), SUM(kcal_mid), COUNT(DISTINCT substr(ts, 1, 10)) FROM food_entries WHERE user_id=?""",
+        (uid,),
+    ).fetchone()
+    for table in ("food_daily", "food_weekly", "food_monthly"):
+        days = "COUNT(*)" if table == "food_daily" else "SUM(days)"
+        r = db.conn.execute(f"SELECT SUM(n), SUM(kcal_mid), {days} FROM {table} WHERE user_id=?", (uid,)).fetchone()
+        assert tuple(r) == tuple(day), table
+
+
+def test_import_csv_bulk_rollups_and_dedupe():
+    with tempfile.TemporaryDirectory() as td:
+        db = DB(os.path.join(td, "t.db"))
+        u = db.get_or_create_user(1, 1, "trial")
+        db.add_food_entry(u.id, "2026-01-05T08:00:00", "кофе", None, "{}", 10, 30, 20, 0.5, 0.1, 0.2)
+
+        path = os.path.join(td, "fit.csv")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("Date;Food;Calories\n")
+            for i in range(2000):
+                kcal = "" if i % 4 == 0 else str(300 + i % 7)   # без калорий — через analyze
+                f.write(f"{1 + i % 28:02d}.{1 + i // 28 % 3:02d}.2026 {i % 24:02d}:{i % 60:02d};обед {i % 50};{kcal}\n")
+            f.write(";пусто;100\n")
+
+        progress = {}
+        res = run_import(db, u.id, path, progress, chunk=300)
+        assert res["inserted"] + res["duplicates"] == 2000 and res["bad"] == 1
+        assert 0 < res["analyzed"] <= 50 and progress["inserted"] == res["inserted"]
+        _check_rollups(db, u.id)
+        assert db.search_meals(u.id, "обед 7")
+        assert db.frequent_meals(u.id)[0]["cnt"] > 1
+
+        again = run_import(db, u.id, path, {}, chunk=300)
+        assert again["inserted"] == 0 and again["duplicates"] == 2000
+        _check_rollups(db, u.id)
+        db.close()
+
+
+def test_import_roundtrip_from_export_and_json_array():
+    with tempfile.TemporaryDirectory() as td:
+        db = DB(os.path.join(td, "t.db"))
+        a = db.get_or_create_user(1, 1, "trial")
+        b = db.get_or_create_user(2, 2, "trial")
+        for i in range(700):
+            db.add_food_entry(a.id, f"2026-03-{1 + i % 30:02d}T{i % 24:02d}:{i % 60:02d}:00", f"суп {i}", None,
+                              json.dumps({"components": ["суп"]}), 200, 400, 300, 0.55, 0.1, 0.2)
+        for fmt in ("csv", "json"):
+            path, n = asyncio.run(export_user(db, a.id, fmt))
+            res = run_import(db, b.id, path, {})
+            os.unlink(path)
+            assert res["inserted"] + res["duplicates"] == n == 700
+        assert db.rollups(a.id, "month", "2026-03", "2026-03") == db.rollups(b.id, "month", "2026-03", "2026-03")
+
+        path = os.path.join(td, "arr.json.gz")
+        with gzip.open(path, "wt", encoding="utf-8") as f:
+            json.dump([{"timestamp": "2026-04-01T10:00:00+03:00", "name": "каша", "energy": 250},
+                       {"date": "2026-04-02", "food": "яблоко"}], f)
+        assert len(list(parse_file(path))) == 2
+        assert run_import(db, b.id, path, {})["inserted"] == 2
+        assert db.rollups(b.id, "day", "2026-04-01", "2026-04-01")[0]["kcal_mid"] == 250
+        db.close()
+
+
+def test_parse_ts():
+    assert parse_ts("2026-04-01T10:00:00+03:00") == "2026-04-01T07:00:00"
+    assert parse_ts("01.04.2026") == "2026-04-01T12:00:00"
+    assert parse_ts("завтра") is None
+
+
+def test_import_truncated_at_max_rows(monkeypatch):
+    monkeypatch.setattr(importer, "MAX_ROWS", 50)
+    with tempfile.TemporaryDirectory() as td:
+        db = DB(os.path.join(td, "t.db"))
+        u = db.get_or_create_user(1, 1, "trial")
+        path = os.path.join(td, "big.csv")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("date,food,kcal\n")
+            for i in range(80):
+                f.write(f"2026-01-{1 + i % 28:02d}T{i % 24:02d}:00:00,блюдо {i},100\n")
+        res = run_import(db, u.id, path, {})
+        assert res["truncated"] and res["read"] == 50 and res["inserted"] == 50
+        db.close()
+
+
+def test_import_wait_cancel_and_abandon():
+    def msg(bot, i, text):
+        return Update.model_validate({"update_id": i, "message": {
+            "message_id": i, "date": int(time.time()), "chat": {"id": 5, "type": "private"},
+            "from": {"id": 5, "is_bot": False, "first_name": "a"}, "text": text}}, context={"bot": bot})
+
+    async def run(path):
+        cfg = Config("1:X", path, "Asia/Yerevan", set(), None, 300, 50)
+        db = DB(path)
+        u = db.get_or_create_user(5, 5, "trial")
+        db.upsert_profile(u.id, sex="f", age=30, height_cm=165, weight_kg=60, activity="light", goal="maintain",
+                          palm_len_cm=None, palm_w_cm=None)
+        db.upsert_targets(u.id, 1800, 100, 25)
+        outbox = Outbox()
+        session = FakeSession()
+        bot = Bot("42:TEST", session=session)
+        bot.session.middleware(outbox)
+        dp = build_dispatcher(cfg, db, outbox)
+        for i, text in enumerate(["/import", "/cancel", "/import", "гречка с котлетой"], 1):
+            await dp.feed_update(bot, msg(bot, i, text))
+        await outbox.close()
+        state = await dp.fsm.get_context(bot, 5, 5).get_state()
+        entries = db.conn.execute("SELECT COUNT(*) FROM food_entries").fetchone()[0]
+        db.close()
+        return [p["text"] for p in session.sent()], state, entries
+
+    with tempfile.TemporaryDirectory() as td:
+        texts, state, entries = asyncio.run(run(os.path.join(td, "t.db")))
+    assert texts[1] == "Импорт отменён."
+    assert state is None and entries == 1     # брошенный импорт не мешает записать еду
+
+
+def test_import_keeps_main_connection_writable():
+    import threading
+    with tempfile.TemporaryDirectory() as td:
+        db = DB(os.path.join(td, "t.db"))
+        a = db.get_or_create_user(1, 1, "trial")
+        b = db.get_or_create_user(2, 2, "trial")
+        entries = ({"ts": f"2026-02-{1 + i % 28:02d}T{i % 24:02d}:{i % 60:02d}:{i // 1440 % 60:02d}",
+                    "text": f"блюдо {i}", "parsed_json": "{}", "conf": 0.7, "err_low": 0.1, "err_high": 0.15,
+                    "kcal_low": 170, "kcal_high": 230, "kcal_mid": 200} for i in range(1000))
+        res = {}
+        t = threading.Thread(target=lambda: res.update(n=db.import_entries(a.id, entries, chunk=100)))
+        t.start()
+        writes = 0
+        while t.is_alive() or not writes:
+            # запись из «хэндлера» в разгар импорта: ждёт пачку, но не падает с database is locked
+            db.add_food_entry(b.id, f"2026-02-01T12:00:{writes % 60:02d}", "кофе", None, "{}", 10, 30, 20, 0.5, 0.1, 0.2)
+            writes += 1
+            time.sleep(0.001)
+        t.join()
+        assert res["n"] == (1000, 0)
+        assert db.conn.execute("SELECT COUNT(*) FROM food_entries WHERE user_id=?", (b.id,)).fetchone()[0] == writes
+        _check_rollups(db, a.id)
+        _check_rollups(db, b.id)
+        db.close()
+
+
+def test_import_keeps_zero_confidence():
+    e = importer.RowMapper().map({"date": "2026-04-01T10:00:00", "food": "вода", "kcal": "0", "conf": "0"})
+    assert e["conf"] == 0.0 and e["kcal_mid"] == 0
+    assert importer.RowMapper().map({"date": "2026-04-01T10:00:00", "food": "вода", "kcal": "0"})["conf"] == 0.7
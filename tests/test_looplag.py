@@ -0,0 +1,30 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+from bot.looplag import LoopLagMonitor
+from bot.metrics import MetricsMiddleware
+
+
+def test_stall_is_attributed_to_running_handler():
+    async def slow_handler(event, data):
+        time.sleep(0.3)  # синхронная работа прямо в цикле
+
+    async def run():
+        mw = MetricsMiddleware()
+        mon = LoopLagMonitor(mw, interval=0.02, threshold=0.05)
+        mon.start()
+        await asyncio.sleep(0.05)
+        data = {"handler": SimpleNamespace(callback=slow_handler), "event_update": SimpleNamespace(update_id=77)}
+        await mw(slow_handler, None, data)
+        await asyncio.sleep(0.05)
+        await mon.stop()
+        return mon
+
+    mon = asyncio.run(run())
+    stalls = mon.dump()
+    assert len(stalls) == 1
+    assert stalls[0]["handler"] == "slow_handler"
+    assert stalls[0]["update_id"] == 77
+    assert stalls[0]["lag_ms"] >= 200
+    assert any("time.sleep" in line for line in stalls[0]["stack"])
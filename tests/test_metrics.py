@@ -0,0 +1,62 @@
+import asyncio
+import os, tempfile, time
+
+from aiogram import Bot
+from aiogram.types import Update
+
+from bot.config import Config
+from bot.db import DB
+from bot.fake_api import FakeSession
+from bot.main import build_dispatcher
+from bot.metrics import (HANDLER_SECONDS, QUERY_SECONDS, REGISTRY, MetricsMiddleware, Registry, instrument_db,
+                         register_runtime)
+from bot.outbox import Outbox
+
+
+def test_handler_and_query_metrics_exported():
+    async def run(path):
+        cfg = Config("1:X", path, "Asia/Yerevan", set(), None, 300, 50)
+        db = instrument_db(DB(path))
+        outbox = Outbox()
+        bot = Bot("42:TEST", session=FakeSession())
+        bot.session.middleware(outbox)
+        mw = MetricsMiddleware()
+        register_runtime(db, outbox, mw)
+        dp = build_dispatcher(cfg, db, outbox, mw)
+        upd = Update.model_validate({"update_id": 1, "message": {
+            "message_id": 1, "date": int(time.time()), "chat": {"id": 5, "type": "private"},
+            "from": {"id": 5, "is_bot": False, "first_name": "a"}, "text": "/help"}}, context={"bot": bot})
+        await dp.feed_update(bot, upd)
+        await outbox.close()
+        db.close()
+
+    with tempfile.TemporaryDirectory() as td:
+        before = HANDLER_SECONDS.count("help_cmd")
+        asyncio.run(run(os.path.join(td, "t.db")))
+        assert HANDLER_SECONDS.count("help_cmd") == before + 1
+        assert QUERY_SECONDS.count("get_or_create_user") >= 1
+
+    text = REGISTRY.render()
+    assert 'bot_handler_seconds_bucket{handler="help_cmd",le="+Inf"}' in text
+    assert 'bot_cache_hit_ratio{cache="users"}' in text
+    assert "bot_outbox_depth 0" in text
+
+
+def test_instrument_db_times_queries_once():
+    with tempfile.TemporaryDirectory() as td:
+        db = instrument_db(DB(os.path.join(td, "t.db")))
+        u = db.get_or_create_user(1, 1, "trial")
+        eid = db.add_food_entry(u.id, "2026-01-05T08:00:00", "суп", None, "{}", 100, 300, 200, 0.6, 0.1, 0.2)
+        added, repeated = QUERY_SECONDS.count("add_food_entry"), QUERY_SECONDS.count("repeat_food_entry")
+        db.repeat_food_entry(eid, u.id, "2026-01-06T08:00:00")
+        assert QUERY_SECONDS.count("repeat_food_entry") == repeated + 1
+        assert QUERY_SECONDS.count("add_food_entry") == added           # вложенный вызов не пишется
+        db.enable_profiling(10)
+        db.disable_profiling()
+        registry = Registry()
+        register_runtime(db, Outbox(), registry=registry)
+        db.close()
+    assert QUERY_SECONDS.count("enable_profiling") == 0 and QUERY_SECONDS.count("flush_meta") == 0
+    text = registry.render()
+    assert "# TYPE bot_outbox_messages_total counter" in text
+    assert 'bot_outbox_messages_total{result="sent"} 0' in text
@@ -0,0 +1,72 @@
+import asyncio
+
+from aiogram import Bot
+
+from bot.fake_api import FakeSession
+from bot.outbox import Outbox
+
+TOKEN = "42:TEST"
+
+
+def _bot(session, outbox):
+    bot = Bot(token=TOKEN, session=session)
+    bot.session.middleware(outbox)
+    return bot
+
+
+def test_retry_after_is_respected():
+    rejected = {"n": 0}
+
+    def fail(name, params):
+        if name == "sendMessage" and rejected["n"] < 1:
+            rejected["n"] += 1
+            return 1
+        return None
+
+    async def run():
+        session = FakeSession(fail=fail)
+        outbox = Outbox(global_rate=1000, chat_rate=1000, chat_burst=10)
+        bot = _bot(session, outbox)
+        msg = await bot.send_message(chat_id=10, text="hi")
+        await outbox.close()
+        return session, outbox, msg
+
+    session, outbox, msg = asyncio.run(run())
+    assert msg.text == "hi"
+    assert len(session.rejected) == 1
+    assert session.sent() == [{"chat_id": 10, "text": "hi"}]
+    assert outbox.retried == 1
+
+
+def test_replies_overtake_bulk_notifications():
+    async def run():
+        session = FakeSession()
+        outbox = Outbox(global_rate=20, chat_rate=1000, chat_burst=1000)
+        bot = _bot(session, outbox)
+        bulk = [outbox.notify(bot.send_message(chat_id=100 + i, text=f"bulk{i}")) for i in range(40)]
+        await asyncio.sleep(0.05)
+        await bot.send_message(chat_id=1, text="reply")
+        await asyncio.gather(*bulk)
+        await outbox.close()
+        return [p["text"] for p in session.sent()]
+
+    texts = asyncio.run(run())
+    # первые 20 уходят пачкой (burst), дальше ответ встаёт в начало очереди
+    assert len(texts) == 41
+    assert texts.index("reply") <= 21
+
+
+def test_per_chat_pacing():
+    async def run():
+        session = FakeSession()
+        outbox = Outbox(global_rate=1000, chat_rate=20, chat_burst=1)
+        bot = _bot(session, outbox)
+        loop = asyncio.get_running_loop()
+        t0 = loop.time()
+        await asyncio.gather(*(bot.send_message(chat_id=5, text=str(i)) for i in range(5)))
+        elapsed = loop.time() - t0
+        await outbox.close()
+        return elapsed
+
+    # 1 сразу + 4 с интервалом 50 мс
+    assert asyncio.run(run()) >= 0.18
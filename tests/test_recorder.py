@@ -0,0 +1,83 @@
+import asyncio, json
+import os, tempfile, time
+
+from aiogram import Bot
+from aiogram.types import Update
+
+from bot.recorder import Pseudonymizer, UpdateRecorder, read_records
+from bot.replay import replay
+
+
+def _message(uid: int, update_id: int, text: str) -> dict:
+    return {"update_id": update_id, "message": {
+        "message_id": update_id, "date": int(time.time()), "chat": {"id": uid, "type": "private"},
+        "from": {"id": uid, "is_bot": False, "first_name": "Анна", "username": "anna"}, "text": text}}
+
+
+def test_record_pseudonymises_and_replays():
+    async def record(path):
+        rec = UpdateRecorder(path, salt=b"s")
+        bot = Bot("42:TEST")
+
+        async def handler(event, data):
+            return None
+
+        for i, text in enumerate(["/start", "f", "/help"], 1):
+            await rec(handler, Update.model_validate(_message(777, i, text), context={"bot": bot}), {})
+        rec.close()
+        await bot.session.close()
+
+    with tempfile.TemporaryDirectory() as td:
+        path = os.path.join(td, "u.jsonl.gz")
+        asyncio.run(record(path))
+
+        records = list(read_records(path))
+        assert len(records) == 3
+        msg = records[0]["update"]["message"]
+        assert msg["from"]["id"] != 777 and msg["from"]["id"] == msg["chat"]["id"]
+        assert "Анна" not in str(records) and "anna" not in str(records)
+        assert msg["text"] == "/start"
+
+        result = asyncio.run(replay(path, None, os.path.join(td, "r.db")))
+        assert result["updates"] == 3 and result["errors"] == 0
+        assert result["api_calls"].get("sendMessage", 0) >= 3
+
+
+ORDER_INFO = {"name": "Анна Петрова", "phone_number": "+79990001122", "email": "anna@example.com",
+              "shipping_address": {"country_code": "RU", "state": "", "city": "Москва",
+                                   "street_line1": "Тверская 1", "street_line2": "", "post_code": "101000"}}
+PRIVATE = ("Анна", "79990001122", "anna@example.com", "Тверская", "101000")
+
+
+def _scrubbed(raw: dict) -> dict:
+    out = Pseudonymizer(b"s").scrub(raw)
+    Update.model_validate(out)      # запись по-прежнему проигрывается
+    assert not any(p in json.dumps(out, ensure_ascii=False) for p in PRIVATE)
+    return out
+
+
+def test_scrub_contact():
+    raw = _message(777, 1, "x")
+    del raw["message"]["text"]
+    raw["message"]["contact"] = {"phone_number": "+79990001122", "first_name": "Анна", "last_name": "Петрова",
+                                 "user_id": 777, "vcard": "BEGIN:VCARD\nTEL:+79990001122\nEND:VCARD"}
+    contact = _scrubbed(raw)["message"]["contact"]
+    assert contact["user_id"] != 777 and "vcard" not in contact
+
+
+def test_scrub_successful_payment_order_info():
+    raw = _message(777, 1, "x")
+    del raw["message"]["text"]
+    raw["message"]["successful_payment"] = {
+        "currency": "RUB", "total_amount": 29900, "invoice_payload": "sub30",
+        "telegram_payment_charge_id": "tg1", "provider_payment_charge_id": "pr1", "order_info": ORDER_INFO}
+    payment = _scrubbed(raw)["message"]["successful_payment"]
+    assert "order_info" not in payment and payment["telegram_payment_charge_id"] == "tg1"
+
+
+def test_scrub_pre_checkout_order_info():
+    raw = {"update_id": 1, "pre_checkout_query": {
+        "id": "q1", "from": {"id": 777, "is_bot": False, "first_name": "Анна"}, "currency": "RUB",
+        "total_amount": 29900, "invoice_payload": "sub30", "order_info": ORDER_INFO}}
+    query = _scrubbed(raw)["pre_checkout_query"]
+    assert "order_info" not in query and query["from"]["id"] != 777
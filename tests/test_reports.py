@@ -0,0 +1,83 @@
+import asyncio
+import csv, json
+import os, shutil, tempfile
+
+from bot.db import DB
+from bot.services.reports import build_reports, run_reports
+
+
+def _setup(db):
+    users = [db.get_or_create_user(i, i, "trial") for i in range(1, 6)]
+    for u, created in zip(users, ("2026-01-10T09:00:00", "2026-01-20T09:00:00", "2026-02-01T09:00:00",
+                                  "2026-02-03T09:00:00", "2026-02-05T09:00:00")):
+        db.conn.execute("UPDATE users SET created_at=? WHERE id=?", (created, u.id))
+    db.conn.commit()
+    a, b, c, d, e = users
+    db.apply_payment(a.id, "ch-a", None, 30000, "RUB", None)
+
+    code = db.get_or_create_promo_code(a.id)
+    for r in (c, d, e):
+        db.apply_promo_for_new_user(r.id, code)
+    db.apply_payment(c.id, "ch-c", None, 15000, "RUB", None)
+    # оплата прошла, но награда ещё не начислена
+    db.conn.execute("UPDATE referrals SET status='paid', first_payment_at='2026-02-10T00:00:00' WHERE referred_user_id=?",
+                    (d.id,))
+    db.conn.commit()
+
+    def log(u, day, kcal):
+        db.add_food_entry(u.id, f"{day}T12:00:00", "еда", None, "{}", kcal - 100, kcal + 100, kcal, 0.5, 0.1, 0.2)
+
+    log(a, "2026-01-11", 1800)   # день 1
+    log(a, "2026-01-18", 2000)   # 2-я неделя
+    log(b, "2026-01-21", 1500)
+    log(b, "2026-01-21", 500)    # тот же день — один день с записями
+    log(c, "2026-03-05", 1700)   # 5-я неделя
+    return users
+
+
+def test_reports_are_set_based_and_consistent():
+    with tempfile.TemporaryDirectory() as td:
+        db = DB(os.path.join(td, "t.db"))
+        _setup(db)
+        rep = build_reports(db, asof="2026-03-31")
+
+        conv = {r[0]: dict(zip(rep["conversion"]["columns"], r)) for r in rep["conversion"]["rows"]}
+        assert conv["2026-01"]["users"] == 2 and conv["2026-01"]["payers"] == 1
+        assert conv["2026-01"]["revenue"] == 300
+        assert conv["2026-02"]["users"] == 3 and conv["2026-02"]["payers"] == 1
+
+        cols = rep["referrals"]["columns"]
+        funnel = dict(zip(cols, rep["referrals"]["rows"][0]))
+        assert (funnel["invited"], funnel["discount_reserved"], funnel["paid"], funnel["rewarded"]) == (3, 3, 2, 1)
+
+        ret = {r[0]: dict(zip(rep["retention"]["columns"], r)) for r in rep["retention"]["rows"]}
+        assert (ret["2026-01"]["d1"], ret["2026-01"]["w1"], ret["2026-01"]["w4"]) == (2, 1, 0)
+        assert ret["2026-02"]["w4"] == 1 and ret["2026-02"]["w4_eligible"] == 3
+
+        kcal = {r[0]: dict(zip(rep["cohort_kcal"]["columns"], r)) for r in rep["cohort_kcal"]["rows"]}
+        assert kcal["2026-01"]["logged_days"] == 3 and kcal["2026-01"]["avg_kcal_day"] == 1933
+
+        # снимок: запись идёт, пока открыт отчёт, и не видна внутри него
+        with db._snapshot() as conn:
+            before = conn.execute("SELECT COUNT(*) FROM food_entries").fetchone()[0]
+            db.add_food_entry(1, "2026-03-06T12:00:00", "ещё", None, "{}", 1, 3, 2, 0.5, 0.1, 0.2)
+            assert conn.execute("SELECT COUNT(*) FROM food_entries").fetchone()[0] == before
+        assert db.conn.execute("SELECT COUNT(*) FROM food_entries").fetchone()[0] == before + 1
+        db.close()
+
+
+def test_run_reports_writes_json_and_csv():
+    with tempfile.TemporaryDirectory() as td:
+        db = DB(os.path.join(td, "t.db"))
+        _setup(db)
+        directory, paths = asyncio.run(run_reports(db, None, "json"))
+        with open(paths[0], encoding="utf-8") as f:
+            assert set(json.load(f)["reports"]) == {"conversion", "referrals", "retention", "cohort_kcal"}
+        shutil.rmtree(directory)
+
+        directory, paths = asyncio.run(run_reports(db, ["referrals"], "csv"))
+        with open(paths[0], encoding="utf-8") as f:
+            rows = list(csv.reader(f))
+        assert rows[0] == ["cohort", "invited", "discount_reserved", "paid", "rewarded"] and len(rows) == 2
+        shutil.rmtree(directory)
+        db.close()
@@ -0,0 +1,336 @@
+"""Общий набор для обеих реализаций Storage: каждый тест гоняется на SQLite и на хранилище в памяти."""
+import asyncio
+import os, pathlib, re, tempfile, time
+from datetime import datetime
+
+import pytest
+from aiogram import Bot
+from aiogram.types import Update
+
+from bot.config import Config
+from bot.db import DB, FREQUENT_MAX
+from bot.fake_api import FakeSession
+from bot.main import build_dispatcher
+from bot.outbox import Outbox
+from bot.storage import MemoryStorage, SqlReports, Storage
+
+ROOT = pathlib.Path(__file__).resolve().parents[1]
+
+
+@pytest.fixture(params=["sqlite", "memory"])
+def store(request):
+    if request.param == "memory":
+        yield MemoryStorage()
+        return
+    with tempfile.TemporaryDirectory() as td:
+        db = DB(os.path.join(td, "t.db"))
+        yield db
+        db.close()
+
+
+def _add(store, uid, text, ts, kcal=500, photo=None):
+    return store.add_food_entry(uid, ts, text, photo, '{"components": ["x"]}', kcal - 100, kcal + 100, kcal,
+                                0.6, 0.2, 0.3)
+
+
+def test_protocol(store):
+    assert isinstance(store, Storage)
+    assert isinstance(store, SqlReports) == isinstance(store, DB)      # SQL-отчёты — только у SQLite
+
+
+def test_no_raw_connection_outside_storage():
+    pattern = re.compile(r"\.conn\b|_readonly\(|_snapshot\(|\.execute\(")
+    for sub in ("handlers", "services"):
+        for path in (ROOT / "bot" / sub).glob("*.py"):
+            assert not pattern.search(path.read_text(encoding="utf-8")), path
+    assert not pattern.search((ROOT / "bot" / "middleware.py").read_text(encoding="utf-8"))
+
+
+def test_users_and_access(store):
+    u = store.get_or_create_user(1, 10, "trial")
+    assert u.status == "trial" and u.trial_end > u.trial_start
+    assert store.get_or_create_user(1, 11, "trial").chat_id == 11
+    assert store.get_or_create_user(1, 0, "trial").chat_id == 11
+    beta = store.get_or_create_user(2, 20, "beta")
+    assert beta.trial_start is None and beta.trial_end is None
+    assert store.find_user(1).id == u.id and store.find_user(99) is None
+
+    store.set_user_tz(u.id, "Europe/Moscow")
+    assert store.find_user(1).tz == "Europe/Moscow"
+    assert sorted(store.user_timezones(), key=str) == ["Europe/Moscow", None]
+
+    assert store.expire_trials("2000-01-01T00:00:00") == 0
+    assert store.expire_trials("2100-01-01T00:00:00") == 1
+    assert store.find_user(1).status == "expired"
+    store.set_paid_until(u.id, "2030-01-01T00:00:00")
+    assert store.get_or_create_user(1, 11, "trial").status == "active"
+    assert store.expire_subscriptions("2031-01-01T00:00:00") == 1
+    store.set_user_status(beta.id, "trial")
+    assert store.find_user(2).status == "trial"
+
+
+def test_entries_rollups_and_export(store):
+    u = store.get_or_create_user(1, 1, "trial")
+    a = _add(store, u.id, "каша", "2026-01-05T08:00:00", kcal=300)      # понедельник
+    _add(store, u.id, "суп", "2026-01-05T13:00:00", kcal=400)
+    _add(store, u.id, None, "2026-01-12T09:00:00", kcal=600, photo="ph1")
+
+    assert store.today_kcal_sum(u.id, datetime(2026, 1, 5, 20)) == (500, 700, 900)
+    assert store.today_kcal_sum(u.id, datetime(2026, 1, 6)) == (0, 0, 0)
+    days = store.rollups(u.id, "day", "2026-01-01", "2026-01-31")
+    assert [(d["key"], d["n"], d["days"], d["kcal_mid"]) for d in days] == [
+        ("2026-01-05", 2, 1, 700), ("2026-01-12", 1, 1, 600)]
+    weeks = store.rollups(u.id, "week", "2026-01-01", "2026-01-31")
+    assert [(w["key"], w["n"], w["days"]) for w in weeks] == [("2026-01-05", 2, 1), ("2026-01-12", 1, 1)]
+    assert store.rollups(u.id, "month", "2026-01", "2026-01")[0]["days"] == 2
+
+    e = store.get_food_entry(a, u.id)
+    assert (e["text"], e["kcal_mid"], e["conf"], e["err_high"]) == ("каша", 300, 0.6, 0.3)
+    assert e["parsed_json"] == '{"components": ["x"]}'
+    assert store.get_food_entry(a, u.id + 1) is None
+
+    store.update_food_entry(a, u.id, '{"components": ["y"]}', 250, 450, 350, 0.7, 0.1, 0.2)
+    assert store.today_kcal_sum(u.id, datetime(2026, 1, 5)) == (550, 750, 950)
+    assert store.rollups(u.id, "month", "2026-01", "2026-01")[0]["kcal_mid"] == 1350
+    store.update_food_entry(a, u.id + 1, "{}", 0, 0, 0, 0.1, 0.1, 0.1)           # чужая запись — ничего
+    assert store.get_food_entry(a, u.id)["kcal_mid"] == 350
+
+    rows = list(store.export_rows(u.id))
+    assert [(r["ts"], r["text"], r["photo_file_id"], r["kcal_mid"]) for r in rows] == [
+        ("2026-01-05T08:00:00", "каша", None, 350), ("2026-01-05T13:00:00", "суп", None, 400),
+        ("2026-01-12T09:00:00", None, "ph1", 600)]
+    assert {"id", "parsed_json", "conf", "kcal_low", "kcal_high"} <= set(rows[0])
+
+
+def test_frequent_search_and_repeat(store):
+    u = store.get_or_create_user(1, 1, "trial")
+    other = store.get_or_create_user(2, 2, "trial")
+    _add(store, u.id, "Курица с рисом", "2026-01-01T12:00:00")
+    last = _add(store, u.id, "курица  с рисом.", "2026-01-02T12:00:00", kcal=520)
+    _add(store, u.id, "Омлет", "2026-01-03T08:00:00")
+    _add(store, other.id, "курица гриль", "2026-01-03T08:00:00")
+
+    top = store.frequent_meals(u.id)
+    assert [m["norm_text"] for m in top] == ["курица с рисом", "омлет"]
+    assert top[0]["cnt"] == 2 and top[0]["entry_id"] == last and top[0]["kcal_mid"] == 520
+    assert [m["norm_text"] for m in store.frequent_meals(u.id, prefix="Кур")] == ["курица с рисом"]
+
+    found = store.search_meals(u.id, "рис кур")
+    assert [(m["norm_text"], m["entry_id"]) for m in found] == [("курица с рисом", last)]
+    assert store.search_meals(u.id, "гриль") == [] and store.search_meals(u.id, '"') == []
+    assert [m["norm_text"] for m in store.search_meals(other.id, "курица")] == ["курица гриль"]
+
+    new_id = store.repeat_food_entry(last, u.id, "2026-01-04T12:00:00")
+    assert store.get_food_entry(new_id, u.id)["kcal_mid"] == 520
+    assert store.repeat_food_entry(last, other.id, "2026-01-04T12:00:00") is None
+    assert store.frequent_meals(u.id)[0]["cnt"] == 3
+
+    for i in range(FREQUENT_MAX + 5):
+        _add(store, u.id, f"блюдо {i}", f"2026-02-01T00:{i:02d}:00")
+    assert len(store.frequent_meals(u.id, limit=1000)) == FREQUENT_MAX
+
+
+def test_import_dedupes_and_resets_frequent(store):
+    u = store.get_or_create_user(1, 1, "trial")
+    _add(store, u.id, "омлет", "2026-01-01T08:00:00")
+
+    def entry(ts, text, kcal):
+        return {"ts": ts, "text": text, "parsed_json": "{}", "kcal_low": kcal - 50, "kcal_high": kcal + 50,
+                "kcal_mid": kcal, "conf": 0.7, "err_low": 0.1, "err_high": 0.15}
+
+    batch = [entry("2026-01-01T08:00:00", "омлет", 300),          # уже есть
+             entry("2026-01-01T08:00:00", "кофе", 20),
+             entry("2026-01-02T12:00:00", "суп", 250),
+             entry("2026-01-02T12:00:00", "суп", 250)]           # дубль внутри файла
+    progress = {}
+    assert store.import_entries(u.id, batch, chunk=2, progress=progress) == (2, 2)
+    assert progress == {"inserted": 2, "duplicates": 2}
+    assert [d["n"] for d in store.rollups(u.id, "day", "2026-01-01", "2026-01-31")] == [2, 1]
+    assert store.rollups(u.id, "month", "2026-01", "2026-01")[0]["days"] == 2
+    assert {m["norm_text"] for m in store.frequent_meals(u.id)} == {"омлет", "кофе", "суп"}
+    assert store.import_entries(u.id, batch) == (0, 4)
+
+
+def test_meta(store):
+    u = store.get_or_create_user(1, 1, "trial")
+    assert store.get_meta(u.id, "tip") is None
+    store.set_meta(u.id, "tip", "a")
+    store.set_meta(u.id, "tip", "b")
+    assert store.get_meta(u.id, "tip") == "b"
+    store.flush_meta()
+    assert store.meta_pending() == 0 and store.get_meta(u.id, "tip") == "b"
+
+
+def test_profile_targets_and_tdee(store):
+    u = store.get_or_create_user(1, 1, "trial")
+    v = store.get_or_create_user(2, 2, "trial")
+    for uid in (u.id, v.id):
+        store.upsert_profile(uid, sex="f", age=30, height_cm=165, weight_kg=60, activity="light", goal="lose",
+                             palm_len_cm=None, palm_w_cm=None)
+    assert store.get_profile(u.id)["goal"] == "lose" and store.get_profile(99) is None
+    store.upsert_targets(u.id, 1800, 90, 25, formula_version=2)
+    assert store.get_targets(u.id)["kcal_target"] == 1800 and store.get_targets(v.id) is None
+
+    stale = [r for batch in store.stale_target_batches(2) for r in batch]
+    assert stale == [(v.id, "f", 30, 165, 60, "light", "lose")]
+    assert len([r for batch in store.stale_target_batches(3, chunk=1) for r in batch]) == 2
+    assert store.bulk_upsert_targets([(v.id, 1700, 80, 25)], 2) == 1
+    assert store.get_targets(v.id)["formula_version"] == 2
+
+    st = {"user_id": u.id, "weight": 60.0, "weight_slope": 0.0, "weight_day": "2026-01-01", "weight_n": 3,
+          "intake": 1800.0, "intake_day": "2026-01-01", "intake_n": 5, "first_day": "2025-12-20"}
+    store.save_tdee_states([st])
+    assert store.get_tdee_state(u.id) == st and store.tdee_states([u.id, v.id]) == {u.id: st}
+    store.log_weight(u.id, "2026-01-02", 59.5, {**st, "weight": 59.5, "weight_n": 4})
+    store.log_weight(u.id, "2026-01-03", 59.4, {**st, "weight": 59.4, "weight_n": 5})
+    assert store.get_profile(u.id)["weight_kg"] == 59.4
+    assert store.weight_history(u.id, "2026-01-03") == [("2026-01-03", 59.4)]
+    rows = [r for batch in store.adaptive_batches(4) for r in batch]
+    assert [(r["user_id"], r["weight_n"], r["goal"], r["kcal_target"]) for r in rows] == [(u.id, 5, "lose", 1800)]
+
+
+def test_summary_and_chart_batches(store):
+    a = store.get_or_create_user(1, 10, "trial")
+    b = store.get_or_create_user(2, 20, "trial")
+    store.get_or_create_user(3, 30, "trial")                       # без целей — не попадает
+    for uid in (a.id, b.id):
+        store.upsert_targets(uid, 2000, 100, 25)
+    _add(store, a.id, "каша", "2026-01-05T08:00:00", kcal=300)
+    _add(store, a.id, "суп", "2026-01-06T08:00:00", kcal=400)
+
+    rows = [r for batch in store.summary_batches(None, "2026-01-05", "2026-01-05T00:00:00",
+                                                 "2026-01-06T00:00:00", chunk=1) for r in batch]
+    assert [(r["id"], r["chat_id"], r["kcal_target"], r["mid"], r["n"]) for r in rows] == [
+        (a.id, 10, 2000, 300, 1), (b.id, 20, 2000, 0, 0)]
+    store.mark_summary_sent([a.id], "2026-01-05")
+    rows = [r for batch in store.summary_batches(None, "2026-01-05", "2026-01-05T00:00:00",
+                                                 "2026-01-06T00:00:00") for r in batch]
+    assert [r["id"] for r in rows] == [b.id]
+    assert list(store.summary_batches("Asia/Tokyo", "2026-01-05", "2026-01-05", "2026-01-06")) == []
+
+    assert [r["id"] for batch in store.chart_batches("2026-01-06") for r in batch] == [a.id]
+    assert list(store.chart_batches("2026-01-07")) == []
+    assert store.warm_up("2026-01-06T00:00:00") == 1
+
+    store.set_user_status(b.id, "expired")
+    rows = [r for batch in store.intake_batches("2026-01-06", "2026-01-31", chunk=1) for r in batch]
+    assert [(r["id"], r["days"]) for r in rows] == [(a.id, [("2026-01-06", 400)])]
+
+
+def test_referrals_and_payments(store):
+    ref = store.get_or_create_user(1, 100, "trial")
+    u = store.get_or_create_user(2, 200, "trial")
+    code = store.get_or_create_promo_code(ref.id)
+    assert store.get_or_create_promo_code(ref.id) == code and code.startswith("NIGMA-")
+    assert store.apply_promo_for_new_user(u.id, "NOPE")[0] is False
+    assert store.apply_promo_for_new_user(ref.id, code)[0] is False
+    ok, _, referrer = store.apply_promo_for_new_user(u.id, code)
+    assert ok and referrer == ref.id
+    assert store.apply_promo_for_new_user(u.id, code)[0] is False
+    assert store.get_discount_for_user(u.id) == 1 and store.get_discount_for_user(ref.id) == 0
+
+    first = store.apply_payment(u.id, "tg-1", "prov-1", 15000, "RUB", "sub_30d")
+    assert first["new"] and first["referrer_chat_id"] == 100
+    assert store.get_or_create_user(2, 200, "trial").paid_until == first["paid_until"]
+    ref_paid = store.find_user(1).paid_until
+    again = store.apply_payment(u.id, "tg-1", "prov-1", 15000, "RUB", "sub_30d")
+    assert again == {"new": False, "paid_until": first["paid_until"], "referrer_chat_id": None}
+    assert store.find_user(1).paid_until == ref_paid and store.get_discount_for_user(u.id) == 0
+    second = store.apply_payment(u.id, "tg-2", None, 15000, "RUB", None)
+    assert second["paid_until"] > first["paid_until"] and second["referrer_chat_id"] is None
+
+    other = store.get_or_create_user(3, 300, "trial")
+    store.apply_promo_for_new_user(other.id, store.get_or_create_promo_code(u.id))
+    assert store.referral_stats(ref.id) == {"invited": 1, "paid": 1, "reward_days": 7}
+    assert store.referral_stats(other.id) == {"invited": 0, "paid": 0, "reward_days": 0}
+    assert [r["user_id"] for r in store.referral_top(10)] == [ref.id, u.id]
+    assert store.referral_rank(u.id) == 2 and store.referral_rank(other.id) is None
+    assert store.rebuild_referral_stats() == {"rows": 2, "mismatched": 0}
+    assert store.referral_stats(ref.id)["reward_days"] == 7
+
+
+def test_indexed_scans_many_users(store):
+    # те же выборки, что идут по индексам SQLite: истечение доступа, пачки по поясу и по дням, рейтинг рефералов
+    ids = [store.get_or_create_user(i, i, "trial").id for i in range(1, 31)]
+    for uid in ids[::3]:
+        store.set_paid_until(uid, "2000-01-01T00:00:00")                 # 10 оплаченных, уже истёкших
+    for uid in ids[1::3]:
+        store.set_user_tz(uid, "Europe/Moscow")
+        store.upsert_targets(uid, 2000, 100, 25)
+    assert store.expire_subscriptions("2000-01-02T00:00:00") == 10
+    assert store.expire_trials("2000-01-01T00:00:00") == 0
+    assert store.expire_trials("2100-01-01T00:00:00") == 20
+    assert store.expire_trials("2100-01-01T00:00:00") == 0
+    for uid in ids[1::3]:
+        store.set_user_status(uid, "active")
+
+    batches = list(store.summary_batches("Europe/Moscow", "2026-01-05", "2026-01-05T00:00:00",
+                                         "2026-01-06T00:00:00", chunk=4))
+    assert [len(b) for b in batches] == [4, 4, 2] and [r["id"] for b in batches for r in b] == ids[1::3]
+    store.set_user_tz(ids[1], None)
+    assert [r["id"] for b in store.summary_batches(None, "2026-01-05", "", "~") for r in b] == [ids[1]]
+
+    for i, uid in enumerate(ids[1::3]):
+        _add(store, uid, "каша", f"2026-01-{1 + i:02d}T08:00:00")
+    assert [r["id"] for b in store.chart_batches("2026-01-08", chunk=2) for r in b] == ids[1::3][7:]
+
+    codes = [store.get_or_create_promo_code(uid) for uid in ids[:3]]
+    for n, (code, invited) in enumerate(zip(codes, (1, 3, 3))):
+        for k in range(invited):
+            store.apply_promo_for_new_user(ids[3 + n * 3 + k], code)
+    store.apply_payment(ids[3], "c1", None, 100, "RUB", None)           # ids[0] — 1 приглашённый, 1 оплатил
+    assert [r["user_id"] for r in store.referral_top(2)] == [ids[0], ids[1]]
+    assert [store.referral_rank(uid) for uid in ids[:3]] == [1, 2, 2]
+    assert store.rebuild_referral_stats()["mismatched"] == 0
+    assert [store.referral_rank(uid) for uid in ids[:3]] == [1, 2, 2]
+
+
+def test_text_entry_through_dispatcher(store):
+    # логика хэндлера целиком, от апдейта до ответа: с MemoryStorage — без диска
+    async def run():
+        cfg = Config("1:X", store.path, "Asia/Yerevan", set(), None, 300, 50)
+        u = store.get_or_create_user(5, 5, "trial")
+        store.upsert_profile(u.id, sex="m", age=35, height_cm=180, weight_kg=80, activity="light", goal="maintain",
+                             palm_len_cm=None, palm_w_cm=None)
+        store.upsert_targets(u.id, 2200, 110, 30)
+        outbox = Outbox()
+        session = FakeSession()
+        bot = Bot("42:TEST", session=session)
+        bot.session.middleware(outbox)
+        dp = build_dispatcher(cfg, store, outbox)
+        upd = Update.model_validate({"update_id": 1, "message": {
+            "message_id": 1, "date": int(time.time()), "chat": {"id": 5, "type": "private"},
+            "from": {"id": 5, "is_bot": False, "first_name": "a"}, "text": "курица с рисом"}}, context={"bot": bot})
+        await dp.feed_update(bot, upd)
+        await outbox.close()
+        return u, session.sent("sendMessage")
+
+    u, sent = asyncio.run(run())
+    assert sent and sent[-1]["text"].startswith("Ок. ~480 ккал")
+    assert store.today_kcal_sum(u.id, datetime.utcnow())[1] == 480
+    assert [m["norm_text"] for m in store.frequent_meals(u.id)] == ["курица с рисом"]
+
+
+def test_repeat_reply_escapes_meal_text(store):
+    # parse_mode по умолчанию HTML: «<» в тексте блюда без экранирования Telegram отклонит
+    async def run():
+        cfg = Config("1:X", store.path, "Asia/Yerevan", set(), None, 300, 50)
+        u = store.get_or_create_user(5, 5, "trial")
+        store.upsert_targets(u.id, 2200, 110, 30)
+        eid = _add(store, u.id, "салат <5% & соус", "2026-01-05T08:00:00", kcal=300)
+        outbox = Outbox()
+        session = FakeSession()
+        bot = Bot("42:TEST", session=session)
+        bot.session.middleware(outbox)
+        dp = build_dispatcher(cfg, store, outbox)
+        upd = Update.model_validate({"update_id": 1, "callback_query": {
+            "id": "q1", "chat_instance": "c", "data": f"rep:{eid}",
+            "from": {"id": 5, "is_bot": False, "first_name": "a"},
+            "message": {"message_id": 1, "date": int(time.time()), "chat": {"id": 5, "type": "private"},
+                        "text": "Что записать ещё раз?"}}}, context={"bot": bot})
+        await dp.feed_update(bot, upd)
+        await outbox.close()
+        return session.sent("sendMessage")
+
+    sent = asyncio.run(run())
+    assert sent[-1]["text"].startswith("Записал: салат &lt;5% &amp; соус — ~300 ккал.")
@@ -0,0 +1,41 @@
+import asyncio
+import os, tempfile
+from datetime import datetime
+
+from bot.db import DB
+from bot.services.summary import send_daily_summaries
+
+
+class _Outbox:
+    def notify(self, coro):
+        return asyncio.ensure_future(coro)
+
+
+class _Bot:
+    def __init__(self):
+        self.sent = []
+
+    async def send_message(self, chat_id, text):
+        self.sent.append((chat_id, text))
+
+
+def test_daily_summary_once_per_day():
+    with tempfile.TemporaryDirectory() as td:
+        db = DB(os.path.join(td, "t.db"))
+        for tg in range(1, 8):
+            u = db.get_or_create_user(tg, 100 + tg, "trial")
+            db.upsert_targets(u.id, 2000, 100, 25)
+            if tg % 2:
+                db.add_food_entry(u.id, "2026-03-10T12:00:00", "суп", None, "{}", 200, 300, 250, 0.5, 0.1, 0.2)
+        db.set_user_tz(1, "America/Los_Angeles")
+
+        bot = _Bot()
+        now = datetime(2026, 3, 10, 18, 0)  # 22:00 в Ереване, 11:00 в Лос-Анджелесе
+        n = asyncio.run(send_daily_summaries(db, bot, _Outbox(), "Asia/Yerevan", chunk=2, now_utc=now))
+        assert n == 3
+        assert sorted(c for c, _ in bot.sent) == [103, 105, 107]
+        assert "~250 ккал" in bot.sent[0][1]
+
+        n = asyncio.run(send_daily_summaries(db, bot, _Outbox(), "Asia/Yerevan", chunk=2, now_utc=now))
+        assert n == 0
+        db.close()
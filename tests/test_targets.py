@@ -5,3 +5,39 @@ def test_targets_sane():
     assert 1200 < kcal < 2600
     assert 80 < prot < 180
     assert fib in (25,30)
+
+
+def test_batch_matches_scalar():
+    import itertools
+    from bot.services.targets import compute_targets_batch
+    grid = list(itertools.product("fm", (18, 45, 80), (150.0, 182.5), (45.0, 70.2, 130.0),
+                                  ("sedentary", "moderate", "athlete", "???"), ("lose", "maintain", "gain")))
+    kcal, prot, fib = compute_targets_batch(*zip(*grid))
+    assert list(zip(kcal, prot, fib)) == [compute_targets(*row) for row in grid]
+    assert min(kcal) >= 1200
+
+
+def test_recompute_stale_targets():
+    import asyncio, os, tempfile
+    from bot.db import DB
+    from bot.scheduler import recompute_targets
+    from bot.services.targets import FORMULA_VERSION
+
+    with tempfile.TemporaryDirectory() as td:
+        db = DB(os.path.join(td, "t.db"))
+        ids = []
+        for tg in range(1, 6):
+            u = db.get_or_create_user(tg, tg, "trial")
+            db.upsert_profile(u.id, sex="f", age=30, height_cm=165, weight_kg=60 + tg, activity="light",
+                              goal="lose", palm_len_cm=None, palm_w_cm=None)
+            ids.append(u.id)
+        db.upsert_targets(ids[0], 1500, 90, 25)                                   # старая, без версии
+        db.upsert_targets(ids[1], 1, 1, 1, formula_version=FORMULA_VERSION)       # актуальная — не трогаем
+        assert db.get_targets(ids[0])["kcal_target"] == 1500
+
+        assert asyncio.run(recompute_targets(db, chunk=2)) == 4
+        assert asyncio.run(recompute_targets(db, chunk=2)) == 0
+        assert db.get_targets(ids[0])["kcal_target"] == compute_targets("f", 30, 165, 61, "light", "lose")[0]
+        assert db.get_targets(ids[0])["formula_version"] == FORMULA_VERSION
+        assert db.get_targets(ids[1])["kcal_target"] == 1
+        db.close()
@@ -0,0 +1,74 @@
+import asyncio
+import os, tempfile
+from dataclasses import asdict
+from datetime import date, datetime, timedelta
+
+from bot.db import DB
+from bot.scheduler import adjust_targets, fold_intake
+from bot.services.tdee import TdeeState, add_intake, add_weight, estimate_tdee, load_state
+
+
+def _day(i: int) -> str:
+    return (date(2026, 1, 1) + timedelta(days=i)).isoformat()
+
+
+def test_estimate_converges_to_true_expenditure():
+    # ест 1800, худеет на 0.5 кг/нед -> расход ~1800 + 0.5/7*7700 = 2350
+    st = TdeeState(user_id=1)
+    for i in range(60):
+        st = add_intake(st, _day(i), 1800 + (60 if i % 2 else -60))
+        if i % 2 == 0:
+            st = add_weight(st, _day(i), 80 - 0.5 / 7 * i + (0.3 if i % 4 else -0.3))
+    assert abs(st.weight_slope * 7 + 0.5) < 0.1
+    assert abs(estimate_tdee(st) - 2350) < 120
+
+
+def test_not_enough_data_keeps_targets():
+    st = add_weight(TdeeState(user_id=1), _day(0), 80)
+    assert estimate_tdee(add_intake(st, _day(0), 2000)) is None
+    assert add_intake(st, _day(0), 0) is st                     # пустой день не считается
+
+
+def test_adjust_targets_job_steps_towards_estimate():
+    with tempfile.TemporaryDirectory() as td:
+        db = DB(os.path.join(td, "t.db"))
+        u = db.get_or_create_user(1, 1, "trial")
+        db.upsert_profile(u.id, sex="m", age=40, height_cm=180, weight_kg=80, activity="light",
+                          goal="maintain", palm_len_cm=None, palm_w_cm=None)
+        db.upsert_targets(u.id, 2000, 110, 30)
+        for i in range(0, 21, 3):
+            st = add_weight(load_state(db, u.id), _day(i), 80.0)
+            db.log_weight(u.id, _day(i), 80.0, asdict(st))
+        for i in range(21):
+            for hh, kcal in ((8, 800), (13, 900), (22, 900)):      # ужин после 21:00 тоже в среднем
+                db.add_food_entry(u.id, f"{_day(i)}T{hh:02d}:30:00", "еда", None, "{}", kcal, kcal, kcal, 0.7, 0.1, 0.1)
+            night = datetime.fromisoformat(_day(i + 1) + "T03:00:00")
+            assert asyncio.run(fold_intake(db, "UTC", now_utc=night)) == 1
+            assert asyncio.run(fold_intake(db, "UTC", now_utc=night)) == 0   # повтор ночи — без эффекта
+        assert load_state(db, u.id).intake == 2600
+        assert load_state(db, u.id).intake_n == 21
+        assert db.get_profile(u.id)["weight_kg"] == 80.0
+        assert asyncio.run(adjust_targets(db, "UTC", now_utc=night)) == 1
+        assert db.get_targets(u.id)["kcal_target"] == 2100     # шаг не больше 100 ккал
+        db.close()
+
+
+def test_fold_waits_for_completed_day_and_catches_up():
+    with tempfile.TemporaryDirectory() as td:
+        db = DB(os.path.join(td, "t.db"))
+        u = db.get_or_create_user(1, 1, "trial")
+        db.set_user_tz(u.id, "America/New_York")
+        for i in range(3):
+            db.add_food_entry(u.id, f"{_day(i)}T12:00:00", "еда", None, "{}", 2000, 2000, 2000, 0.7, 0.1, 0.1)
+        # 03:00 UTC 3-го — в Нью-Йорке ещё 2-е: последний завершённый день — 1-е, пропущенная ночь догоняется
+        asyncio.run(fold_intake(db, "UTC", now_utc=datetime.fromisoformat(_day(3) + "T03:00:00")))
+        st = load_state(db, u.id)
+        assert (st.intake_n, st.intake_day) == (2, _day(1))
+        db.close()
+
+
+def test_same_day_reweigh_is_not_a_new_weighin():
+    st = add_weight(TdeeState(user_id=1), _day(0), 80)
+    st = add_weight(st, _day(0), 79.6)
+    assert st.weight_n == 1
+    assert add_weight(st, _day(1), 79.8).weight_n == 2